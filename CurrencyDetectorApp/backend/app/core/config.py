@@ -1,5 +1,6 @@
+import os
+from functools import lru_cache
 from pathlib import Path
-import torch
 
 # === BASE PATHS ===
 
@@ -11,7 +12,14 @@ MODELS_DIR = APP_DIR / "models"
 
 # === DEVICE ===
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# Resolved on first use, not on import: importing torch alone takes seconds, and
+# /health has to answer before that. DEVICE is still available as an attribute
+# (module __getattr__ below) for scripts; services call get_device() at load time.
+@lru_cache(maxsize=1)
+def get_device() -> str:
+    import torch
+
+    return "cuda" if torch.cuda.is_available() else "cpu"
 
 # === MODEL PATHS (YOLO .pt) ===
 
@@ -20,10 +28,27 @@ BINARY_MODEL = MODELS_DIR / "binary_model.pt"
 BANKNOTE_MODEL = MODELS_DIR / "banknote_model.pt"
 COIN_MODEL = MODELS_DIR / "coin_model.pt"
 
-# Early validation.
-for model_path in (BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL):
-    if not model_path.exists():
-        raise FileNotFoundError(f"Model not found: {model_path}")
+# === MODEL BACKEND ===
+
+# "pt" runs the .pt files with ultralytics, "onnx" runs the .onnx files next to
+# them (same name, .onnx suffix) with ONNX Runtime on CPU.
+MODEL_BACKEND = "pt"
+ONNX_THREADS = 0  # 0 = let ONNX Runtime decide
+
+# "fp32" (default), "fp16" / "bf16" with the pt backend, "int8" with the onnx
+# backend (<name>.int8.onnx, see tests/quantization_report.py).
+MODEL_PRECISION = "fp32"
+
+
+# Called from the startup path (main.startup_event) instead of on import, so that
+# importing the config (tests, tools, worker processes) never fails or blocks.
+def validate_model_files() -> None:
+    for model_path in (BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL):
+        if MODEL_BACKEND == "onnx":
+            suffix = ".int8.onnx" if MODEL_PRECISION == "int8" else ".onnx"
+            model_path = model_path.with_suffix(suffix)
+        if not model_path.exists():
+            raise FileNotFoundError(f"Model not found: {model_path}")
 
 # === CONFIDENCE THRESHOLDS ===
 
@@ -34,10 +59,188 @@ COIN_CONFIDENCE = 0.45
 # === IMAGE & PIPELINE SETTINGS ===
 
 IMAGE_SIZE = 640
+
+# Multi-resolution cascade: the binary gate only decides "coin vs note, and where",
+# so it runs at a lower resolution. The banknote/coin stage picks the smallest of
+# SPECIFIC_IMAGE_SIZES at which the objects found by the gate still span at least
+# SPECIFIC_MIN_OBJECT_SIZE pixels (IMAGE_SIZE is the upper bound). The models were
+# trained at 640 with scale=0.5 augmentation; in the training labels the smallest
+# object of an image spans >= 192 px (banknote, 25th percentile) and >= 231 px
+# (coin, 5th percentile) at 640, so 160 px stays inside what they have seen. With
+# 256, 72-74% of those full frames fell back to 640; with 160, 29% of banknote
+# and no coin frames do.
+BINARY_IMAGE_SIZE = 320
+SPECIFIC_IMAGE_SIZES = (320, 416, 512, IMAGE_SIZE)
+SPECIFIC_MIN_OBJECT_SIZE = 160
+
 MAX_IMAGE_SIZE = 10 * 1024 * 1024  # 10MB
 
+# Uploads are read in chunks and rejected as soon as MAX_IMAGE_SIZE is crossed.
+# Requests whose Content-Length is above MAX_IMAGE_SIZE + UPLOAD_OVERHEAD (room for
+# multipart headers) are rejected before the body is read at all; chunked requests
+# without Content-Length are cut off as soon as the received body crosses that size.
+UPLOAD_CHUNK_SIZE = 256 * 1024
+UPLOAD_OVERHEAD = 64 * 1024
+
+# Content types accepted by /detect/raw (the image is the whole request body)
+RAW_CONTENT_TYPES = ("image/jpeg", "image/png", "application/octet-stream")
+
 ALLOWED_EXTENSIONS = {".jpg", ".jpeg", ".png"}
 
 USE_PREPROCESSING = True
+# "quality", "fast" or "off" (see services/preprocess.py and tests/benchmark_preprocess.py)
+PREPROCESS_PROFILE = "quality"
 USE_ENSEMBLE = True
+# Minimum binary/specific box IoU for weighted box fusion
+ENSEMBLE_IOU_THRESHOLD = 0.3
+
+# === ROI CASCADE ===
+
+# The banknote/coin model runs on padded crops of the binary boxes instead of the
+# whole frame, at the resolution picked by the policy above. Falls back to the
+# whole frame when there are too many boxes or the boxes already cover most of it.
+USE_ROI_CASCADE = True
+ROI_PADDING = 10  # same padding as extract_single_currency
+ROI_MAX_REGIONS = 4
+ROI_MAX_AREA_RATIO = 0.5
+
+
+# === MICRO-BATCHING ===
+
+# Concurrent /detect requests that arrive within the window are run as one batch.
+USE_MICRO_BATCHING = True
+BATCH_WINDOW_MS = 10
+MAX_BATCH_SIZE = 8
+
+# === INFERENCE QUEUE ===
+
+# Models run on a dedicated executor; once MAX_QUEUE_SIZE requests are waiting,
+# new ones are rejected with 503 + Retry-After instead of queueing forever.
+INFERENCE_WORKERS = 1
+MAX_QUEUE_SIZE = 32
+RETRY_AFTER_SECONDS = 1
+
+# === WORKER PROCESSES ===
+
+# "thread" runs the models in this process, "process" starts a pool of worker
+# processes, each with its own CurrencyDetector. Frames go through shared memory.
+INFERENCE_MODE = "thread"
+NUM_PROCESS_WORKERS = max(1, os.cpu_count() or 1)
+SHM_SLOT_BYTES = 64 * 1024 * 1024  # per worker
+WORKER_START_TIMEOUT = 300  # seconds, includes the warmup (see WARMUP)
+# A worker that dies or does not answer a request within this many seconds is
+# terminated, its shared memory released and a new one started in the background.
+WORKER_RESPONSE_TIMEOUT = 60
+
+# === WARMUP ===
+
+# init_detector runs WARMUP_PASSES passes through every model at the production
+# input shapes (BINARY_IMAGE_SIZE for the binary model, SPECIFIC_IMAGE_SIZES for
+# the banknote/coin models, batch 1 and MAX_BATCH_SIZE with micro-batching), then
+# one full cascade. 0 disables warmup. Input buffers (letterbox canvases of every
+# backend, ONNX input tensors) come from a shared pool that keeps up to
+# BUFFER_POOL_MAX_FREE free arrays per shape, so requests after warmup do not
+# allocate them again. A full micro-batch holds one canvas per image and stage.
+WARMUP_PASSES = 2
+BUFFER_POOL_MAX_FREE = 2 * MAX_BATCH_SIZE
+
+# === RESULT CACHE ===
+
+# /detect responses are cached by a hash of the uploaded bytes ("exact") or by a
+# perceptual hash of the decoded image ("perceptual", also matches re-encoded
+# and resized copies of the same photo: a dHash within PERCEPTUAL_MAX_DISTANCE
+# bits, the same aspect ratio and a PERCEPTUAL_THUMB_SIZE grayscale thumbnail within
+# PERCEPTUAL_MAX_DIFF mean absolute difference, 0-255). LRU + TTL eviction, capped
+# by entries and bytes. Perceptual mode is opt-in: it can still return the cached
+# result of a different but near-identical photo (e.g. another note of the same
+# design, shot in the same pose and light), so keep "exact" unless uploads repeat
+# as re-encoded copies. Re-encoded/resized copies of the test images measure below
+# 0.3 thumbnail difference, a differently coloured note in the same pose above 11.
+USE_RESULT_CACHE = True
+CACHE_KEY_MODE = "exact"
+CACHE_MAX_ENTRIES = 256
+CACHE_MAX_BYTES = 32 * 1024 * 1024
+CACHE_TTL_SECONDS = 300
+PERCEPTUAL_MAX_DISTANCE = 5
+PERCEPTUAL_THUMB_SIZE = 32
+PERCEPTUAL_MAX_DIFF = 4.0
+# Directory for a file-backed tier shared by all workers/processes (None = off)
+CACHE_SHARED_DIR = None
+CACHE_SHARED_MAX_ENTRIES = 4096
+
+# === LIVE STREAM TRACKING ===
+
+# On /ws/detect the full cascade runs on keyframes only; in between, boxes are
+# carried forward with sparse optical flow (on a TRACK_WIDTH-wide grayscale copy).
+# A new keyframe is forced after TRACK_KEYFRAME_INTERVAL frames, when fewer than
+# TRACK_MIN_POINTS_RATIO of a track's points survive, or when the mean absolute
+# difference (0-255) outside the tracked boxes exceeds TRACK_MAX_BACKGROUND_CHANGE.
+# Tracks detected with a confidence below TRACK_MIN_CONFIDENCE are not carried
+# forward, and a keyframe also runs when the median forward-backward error of a
+# track's points (pixels on the tracking copy) rises above TRACK_MAX_FB_ERROR.
+USE_STREAM_TRACKING = True
+TRACK_KEYFRAME_INTERVAL = 15
+TRACK_MIN_POINTS_RATIO = 0.5
+TRACK_MAX_BACKGROUND_CHANGE = 12.0
+TRACK_MIN_CONFIDENCE = 0.6
+TRACK_MAX_FB_ERROR = 0.5
+TRACK_WIDTH = 320
+
+# === SCENE-CHANGE GATE ===
+
+# Before the models run, each frame is shrunk to a SCENE_GATE_SIZE x SCENE_GATE_SIZE
+# grayscale thumbnail and compared with the last frame that went through the
+# models (per session). Below SCENE_GATE_THRESHOLD mean absolute difference (0-255)
+# the previous result is returned, at most SCENE_GATE_MAX_REUSE times in a row.
+# Used on /ws/detect and on /detect when the client sends a session_id.
+USE_SCENE_GATE = True
+SCENE_GATE_SIZE = 32
+SCENE_GATE_THRESHOLD = 4.0
+SCENE_GATE_MAX_REUSE = 30
+SCENE_GATE_MAX_SESSIONS = 256
+
+# === IMAGE DECODE ===
+
+# Uploads are decoded straight to BGR. JPEGs are decoded at 1/2, 1/4 or 1/8 size
+# (the largest reduction that keeps the long side >= DECODE_MAX_SIDE); other
+# formats are resized by the same factor. Boxes are scaled back to the uploaded
+# image. Images above MAX_IMAGE_PIXELS are rejected before any pixels are decoded.
+DECODE_MAX_SIDE = 1280
+MAX_IMAGE_PIXELS = 50_000_000
+
+# === CROPS ===
+
+# /detect returns crop links (/crops/{image_id}/{crop_id}) by default. Crops are
+# extracted and encoded only when requested, from a short-lived per-request store.
+# ?crops=inline keeps the old base64-in-JSON behaviour. Coin crops have alpha,
+# so they are sent as PNG when JPEG is requested.
+CROP_FORMAT = "webp"
+CROP_QUALITY = 80
+CROP_TTL_SECONDS = 120
+CROP_STORE_MAX_REQUESTS = 64
+CROP_STORE_MAX_BYTES = 256 * 1024 * 1024
+# The store is per process: with several uvicorn workers a crop link can reach a
+# worker that did not handle the /detect request. Set CROP_SHARED_DIR (ideally on
+# tmpfs, e.g. /dev/shm/crops) so every worker finds it there; without it crops=url
+# needs a single worker or sticky routing.
+CROP_SHARED_DIR = None
+CROP_SHARED_MAX_REQUESTS = 256
+
+# Summary grid of all crops of a request, as one JPEG (GET /crops/{image_id}/grid)
+GRID_COLUMNS = 3
+GRID_CELL_SIZE = 300
+GRID_QUALITY = 85
+
+# === RESPONSE WIRE FORMAT ===
+
+# /detect responses of at least COMPRESS_MIN_BYTES are gzip-compressed when the
+# client sends Accept-Encoding: gzip (see services/serialization.py).
+COMPRESS_MIN_BYTES = 1024
+COMPRESS_LEVEL = 5
+
 
+# Lazy module attributes: `from core.config import DEVICE` resolves the device only then
+def __getattr__(name):
+    if name == "DEVICE":
+        return get_device()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -1,26 +1,64 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 
-import cv2
+import asyncio
 import numpy as np
-from PIL import Image
-import io
 import base64
+import time
 import uvicorn
+from typing import AsyncIterator, Callable, Optional, Tuple
 
 from core.config import (
     BINARY_MODEL,
     BANKNOTE_MODEL,
     COIN_MODEL,
-    DEVICE,
     USE_PREPROCESSING,
     USE_ENSEMBLE,
     MAX_IMAGE_SIZE,
+    UPLOAD_CHUNK_SIZE,
+    UPLOAD_OVERHEAD,
+    RAW_CONTENT_TYPES,
+    CROP_FORMAT,
+    CROP_QUALITY,
+    GRID_COLUMNS,
+    GRID_QUALITY,
+    USE_MICRO_BATCHING,
+    RETRY_AFTER_SECONDS,
+    INFERENCE_MODE,
+    INFERENCE_WORKERS,
+    MODEL_BACKEND,
+    USE_RESULT_CACHE,
+    CACHE_KEY_MODE,
+    USE_STREAM_TRACKING,
+    USE_SCENE_GATE,
+    get_device,
+    validate_model_files,
 )
 
-from services.inference import init_detector, detect_currency
-from services.extraction import extract_single_currency
+from services.inference import init_detector, detect_currency, detect_currency_batch, detect_currency_all
+from services.batching import MicroBatcher
+from services.buffers import buffer_pool
+from services.executor import InferenceExecutor, QueueFullError
+from services.worker_pool import WorkerLostError, WorkerPool
+from services.cache import PerceptualIndex, ResultCache, content_key
+from services.stream import LatestFrameSlot, compact_result
+from services.tracking import FrameTracker
+from services.scene_gate import SceneGate, SceneGateRegistry
+from services.extraction import extract_batch
+from services.decode import decode_image, ImageTooLargeError
+from services.crops import CropStore, encode_crop, negotiate_format
+from services.serialization import (
+    compact_payload,
+    compress,
+    deserialize,
+    expand_payload,
+    media_type_for,
+    negotiate_wire_format,
+    rescale_boxes,
+    serialize,
+)
 from core.logging import get_logger
 
 logger = get_logger(__name__)
@@ -39,12 +77,58 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Се поставуваат при startup, според INFERENCE_MODE
+inference_executor: Optional[InferenceExecutor] = None
+batcher: Optional[MicroBatcher] = None
+worker_pool: Optional[WorkerPool] = None
+result_cache: Optional[ResultCache] = ResultCache() if USE_RESULT_CACHE else None
+perceptual_index = PerceptualIndex() if CACHE_KEY_MODE == "perceptual" else None
+scene_gates: Optional[SceneGateRegistry] = SceneGateRegistry() if USE_SCENE_GATE else None
+crop_store = CropStore()
+run_single: Callable[[np.ndarray], dict] = detect_currency
+run_all: Callable[[np.ndarray], dict] = detect_currency_all
+
+# mode=single: една валута (најсигурната), mode=all: сите банкноти и монети во сликата
+DETECT_MODES = ("single", "all")
+CROP_MODES = ("url", "inline", "none")
+
+# Фази при стартување: liveness (/health) одговара веднаш, а readiness (/ready)
+# дури кога моделите се вчитани и загреани ("ready")
+# starting -> loading -> warming_up -> ready (или failed)
+startup_stage = "starting"
+startup_error: Optional[str] = None
+startup_seconds: Optional[float] = None
+active_device: Optional[str] = None
+startup_task: Optional[asyncio.Task] = None
+
+
+# Барање за детекција пред моделите да се вчитани (или ако вчитувањето не успеало)
+class NotReadyError(Exception):
+    pass
+
 
 # =========================
 # STARTUP
 # =========================
+# Стартувањето не чека на моделите: проверката на фајловите е брза (и ако падне,
+# процесот се стопира како порано), а torch/ultralytics, вчитувањето и загревањето
+# одат во позадина, додека /health веќе одговара
 @app.on_event("startup")
 async def startup_event():
+    global startup_stage, startup_task
+
+    validate_model_files()
+
+    startup_stage = "loading"
+    startup_task = asyncio.create_task(load_models())
+
+
+async def load_models():
+    global inference_executor, batcher, worker_pool, run_single, run_all
+    global startup_stage, startup_error, startup_seconds, active_device
+
+    started_at = time.perf_counter()
+
     try:
         model_paths = {
             "binary": BINARY_MODEL,
@@ -52,18 +136,153 @@ async def startup_event():
             "coin": COIN_MODEL,
         }
 
-        init_detector(model_paths, device=DEVICE)
+        if INFERENCE_MODE == "process":
+            worker_pool = WorkerPool(model_paths)
+            await run_in_threadpool(worker_pool.start)
+            run_single, run_batch = worker_pool.detect, worker_pool.detect_batch
+            run_all = worker_pool.detect_all
+            workers = worker_pool.num_workers
+            active_device = (
+                await run_in_threadpool(get_device) if MODEL_BACKEND == "pt" else "cpu"
+            )
+        else:
+            detector = await run_in_threadpool(init_detector, model_paths)
+            run_single, run_batch = detect_currency, detect_currency_batch
+            run_all = detect_currency_all
+            workers = INFERENCE_WORKERS
+            active_device = detector.device
+
+        inference_executor = InferenceExecutor(max_workers=workers)
+
+        if USE_MICRO_BATCHING:
+            batcher = MicroBatcher(
+                run_batch, executor=inference_executor, concurrency=workers
+            )
+            batcher.start()
+
+        startup_stage = "warming_up"
+        await warmup()
+
+        startup_seconds = time.perf_counter() - started_at
+        startup_stage = "ready"
 
         logger.info("=" * 50)
         logger.info("MKD Currency Detector API Started")
-        logger.info(f"Device: {DEVICE}")
+        logger.info(f"Device: {active_device}")
+        logger.info(f"Inference mode: {INFERENCE_MODE} ({workers} workers)")
         logger.info(f"Preprocessing: {USE_PREPROCESSING}")
         logger.info(f"Ensemble voting: {USE_ENSEMBLE}")
+        logger.info(f"Micro-batching: {USE_MICRO_BATCHING}")
+        logger.info(f"Result cache: {CACHE_KEY_MODE if result_cache is not None else False}")
+        logger.info(f"Ready after {startup_seconds:.1f}s")
         logger.info("=" * 50)
 
     except Exception as e:
+        startup_error = str(e)
+        startup_stage = "failed"
         logger.error(f"Failed to initialize detector: {e}")
-        raise
+
+
+# Моделите се веќе загреани во init_detector (или во секој работнички процес),
+# ова е уште едно поминување низ патеката на барањето (executor нишката, micro-batcher-от)
+async def warmup():
+    blank = np.full((640, 640, 3), 128, dtype=np.uint8)
+
+    start = time.perf_counter()
+    if batcher is not None:
+        await batcher.submit(blank)
+    else:
+        await inference_executor.run(run_single, blank)
+    logger.info(f"Warmup request path: {(time.perf_counter() - start) * 1000:.0f}ms")
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    if startup_task is not None and not startup_task.done():
+        startup_task.cancel()
+    if batcher is not None:
+        await batcher.stop()
+    if inference_executor is not None:
+        inference_executor.shutdown()
+    if worker_pool is not None:
+        worker_pool.stop()
+
+
+# Барањата со Content-Length над лимитот се одбиваат пред телото да се прочита
+# (за /detect пред multipart парсирањето), UPLOAD_OVERHEAD е за multipart заглавјата
+# Chunked барањата немаат Content-Length, па receive се обвиткува и бајтите се бројат
+# додека телото пристигнува, пред UploadFile да го спакува на диск
+class UploadLimitMiddleware:
+    def __init__(self, app, paths: Tuple[str, ...], limit: int):
+        self.app = app
+        self.paths = paths
+        self.limit = limit
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        length = headers.get(b"content-length", b"").decode("latin-1")
+        if length.isdigit() and int(length) > self.limit:
+            error = image_too_large()
+            response = JSONResponse(status_code=error.status_code, content={"detail": error.detail})
+            await response(scope, receive, send)
+            return
+
+        received = 0
+
+        async def limited_receive():
+            nonlocal received
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.limit:
+                    raise image_too_large()
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+app.add_middleware(
+    UploadLimitMiddleware,
+    paths=("/detect", "/detect/raw"),
+    limit=MAX_IMAGE_SIZE + UPLOAD_OVERHEAD,
+)
+
+
+# Изгубен работнички процес (и нема друг слободен) е привремено, исто како полна редица
+@app.exception_handler(WorkerLostError)
+@app.exception_handler(QueueFullError)
+async def queue_full_handler(request: Request, exc: Exception):
+    logger.warning(f"Rejecting {request.url.path}: {exc}")
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        content={
+            "success": False,
+            "error": "Server busy, retry later",
+            "detections": [],
+            "count": 0,
+            "tts_audio": None,
+        },
+    )
+
+
+@app.exception_handler(NotReadyError)
+async def not_ready_handler(request: Request, exc: NotReadyError):
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(RETRY_AFTER_SECONDS)},
+        content={
+            "success": False,
+            "error": str(exc),
+            "detections": [],
+            "count": 0,
+            "tts_audio": None,
+        },
+    )
 
 
 # =========================
@@ -99,6 +318,176 @@ def mk_detection_message(detections: list) -> str:
         return f"Детектирана валута {value}"
 
 
+# Порака за мешана сцена (mode=all): број на објекти и вкупна вредност
+def mk_total_message(detections: list, total_value: int) -> str:
+    if not detections:
+        return "Не е детектирана валута."
+
+    notes = sum(1 for d in detections if d["class_name"].endswith("note"))
+    coins = sum(1 for d in detections if d["class_name"].endswith("coin"))
+    return f"Детектирани {notes} банкноти и {coins} монети, вкупно {total_value} денари"
+
+
+# Box-овите се враќаат во координати на оригиналната (прикачена) слика,
+# а исечоците се од декодираната слика
+# Исечоците: "url" - само линк (/crops/...), се прават дури кога ќе се побараат (CropStore),
+# "inline" - base64 во JSON-от (crop_format / crop_quality), "none" - без исечоци
+def format_detections(image: np.ndarray, result: dict, crops: str, scale: float = 1.0,
+                      image_id: Optional[str] = None, crop_format: str = CROP_FORMAT,
+                      crop_quality: int = CROP_QUALITY) -> list:
+    detected_type = result.get("type")
+    detections_formatted = []
+    regions = []
+
+    for i, det in enumerate(result.get("detections", [])):
+        data = {
+            "id": i,
+            "class_name": det["class_name"],
+            "confidence": det.get("ensemble_confidence", det["confidence"]),
+            "bbox": [v / scale for v in det["bbox"]],
+        }
+        if "type" in det:
+            data["type"] = det["type"]
+
+        regions.append((det["bbox"], det.get("type", detected_type)))
+        if crops == "url":
+            data["image_url"] = f"/crops/{image_id}/{i}"
+
+        detections_formatted.append(data)
+
+    if crops == "url" and regions:
+        crop_store.put(image_id, image, regions, detections_formatted)
+    elif crops == "inline" and regions:
+        # Сите исечоци од барањето во еден повик (extract_batch)
+        try:
+            extracted = extract_batch(image, regions)
+        except Exception:
+            extracted = [None] * len(regions)
+
+        for data, crop in zip(detections_formatted, extracted):
+            try:
+                buffer, media_type = encode_crop(crop, crop_format, crop_quality)
+                data["image"] = (
+                        f"data:{media_type};base64,"
+                        + base64.b64encode(buffer).decode()
+                )
+            except Exception:
+                data["image"] = None
+
+    return detections_formatted
+
+
+# Записот во CropStore за кеширан одговор: box-овите од одговорот (оригинални координати)
+# се враќаат во координати на декодираната слика
+def restore_crops(image_id: str, image: np.ndarray, scale: float, body: bytes,
+                  wire_format: str) -> None:
+    payload = expand_payload(deserialize(body, wire_format))
+    detections = payload.get("detections", [])
+    regions = [
+        ([v * scale for v in det["bbox"]], det.get("type", payload.get("type")))
+        for det in detections
+    ]
+    if regions:
+        crop_store.put(image_id, image, regions, detections)
+
+
+# Кешот е во меморија, а заедничкиот слој (ако постои) е на диск, па тогаш оди во threadpool
+async def cache_get(key: str) -> Optional[bytes]:
+    if result_cache.shared_dir is None:
+        return result_cache.get(key)
+    return await run_in_threadpool(result_cache.get, key)
+
+
+async def cache_put(key: str, body: bytes) -> None:
+    if result_cache.shared_dir is None:
+        result_cache.put(key, body)
+    else:
+        await run_in_threadpool(result_cache.put, key, body)
+
+
+# Одговор од веќе серијализирано тело (JSON или MessagePack), со gzip за поголемите
+def wire_response(request: Request, body: bytes, wire_format: str,
+                  cache_hit: bool = False) -> Response:
+    body, encoding = compress(body, request.headers.get("accept-encoding"))
+
+    headers = {"Vary": "Accept, Accept-Encoding"}
+    if encoding is not None:
+        headers["Content-Encoding"] = encoding
+    if cache_hit:
+        headers["X-Cache"] = "HIT"
+
+    return Response(content=body, media_type=media_type_for(wire_format), headers=headers)
+
+
+def check_mode(mode: str) -> None:
+    if mode not in DETECT_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown mode '{mode}', expected one of {', '.join(DETECT_MODES)}",
+        )
+
+
+# Начин на враќање на исечоците; extract_images=false значи без исечоци (како порано)
+def check_crops(extract_images: bool, crops: str, crop_format: Optional[str]) -> Tuple[str, str]:
+    if crops not in CROP_MODES:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unknown crops '{crops}', expected one of {', '.join(CROP_MODES)}",
+        )
+    try:
+        fmt = negotiate_format(None, crop_format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    return (crops if extract_images else "none"), fmt
+
+
+def image_too_large() -> HTTPException:
+    return HTTPException(
+        status_code=400,
+        detail=f"Image too large. Max size {MAX_IMAGE_SIZE / (1024 * 1024):.1f}MB",
+    )
+
+
+async def upload_chunks(file: UploadFile) -> AsyncIterator[bytes]:
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        yield chunk
+
+
+# Телото се чита во делови и читањето се прекинува штом ќе се помине лимитот,
+# наместо прво целото да се прочита во меморија па дури тогаш да се провери
+async def read_limited(chunks: AsyncIterator[bytes], limit: int) -> bytes:
+    parts = []
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            raise image_too_large()
+        parts.append(chunk)
+    return b"".join(parts)
+
+
+async def run_detection(image: np.ndarray, mode: str = "single") -> dict:
+    if startup_stage != "ready":
+        raise NotReadyError(f"Models not ready (stage: {startup_stage})")
+
+    if mode == "all":
+        if inference_executor is None:
+            raise RuntimeError("Detector not initialized. Call init_detector() first.")
+        return await inference_executor.run(run_all, image)
+
+    if batcher is not None and batcher.running:
+        return await batcher.submit(image)
+
+    if inference_executor is None:
+        raise RuntimeError("Detector not initialized. Call init_detector() first.")
+
+    return await inference_executor.run(run_single, image)
+
+
 # =========================
 # ROUTES
 # =========================
@@ -110,42 +499,158 @@ async def root():
         "status": "running",
         "endpoints": {
             "health": "/health",
-            "detect": "/detect (POST)",
+            "ready": "/ready",
+            "detect": "/detect (POST, ?mode=single|all)",
+            "detect_raw": "/detect/raw (POST, image body)",
+            "crops": "/crops/{image_id}/{crop_id} (GET, ?format=webp|jpeg|png)",
+            "crop_grid": "/crops/{image_id}/grid (GET, JPEG)",
+            "stream": "/ws/detect (WebSocket, JPEG frames)",
         },
     }
 
 
+# Liveness: одговара веднаш по стартување, и додека моделите сеуште се вчитуваат
+# Ако вчитувањето или загревањето не успеало, враќа 503, за orchestrator-от да го рестартира процесот
 @app.get("/health")
 async def health_check():
+    if startup_stage == "failed":
+        return JSONResponse(
+            status_code=503,
+            content={"status": "unhealthy", "stage": startup_stage, "error": startup_error},
+        )
+
     return {
         "status": "healthy",
-        "device": DEVICE,
+        "stage": startup_stage,
+        "device": active_device,
         "preprocessing": USE_PREPROCESSING,
         "ensemble": USE_ENSEMBLE,
+        "inference_mode": INFERENCE_MODE,
+        "queue": inference_executor.stats() if inference_executor is not None else None,
+        "batching": batcher.stats() if batcher is not None else None,
+        "workers": worker_pool.stats() if worker_pool is not None else None,
+        "cache": result_cache.stats() if result_cache is not None else None,
+        "scene_gate": scene_gates.stats() if scene_gates is not None else None,
+        "crops": crop_store.stats(),
+        "buffers": buffer_pool.stats(),
+    }
+
+
+# Readiness: 200 дури кога моделите се вчитани и загреани, дотогаш 503
+@app.get("/ready")
+async def readiness_check():
+    body = {
+        "ready": startup_stage == "ready",
+        "stage": startup_stage,
+        "startup_seconds": startup_seconds,
+        "error": startup_error,
     }
+    return JSONResponse(status_code=200 if body["ready"] else 503, content=body)
 
 
+# compact=true: кратки клучеви, box-ови во цели пиксели, без null полиња
+# Accept: application/msgpack враќа MessagePack наместо JSON
 @app.post("/detect")
-async def detect(file: UploadFile = File(...), extract_images: bool = True):
-    try:
-        contents = await file.read()
+async def detect(request: Request, file: UploadFile = File(...), extract_images: bool = True,
+                 session_id: Optional[str] = None, mode: str = "single",
+                 crops: str = "url", crop_format: Optional[str] = None,
+                 crop_quality: int = CROP_QUALITY, compact: bool = False):
+    check_mode(mode)
+    crops, crop_format = check_crops(extract_images, crops, crop_format)
+    contents = await read_limited(upload_chunks(file), MAX_IMAGE_SIZE)
+    return await detect_contents(
+        request, contents, crops, session_id, mode, crop_format, crop_quality, compact
+    )
+
+
+# Истото како /detect, но сликата е цело тело на барањето (без multipart),
+# со Content-Type image/jpeg, image/png или application/octet-stream
+@app.post("/detect/raw")
+async def detect_raw(request: Request, extract_images: bool = True,
+                     session_id: Optional[str] = None, mode: str = "single",
+                     crops: str = "url", crop_format: Optional[str] = None,
+                     crop_quality: int = CROP_QUALITY, compact: bool = False):
+    check_mode(mode)
+    crops, crop_format = check_crops(extract_images, crops, crop_format)
+
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type not in RAW_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=415,
+            detail=f"Unsupported Content-Type, expected one of {', '.join(RAW_CONTENT_TYPES)}",
+        )
 
-        if len(contents) > MAX_IMAGE_SIZE:
-            raise HTTPException(
-                status_code=400,
-                detail=f"Image too large. Max size {MAX_IMAGE_SIZE / (1024 * 1024):.1f}MB",
-            )
+    contents = await read_limited(request.stream(), MAX_IMAGE_SIZE)
+    if not contents:
+        raise HTTPException(status_code=400, detail="Empty request body")
+
+    return await detect_contents(
+        request, contents, crops, session_id, mode, crop_format, crop_quality, compact
+    )
+
+
+# Сликата се идентификува со хашот на бајтите (или перцептивниот хаш), а истиот id
+# се користи и за кешот и за линковите до исечоците
+# Кеширан одговор со линкови без исечоци во CropStore (од друг worker) ги враќа исечоците
+# од декодираната слика
+async def detect_contents(request: Request, contents: bytes, crops: str,
+                          session_id: Optional[str], mode: str,
+                          crop_format: str = CROP_FORMAT, crop_quality: int = CROP_QUALITY,
+                          compact: bool = False):
+    try:
+        wire_format = negotiate_wire_format(request.headers.get("accept"))
+        variant = f"{crops}:{crop_format}:{crop_quality}:{mode}:{wire_format}:{int(compact)}"
+        image_id = content_key(contents)
+
+        # Истата слика (повторно испратена) не оди пак низ моделите
+        cache_key = None
+        cached = None
+        if result_cache is not None and CACHE_KEY_MODE == "exact":
+            cache_key = f"{image_id}:{variant}"
+            cached = await cache_get(cache_key)
+            if cached is not None and (crops != "url" or crop_store.contains(image_id)):
+                return wire_response(request, cached, wire_format, cache_hit=True)
 
         try:
-            pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
-            image = cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
-        except Exception:
+            image, scale = await run_in_threadpool(decode_image, contents)
+        except ImageTooLargeError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            # Деталите (грешката од PIL/OpenCV) остануваат во логот, не се враќаат на клиентот
+            logger.warning(f"Image decode failed: {e}")
             raise HTTPException(status_code=400, detail="Invalid image file")
 
-        result = detect_currency(image)
+        # Перцептивно: иста фотографија повторно енкодирана или со друга резолуција
+        # (box-овите од кешот се скалираат на оваа резолуција)
+        if result_cache is not None and perceptual_index is not None:
+            original_size = (round(image.shape[1] / scale), round(image.shape[0] / scale))
+            image_id, factor = await run_in_threadpool(perceptual_index.match, image, original_size)
+            cache_key = f"{image_id}:{variant}"
+            cached = await cache_get(cache_key)
+            if cached is not None and factor != 1.0:
+                cached = await run_in_threadpool(rescale_boxes, cached, wire_format, factor)
+
+        # Погодок без исечоци во овој процес (одговорот го кеширал друг worker преку
+        # заедничкиот слој, или исечоците истекле): исечоците се враќаат од оваа слика,
+        # според box-овите од кешираниот одговор, без моделите
+        if cached is not None:
+            if crops == "url" and not crop_store.contains(image_id):
+                await run_in_threadpool(restore_crops, image_id, image, scale, cached, wire_format)
+            return wire_response(request, cached, wire_format, cache_hit=True)
+
+        # Клиент што праќа слики од иста сесија (камера) не ги пушта моделите
+        # ако сцената не се сменила од претходната слика
+        gate = scene_gates.get(f"{session_id}:{mode}") if scene_gates is not None and session_id else None
+        result = await run_in_threadpool(gate.check, image) if gate is not None else None
+
+        if result is None:
+            result = await run_detection(image, mode)
+            if gate is not None:
+                gate.update(result)
 
         if not result.get("success", False):
-            return JSONResponse(
+            return await finish_response(
+                request,
                 {
                     "success": False,
                     "message": result.get("message", "No currency detected"),
@@ -153,36 +658,18 @@ async def detect(file: UploadFile = File(...), extract_images: bool = True):
                     "detections": [],
                     "count": 0,
                     "tts_audio": None,
-                }
+                },
+                wire_format, compact, cache_key
             )
 
         detected_type = result.get("type")
-        detections_formatted = []
-
-        for i, det in enumerate(result.get("detections", [])):
-            data = {
-                "id": i,
-                "class_name": det["class_name"],
-                "confidence": det.get("ensemble_confidence", det["confidence"]),
-                "bbox": det["bbox"],
-            }
-
-            if extract_images:
-                try:
-                    extracted = extract_single_currency(
-                        image, det["bbox"], detected_type
-                    )
-                    _, buffer = cv2.imencode(".png", extracted)
-                    data["image"] = (
-                            "data:image/png;base64,"
-                            + base64.b64encode(buffer).decode()
-                    )
-                except Exception:
-                    data["image"] = None
-
-            detections_formatted.append(data)
+        detections_formatted = await run_in_threadpool(
+            format_detections, image, result, crops, scale, image_id, crop_format, crop_quality
+        )
         tts_text = mk_detection_message(detections_formatted)
         tts_text = mk_detection_message(detections_formatted)
+        if mode == "all":
+            tts_text = mk_total_message(detections_formatted, result.get("total_value", 0))
 
         response_payload = {
             "success": True,
@@ -191,6 +678,11 @@ async def detect(file: UploadFile = File(...), extract_images: bool = True):
             "count": len(detections_formatted),
             "tts_text": tts_text,
         }
+        if mode == "all":
+            response_payload["total_value"] = result.get("total_value", 0)
+            response_payload["counts"] = result.get("counts", {})
+        if crops == "url" and len(detections_formatted) > 1:
+            response_payload["grid_url"] = f"/crops/{image_id}/grid"
 
 
         logger.info("=== /detect RESPONSE PAYLOAD ===")
@@ -204,10 +696,10 @@ async def detect(file: UploadFile = File(...), extract_images: bool = True):
             )
         logger.info("=== END RESPONSE ===")
 
-        return JSONResponse(response_payload)
+        return await finish_response(request, response_payload, wire_format, compact, cache_key)
 
 
-    except HTTPException:
+    except (HTTPException, QueueFullError, WorkerLostError, NotReadyError):
         raise
     except Exception as e:
         logger.error(f"Unexpected error: {e}")
@@ -223,6 +715,145 @@ async def detect(file: UploadFile = File(...), extract_images: bool = True):
         )
 
 
+# Серијализација, кеширање и одговор
+async def finish_response(request: Request, payload: dict, wire_format: str, compact: bool,
+                          cache_key: Optional[str]) -> Response:
+    if compact:
+        payload = compact_payload(payload)
+
+    body, _ = serialize(payload, wire_format)
+    if cache_key is not None:
+        await cache_put(cache_key, body)
+
+    return wire_response(request, body, wire_format)
+
+
+# Сите исечоци од претходно /detect барање со натписи (класа, confidence), како една JPEG слика
+# Мора да е пред /crops/{image_id}/{crop_id}, инаку "grid" би се парсирало како crop_id
+@app.get("/crops/{image_id}/grid")
+async def get_crop_grid(image_id: str, quality: int = GRID_QUALITY, columns: int = GRID_COLUMNS):
+    grid = await run_in_threadpool(crop_store.grid, image_id, quality, columns)
+    if grid is None:
+        raise HTTPException(status_code=404, detail="Crops not found or expired")
+
+    body, media_type = grid
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={"Cache-Control": f"private, max-age={int(crop_store.ttl)}"},
+    )
+
+
+# Исечок од претходно /detect барање, се прави и енкодира дури сега
+# Форматот е од ?format= или од Accept заглавјето (WebP ако клиентот го поддржува)
+@app.get("/crops/{image_id}/{crop_id}")
+async def get_crop(request: Request, image_id: str, crop_id: int,
+                   format: Optional[str] = None, quality: int = CROP_QUALITY):
+    try:
+        fmt = negotiate_format(request.headers.get("accept"), format)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    crop = await run_in_threadpool(crop_store.get, image_id, crop_id, fmt, quality)
+    if crop is None:
+        raise HTTPException(status_code=404, detail="Crop not found or expired")
+
+    body, media_type = crop
+    return Response(
+        content=body,
+        media_type=media_type,
+        headers={"Cache-Control": f"private, max-age={int(crop_store.ttl)}"},
+    )
+
+
+# Live камера: клиентот праќа JPEG слики (binary пораки) на истиот socket,
+# а серверот секогаш ја обработува само најновата и враќа компактен JSON резултат
+# Со USE_STREAM_TRACKING моделите се пуштаат само на keyframe-ови (services/tracking.py)
+@app.websocket("/ws/detect")
+async def detect_stream(websocket: WebSocket):
+    await websocket.accept()
+    slot = LatestFrameSlot()
+    tracker = FrameTracker() if USE_STREAM_TRACKING else None
+    gate = SceneGate() if USE_SCENE_GATE else None
+
+    # Текстуални пораки не се слики: се одбиваат со грешка, а socket-от останува отворен
+    async def receive_frames():
+        try:
+            while True:
+                message = await websocket.receive()
+                if message["type"] == "websocket.disconnect":
+                    break
+                if message.get("bytes") is not None:
+                    slot.put(message["bytes"])
+                else:
+                    await websocket.send_json({
+                        "success": False, "error": "Expected binary image frames"
+                    })
+        except (WebSocketDisconnect, RuntimeError):
+            pass
+        finally:
+            slot.close()
+
+    receiver = asyncio.create_task(receive_frames())
+
+    try:
+        while True:
+            frame = await slot.get()
+            if frame is None:
+                break
+            seq, contents, received_at = frame
+
+            if len(contents) > MAX_IMAGE_SIZE:
+                await websocket.send_json({"seq": seq, "success": False, "error": "Image too large"})
+                continue
+
+            try:
+                image, scale = await run_in_threadpool(decode_image, contents)
+            except Exception:
+                await websocket.send_json({"seq": seq, "success": False, "error": "Invalid image file"})
+                continue
+
+            # Прво scene gate (најевтино), па tracker, па дури тогаш моделите
+            result = None
+            if gate is not None:
+                result = await run_in_threadpool(gate.check, image)
+            if result is None and tracker is not None:
+                result = await run_in_threadpool(tracker.step, image)
+
+            if result is None:
+                try:
+                    result = await run_detection(image)
+                except (QueueFullError, WorkerLostError):
+                    # Сликата се пропушта, следната (понова) ќе дојде наскоро
+                    await websocket.send_json({"seq": seq, "success": False, "error": "Server busy"})
+                    continue
+                except NotReadyError:
+                    await websocket.send_json({"seq": seq, "success": False, "error": "Server starting"})
+                    continue
+
+                if tracker is not None:
+                    result = await run_in_threadpool(tracker.update, image, result)
+
+            if gate is not None and not result.get("gated"):
+                gate.update(result)
+
+            await websocket.send_json(
+                compact_result(seq, result, time.perf_counter() - received_at, slot.dropped, scale)
+            )
+
+    except WebSocketDisconnect:
+        pass
+    except Exception as e:
+        logger.error(f"Stream error: {e}")
+    finally:
+        receiver.cancel()
+        logger.info(f"Stream closed: {slot.stats()}")
+        if tracker is not None:
+            logger.info(f"Stream tracking: {tracker.stats()}")
+        if gate is not None:
+            logger.info(f"Stream scene gate: {gate.stats()}")
+
+
 # =========================
 # RUN
 # =========================
@@ -0,0 +1,235 @@
+import ast
+import contextlib
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import IMAGE_SIZE, MODEL_PRECISION, ONNX_THREADS, get_device
+from core.logging import get_logger
+from services.buffers import buffer_pool
+from services.detections import Detections
+from services.preprocess import letterbox
+
+logger = get_logger(__name__)
+
+MAX_DETECTIONS = 300
+
+
+# Заеднички интерфејс за сите backend-и:
+# names -> {class_id: class_name}
+# detect(images, conf, iou, imgsz) -> по еден Detections (NumPy низи) за секоја слика
+
+# Прецизности што ги поддржува секој backend
+# fp16 е само за CUDA, bf16 е autocast (CPU со AVX512-BF16/AMX или CUDA),
+# int8 е квантизиран ONNX модел (<име>.int8.onnx)
+PRECISIONS = {
+    "pt": ("fp32", "fp16", "bf16"),
+    "onnx": ("fp32", "int8"),
+}
+
+
+# Стандардниот backend, ultralytics YOLO врз .pt фајловите
+class UltralyticsBackend:
+    def __init__(self, path: str, device: Optional[str] = None, precision: str = "fp32"):
+        from ultralytics import YOLO
+
+        device = device or get_device()
+        if precision == "fp16" and not device.startswith("cuda"):
+            raise ValueError("fp16 precision requires a CUDA device")
+
+        self.model = YOLO(str(path))
+        self.device = device
+        self.precision = precision
+        self.names: Dict[int, str] = self.model.names
+
+    def _precision_context(self):
+        if self.precision != "bf16":
+            return contextlib.nullcontext()
+
+        import torch
+
+        device_type = "cuda" if self.device.startswith("cuda") else "cpu"
+        return torch.autocast(device_type=device_type, dtype=torch.bfloat16)
+
+    def detect(self, images: List[np.ndarray], conf: float, iou: float,
+               imgsz: int = IMAGE_SIZE) -> List[Detections]:
+        options = {"half": True} if self.precision == "fp16" else {}
+
+        with self._precision_context():
+            results = self.model(
+                images,
+                conf=conf,
+                iou=iou,
+                imgsz=imgsz,
+                verbose=False,
+                **options
+            )
+
+        # Еден пренос tensor -> NumPy по слика, наместо по еден за секој box
+        return [
+            Detections.from_array(result.boxes.data.float().cpu().numpy(), self.names)
+            for result in results
+        ]
+
+
+# Класичен greedy NMS во NumPy, boxes се во xyxy формат
+def nms(boxes: np.ndarray, scores: np.ndarray, iou_threshold: float) -> np.ndarray:
+    x1, y1, x2, y2 = boxes[:, 0], boxes[:, 1], boxes[:, 2], boxes[:, 3]
+    areas = (x2 - x1) * (y2 - y1)
+    order = scores.argsort()[::-1]
+
+    keep = []
+    while order.size > 0:
+        i = order[0]
+        keep.append(i)
+
+        xx1 = np.maximum(x1[i], x1[order[1:]])
+        yy1 = np.maximum(y1[i], y1[order[1:]])
+        xx2 = np.minimum(x2[i], x2[order[1:]])
+        yy2 = np.minimum(y2[i], y2[order[1:]])
+
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        union = areas[i] + areas[order[1:]] - inter
+        iou = np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+        order = order[1:][iou <= iou_threshold]
+
+    return np.array(keep, dtype=np.int64)
+
+
+# Го декодира излезот на YOLOv8 (4 + nc, anchors) во boxes, scores, class ids
+# NMS се прави по класа, со поместување на box-овите за секоја класа
+def decode_yolo_output(output: np.ndarray, conf: float,
+                       iou: float) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    predictions = output.T
+    class_scores = predictions[:, 4:]
+
+    class_ids = class_scores.argmax(axis=1)
+    scores = class_scores[np.arange(len(class_scores)), class_ids]
+
+    mask = scores > conf
+    predictions, scores, class_ids = predictions[mask], scores[mask], class_ids[mask]
+
+    if len(scores) == 0:
+        return np.zeros((0, 4), dtype=np.float32), scores, class_ids
+
+    xy, wh = predictions[:, :2], predictions[:, 2:4]
+    boxes = np.concatenate([xy - wh / 2, xy + wh / 2], axis=1)
+
+    offsets = class_ids[:, None].astype(np.float32) * 7680.0
+    keep = nms(boxes + offsets, scores, iou)[:MAX_DETECTIONS]
+
+    return boxes[keep], scores[keep], class_ids[keep]
+
+
+# ONNX Runtime backend за CPU
+# Letterbox, декодирање на box-ови и NMS се прават во NumPy, без torch и ultralytics
+class OnnxBackend:
+    def __init__(self, path: str, device: Optional[str] = None, precision: str = "fp32"):
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if ONNX_THREADS:
+            options.intra_op_num_threads = ONNX_THREADS
+
+        self.session = ort.InferenceSession(
+            str(path),
+            sess_options=options,
+            providers=["CPUExecutionProvider"]
+        )
+        self.device = "cpu"
+        self.precision = precision
+
+        model_input = self.session.get_inputs()[0]
+        self.input_name = model_input.name
+
+        batch_dim, _, height, _ = model_input.shape
+        self.dynamic_batch = not isinstance(batch_dim, int)
+
+        metadata = self.session.get_modelmeta().custom_metadata_map
+        self.names: Dict[int, str] = ast.literal_eval(metadata["names"]) if "names" in metadata else {}
+        # Модел извезен со фиксна големина ја игнорира бараната imgsz
+        self.fixed_imgsz = height if isinstance(height, int) else None
+
+    # Влезниот тензор и letterbox платното се позајмуваат од buffer_pool (не се алоцираат по барање)
+    # Сликите од PipelineContext веќе се imgsz x imgsz, па за нив letterbox се прескокнува
+    def _prepare(self, images: List[np.ndarray], imgsz: int,
+                 blob: np.ndarray) -> List[Tuple[float, Tuple[float, float]]]:
+        transforms = []
+
+        with buffer_pool.borrow((1, imgsz, imgsz, 3), np.uint8) as canvas:
+            for i, image in enumerate(images):
+                if image.shape == (imgsz, imgsz, 3):
+                    boxed, ratio, pad = image, 1.0, (0, 0)
+                else:
+                    boxed, ratio, pad = letterbox(image, imgsz, out=canvas[0])
+                # BGR -> RGB, HWC -> CHW, [0, 255] -> [0, 1]
+                blob[i] = boxed[:, :, ::-1].transpose(2, 0, 1)
+                transforms.append((ratio, pad))
+
+        blob *= 1.0 / 255.0
+        return transforms
+
+    def _run(self, blob: np.ndarray) -> np.ndarray:
+        if self.dynamic_batch:
+            return self.session.run(None, {self.input_name: blob})[0]
+
+        # Моделот е извезен со фиксен batch = 1
+        return np.concatenate([
+            self.session.run(None, {self.input_name: blob[i:i + 1]})[0]
+            for i in range(len(blob))
+        ])
+
+    def detect(self, images: List[np.ndarray], conf: float, iou: float,
+               imgsz: int = IMAGE_SIZE) -> List[Detections]:
+        imgsz = self.fixed_imgsz or imgsz
+        with buffer_pool.borrow((len(images), 3, imgsz, imgsz), np.float32) as blob:
+            transforms = self._prepare(images, imgsz, blob)
+            outputs = self._run(blob)
+
+        batch_detections = []
+        for image, output, (ratio, (pad_x, pad_y)) in zip(images, outputs, transforms):
+            boxes, scores, class_ids = decode_yolo_output(output, conf, iou)
+
+            h, w = image.shape[:2]
+            boxes = boxes - np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)
+            boxes /= ratio
+            boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, w)
+            boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, h)
+
+            batch_detections.append(Detections(boxes, scores, class_ids, self.names))
+
+        return batch_detections
+
+
+BACKENDS = {
+    "pt": UltralyticsBackend,
+    "onnx": OnnxBackend,
+}
+
+
+# Патеката за ONNX моделот е истата како .pt, само со .onnx наставка
+# Квантизираниот INT8 модел е <име>.int8.onnx
+def resolve_model_path(path, backend: str, precision: str = "fp32") -> Path:
+    path = Path(path)
+    if backend == "onnx":
+        if precision == "int8":
+            return path.with_suffix(".int8.onnx")
+        return path.with_suffix(".onnx")
+    return path
+
+
+def load_backend(path, backend: str, device: Optional[str] = None,
+                 precision: str = MODEL_PRECISION):
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown model backend: {backend} (expected one of {list(BACKENDS)})")
+
+    if precision not in PRECISIONS[backend]:
+        raise ValueError(
+            f"Precision {precision} is not supported by the {backend} backend "
+            f"(expected one of {list(PRECISIONS[backend])})"
+        )
+
+    return BACKENDS[backend](str(resolve_model_path(path, backend, precision)), device, precision)
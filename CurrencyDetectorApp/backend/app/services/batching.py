@@ -0,0 +1,172 @@
+import asyncio
+import time
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+from core.config import BATCH_WINDOW_MS, MAX_BATCH_SIZE, MAX_QUEUE_SIZE
+from core.logging import get_logger
+from services.executor import InferenceExecutor, QueueFullError, QueueStats
+
+logger = get_logger(__name__)
+
+
+# Ги собира барањата што пристигнуваат во краток временски прозорец
+# и ги пушта како еден batch низ моделите
+# Секое барање го добива својот резултат преку сопствен future
+# Редицата е ограничена на max_queue, после тоа submit крева QueueFullError
+# Со concurrency > 1 повеќе batch-ови можат да се извршуваат истовремено (на пр. во worker pool)
+class MicroBatcher:
+    def __init__(
+            self,
+            run_batch: Callable[[List[np.ndarray]], List[Dict]],
+            window_ms: float = BATCH_WINDOW_MS,
+            max_batch_size: int = MAX_BATCH_SIZE,
+            max_queue: int = MAX_QUEUE_SIZE,
+            executor: Optional[InferenceExecutor] = None,
+            concurrency: int = 1
+    ):
+        self.run_batch = run_batch
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_queue = max(1, max_queue)
+        self.executor = executor
+        self.concurrency = max(1, concurrency)
+        self.queue_stats = QueueStats()
+
+        self.batches_run = 0
+        self.images_run = 0
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._inflight: Set[asyncio.Task] = set()
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None
+
+    def start(self) -> None:
+        if self._worker is not None:
+            return
+
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._worker = asyncio.get_running_loop().create_task(self._run())
+        logger.info(
+            f"Micro-batching started (window={self.window * 1000:.0f}ms, "
+            f"max_batch={self.max_batch_size})"
+        )
+
+    async def stop(self) -> None:
+        if self._worker is None:
+            return
+
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+
+        # Batch-овите што веќе се извршуваат ги оставаме да завршат
+        await asyncio.gather(*self._inflight, return_exceptions=True)
+
+        # Барањата што останале во редицата не смеат да чекаат засекогаш
+        while not self._queue.empty():
+            _, future, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Micro-batcher stopped"))
+
+        self._worker = None
+        self._queue = None
+
+    async def submit(self, image: np.ndarray) -> Dict:
+        if self._queue is None:
+            raise RuntimeError("Micro-batcher not started. Call start() first.")
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((image, future, time.perf_counter()))
+        except asyncio.QueueFull:
+            self.queue_stats.record_rejected()
+            raise QueueFullError("Micro-batching queue is full")
+
+        return await future
+
+    async def _collect(self) -> List[Tuple[np.ndarray, asyncio.Future, float]]:
+        loop = asyncio.get_running_loop()
+
+        batch = [await self._queue.get()]
+        deadline = loop.time() + self.window
+
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self) -> None:
+        while True:
+            # Нов batch се собира дури кога има слободен слот за извршување,
+            # така што барањата што пристигнуваат во меѓувреме формираат поголем batch
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except asyncio.CancelledError:
+                self._slots.release()
+                raise
+
+            task = asyncio.get_running_loop().create_task(self._execute(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _execute(self, batch: List[Tuple[np.ndarray, asyncio.Future, float]]) -> None:
+        try:
+            images = [image for image, _, _ in batch]
+
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_stats.record_wait(started - enqueued)
+
+            try:
+                if self.executor is not None:
+                    results = await self.executor.run(self.run_batch, images)
+                else:
+                    results = await asyncio.get_running_loop().run_in_executor(
+                        None, self.run_batch, images
+                    )
+            except Exception as e:
+                logger.error(f"Batched detection failed: {e}")
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+
+            self.batches_run += 1
+            self.images_run += len(images)
+
+            for (_, future, _), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+        finally:
+            self._slots.release()
+
+    def stats(self) -> Dict:
+        return {
+            "window_ms": self.window * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "concurrency": self.concurrency,
+            "max_queue": self.max_queue,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "batches": self.batches_run,
+            "images": self.images_run,
+            "avg_batch_size": (
+                self.images_run / self.batches_run if self.batches_run else 0.0
+            ),
+            **self.queue_stats.as_dict(),
+        }
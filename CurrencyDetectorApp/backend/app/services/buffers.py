@@ -0,0 +1,74 @@
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Sequence, Tuple
+
+import numpy as np
+
+from core.config import BUFFER_POOL_MAX_FREE
+
+
+# Пул од однапред алоцирани низи (влезни тензори за моделите, letterbox платна)
+# Низите се делат меѓу нишките: секој inference позајмува низа и ја враќа веднаш потоа,
+# па по загревањето (warmup) барањата не алоцираат нови
+# Клучот е обликот без првата (batch) димензија, а позајмената низа е view [:n]
+# од слободна низа со барем n редови
+class BufferPool:
+    def __init__(self, max_free: int = BUFFER_POOL_MAX_FREE):
+        self.max_free = max(1, max_free)
+        self._free: Dict[Tuple, List[np.ndarray]] = {}
+        self._lock = threading.Lock()
+
+        self.allocated = 0
+        self.reused = 0
+
+    @staticmethod
+    def _key(shape: Sequence[int], dtype) -> Tuple:
+        return tuple(shape[1:]), np.dtype(dtype).str
+
+    # Низа со барем shape[0] редови (може повеќе), се враќа со release
+    # За позајмици што траат подолго од еден блок (на пр. додека трае PipelineContext)
+    def acquire(self, shape: Sequence[int], dtype=np.float32) -> np.ndarray:
+        with self._lock:
+            free = self._free.get(self._key(shape, dtype), [])
+            for i, array in enumerate(free):
+                if len(array) >= shape[0]:
+                    self.reused += 1
+                    return free.pop(i)
+            self.allocated += 1
+
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array: np.ndarray) -> None:
+        with self._lock:
+            free = self._free.setdefault(self._key(array.shape, array.dtype), [])
+            if len(free) < self.max_free:
+                free.append(array)
+
+    # Содржината на позајмената низа е недефинирана (како np.empty)
+    @contextmanager
+    def borrow(self, shape: Sequence[int], dtype=np.float32) -> Iterator[np.ndarray]:
+        array = self.acquire(shape, dtype)
+        try:
+            yield array[:shape[0]]
+        finally:
+            self.release(array)
+
+    # Однапред count низи со даден облик (при warmup, по една за секоја нишка што работи inference)
+    def reserve(self, shape: Sequence[int], dtype=np.float32, count: int = 1) -> None:
+        arrays = [self.acquire(shape, dtype) for _ in range(count)]
+        for array in arrays:
+            self.release(array)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "shapes": len(self._free),
+                "free": sum(len(free) for free in self._free.values()),
+                "bytes": sum(a.nbytes for free in self._free.values() for a in free),
+                "allocated": self.allocated,
+                "reused": self.reused,
+            }
+
+
+# Заеднички пул за процесот (секој работнички процес има свој)
+buffer_pool = BufferPool()
@@ -0,0 +1,267 @@
+import hashlib
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.config import (
+    CACHE_MAX_ENTRIES,
+    CACHE_MAX_BYTES,
+    CACHE_TTL_SECONDS,
+    CACHE_SHARED_DIR,
+    CACHE_SHARED_MAX_ENTRIES,
+    PERCEPTUAL_MAX_DISTANCE,
+    PERCEPTUAL_MAX_DIFF,
+    PERCEPTUAL_THUMB_SIZE,
+)
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Резолуција на групите за сооднос на страните (4:3 -> 21, 16:9 -> 28)
+ASPECT_BUCKETS = 16
+
+
+# Клуч од суровите бајти на прикачената слика
+def content_key(contents: bytes) -> str:
+    return hashlib.blake2b(contents, digest_size=16).hexdigest()
+
+
+# dHash (64 бита) од декодираната слика
+def dhash(image: np.ndarray) -> int:
+    small = cv2.resize(image, (9, 8), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+# Група според соодносот на страните (наместо точните димензии),
+# за да се поклопат и намалени копии од истата фотографија
+def aspect_bucket(width: int, height: int) -> int:
+    return int(round(width / max(height, 1) * ASPECT_BUCKETS))
+
+
+# Сива минијатура за потврда на перцептивно совпаѓање (како кај SceneGate)
+def thumbnail(image: np.ndarray, size: int = PERCEPTUAL_THUMB_SIZE) -> np.ndarray:
+    small = cv2.resize(image, (size, size), interpolation=cv2.INTER_AREA)
+    if small.ndim == 3:
+        small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    return small
+
+
+# Индекс на перцептивни клучеви за перцептивниот кеш
+# Повторно енкодирана (JPEG) или намалена копија менува неколку бита од dHash-от, па
+# наместо точно совпаѓање се бара веќе виден хаш со ист сооднос на страните и
+# Хаминг растојание најмногу max_distance, и се враќа неговиот клуч
+# dHash не ја гледа осветленоста и бојата: друга банкнота сликана во иста поза може да
+# има ист хаш, па совпаѓањето се потврдува и со средната апсолутна разлика на
+# минијатурите (најмногу max_diff), инаку би се вратила погрешна деноминација
+# Се памети и големината на оригиналот, за box-овите од кешот да се скалираат
+# кога копијата е со друга резолуција
+class PerceptualIndex:
+    def __init__(self, max_distance: int = PERCEPTUAL_MAX_DISTANCE,
+                 max_diff: float = PERCEPTUAL_MAX_DIFF,
+                 max_entries: int = CACHE_MAX_ENTRIES):
+        self.max_distance = max_distance
+        self.max_diff = max_diff
+        self.max_entries = max(1, max_entries)
+
+        # клуч -> (хаш, (ширина, висина) на оригиналот, минијатура), по група на соодносот
+        self._buckets: Dict[int, "OrderedDict[str, Tuple[int, Tuple[int, int], np.ndarray]]"] = {}
+        self._size = 0
+        self._lock = threading.Lock()
+
+    # Враќа (клуч, фактор): фактор = ширина на оваа слика / ширина на онаа од клучот
+    # size е големината на оригиналот (box-овите во одговорот се во тие координати)
+    def match(self, image: np.ndarray, size: Tuple[int, int]) -> Tuple[str, float]:
+        value = dhash(image)
+        thumb = thumbnail(image)
+        bucket = aspect_bucket(*size)
+
+        with self._lock:
+            entries = self._buckets.setdefault(bucket, OrderedDict())
+            for key, (known, known_size, known_thumb) in entries.items():
+                if bin(known ^ value).count("1") > self.max_distance:
+                    continue
+                if cv2.absdiff(thumb, known_thumb).mean() > self.max_diff:
+                    continue
+                entries.move_to_end(key)
+                return key, size[0] / known_size[0]
+
+            # Минијатурата е дел од клучот: две различни слики со ист хаш не делат запис
+            digest = hashlib.blake2b(thumb.tobytes(), digest_size=4).hexdigest()
+            key = f"p{value:016x}-a{bucket}-t{digest}"
+            entries[key] = (value, size, thumb)
+            self._size += 1
+            self._evict()
+            return key, 1.0
+
+    # Најстариот запис од групата со најмногу записи
+    def _evict(self) -> None:
+        while self._size > self.max_entries:
+            entries = max(self._buckets.values(), key=len)
+            entries.popitem(last=False)
+            self._size -= 1
+
+
+# Кеш за готови одговори (JSON бајти), LRU + TTL, ограничен по број и по меморија
+# Со shared_dir има и втор, заеднички слој на диск за повеќе worker-и / процеси
+class ResultCache:
+    def __init__(self, max_entries: int = CACHE_MAX_ENTRIES, max_bytes: int = CACHE_MAX_BYTES,
+                 ttl_seconds: float = CACHE_TTL_SECONDS,
+                 shared_dir: Optional[str] = CACHE_SHARED_DIR,
+                 shared_max_entries: int = CACHE_SHARED_MAX_ENTRIES):
+        self.max_entries = max(1, max_entries)
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.shared_dir = Path(shared_dir) if shared_dir else None
+        self.shared_max_entries = shared_max_entries
+
+        # key -> (body, expires_at)
+        self._entries: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self._shared_writes = 0
+
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.shared_dir is not None:
+            self.shared_dir.mkdir(parents=True, exist_ok=True)
+
+    def get(self, key: str) -> Optional[bytes]:
+        now = time.monotonic()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                body, expires_at = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return body
+                self._remove(key)
+
+        shared = self._shared_get(key)
+
+        with self._lock:
+            if shared is None:
+                self.misses += 1
+                return None
+            # Записот го задржува рокот од заедничкиот слој, не добива нов TTL
+            body, remaining = shared
+            self.shared_hits += 1
+            self._store(key, body, now + remaining)
+            return body
+
+    def put(self, key: str, body: bytes) -> None:
+        if len(body) > self.max_bytes:
+            return
+
+        with self._lock:
+            self._store(key, body, time.monotonic() + self.ttl)
+
+        self._shared_put(key, body)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def _store(self, key: str, body: bytes, expires_at: float) -> None:
+        if key in self._entries:
+            self._remove(key)
+
+        self._entries[key] = (body, expires_at)
+        self._bytes += len(body)
+
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str) -> None:
+        body, _ = self._entries.pop(key)
+        self._bytes -= len(body)
+
+    # Заеднички слој: еден фајл по клуч, TTL според времето на запишување
+    # Името е хаш од клучот (клучевите имаат ':' и параметри од барањето)
+    def _shared_path(self, key: str) -> Path:
+        return self.shared_dir / f"{hashlib.blake2b(key.encode(), digest_size=16).hexdigest()}.json"
+
+    # Враќа (тело, преостанати секунди до истекување) или None
+    def _shared_get(self, key: str) -> Optional[Tuple[bytes, float]]:
+        if self.shared_dir is None:
+            return None
+
+        path = self._shared_path(key)
+        try:
+            remaining = path.stat().st_mtime + self.ttl - time.time()
+            if remaining <= 0:
+                path.unlink(missing_ok=True)
+                return None
+            return path.read_bytes(), remaining
+        except OSError:
+            return None
+
+    def _shared_put(self, key: str, body: bytes) -> None:
+        if self.shared_dir is None:
+            return
+
+        try:
+            # Атомско запишување, за друг процес никогаш да не прочита половина фајл
+            fd, tmp_path = tempfile.mkstemp(dir=self.shared_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, self._shared_path(key))
+        except OSError as e:
+            logger.warning(f"Shared cache write failed: {e}")
+            return
+
+        # Бришењето на најстарите фајлови се прави на секои 64 запишувања
+        self._shared_writes += 1
+        if self._shared_writes % 64 == 0:
+            self._shared_prune()
+
+    def _shared_prune(self) -> None:
+        files = []
+        for path in self.shared_dir.glob("*.json"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+
+        if len(files) <= self.shared_max_entries:
+            return
+
+        files.sort()
+        for _, path in files[:len(files) - self.shared_max_entries]:
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "ttl_seconds": self.ttl,
+                "shared": str(self.shared_dir) if self.shared_dir is not None else None,
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,301 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from core.config import (
+    CROP_FORMAT,
+    CROP_QUALITY,
+    CROP_STORE_MAX_REQUESTS,
+    CROP_STORE_MAX_BYTES,
+    CROP_SHARED_DIR,
+    CROP_SHARED_MAX_REQUESTS,
+    CROP_TTL_SECONDS,
+    GRID_COLUMNS,
+    GRID_CELL_SIZE,
+    GRID_QUALITY,
+)
+from services.extraction import extract_batch, create_display_grid
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+CROP_FORMATS = ("webp", "jpeg", "png")
+MEDIA_TYPES = {"webp": "image/webp", "jpeg": "image/jpeg", "png": "image/png"}
+
+
+# Формат од Accept заглавјето, ако клиентот не побарал експлицитно
+def negotiate_format(accept: Optional[str], requested: Optional[str] = None) -> str:
+    if requested:
+        requested = requested.lower().replace("jpg", "jpeg")
+        if requested not in CROP_FORMATS:
+            raise ValueError(
+                f"Unknown crop format '{requested}', expected one of {', '.join(CROP_FORMATS)}"
+            )
+        return requested
+
+    accept = (accept or "").lower()
+    if "image/webp" in accept:
+        return "webp"
+    if "image/jpeg" in accept and "image/png" not in accept:
+        return "jpeg"
+    return CROP_FORMAT
+
+
+# Енкодирање на исечок, враќа (бајти, media type)
+# Исечоците од монети имаат alpha канал (тргната позадина): WebP и PNG го задржуваат,
+# а наместо JPEG (нема alpha) тогаш се враќа PNG
+def encode_crop(crop: np.ndarray, fmt: str = CROP_FORMAT,
+                quality: int = CROP_QUALITY) -> Tuple[bytes, str]:
+    quality = min(max(int(quality), 1), 100)
+    has_alpha = crop.ndim == 3 and crop.shape[2] == 4
+
+    if fmt == "jpeg" and has_alpha:
+        fmt = "png"
+
+    if fmt == "webp":
+        params = [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif fmt == "jpeg":
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    else:
+        params = [cv2.IMWRITE_PNG_COMPRESSION, 1]
+
+    ok, buffer = cv2.imencode(f".{fmt}", crop, params)
+    if not ok:
+        raise ValueError(f"Could not encode crop as {fmt}")
+
+    return buffer.tobytes(), MEDIA_TYPES[fmt]
+
+
+# Клуч на мрежата во _Entry.encoded (исечоците имаат crop_id >= 0)
+GRID_ID = -1
+
+
+class _Entry:
+    def __init__(self, image: np.ndarray, regions: List[Tuple[List[float], str]],
+                 labels: List[Dict], expires_at: float):
+        self.image = image
+        self.regions = regions
+        self.labels = labels
+        self.expires_at = expires_at
+        self.crops: Dict[int, np.ndarray] = {}
+        self.encoded: Dict[Tuple[int, str, int], Tuple[bytes, str]] = {}
+
+
+# Краткотраен кеш по барање за исечоците од /detect
+# Одговорот враќа само URL (/crops/{image_id}/{crop_id}), а исечокот се прави
+# (extract_batch + енкодирање) дури кога клиентот ќе го побара, и се памти
+# LRU + TTL, ограничен по број на барања и по меморија (декодираните слики)
+# Со shared_dir барањето се запишува и на диск, за линкот да работи и кога
+# го опслужува друг worker (исто како заедничкиот слој на ResultCache)
+class CropStore:
+    def __init__(self, max_requests: int = CROP_STORE_MAX_REQUESTS,
+                 max_bytes: int = CROP_STORE_MAX_BYTES,
+                 ttl_seconds: float = CROP_TTL_SECONDS,
+                 shared_dir: Optional[str] = CROP_SHARED_DIR,
+                 shared_max_requests: int = CROP_SHARED_MAX_REQUESTS):
+        self.max_requests = max(1, max_requests)
+        self.max_bytes = max_bytes
+        self.ttl = ttl_seconds
+        self.shared_dir = Path(shared_dir) if shared_dir else None
+        self.shared_max_requests = shared_max_requests
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._shared_writes = 0
+
+        self.served = 0
+        self.generated = 0
+        self.expired = 0
+        self.shared_hits = 0
+
+        if self.shared_dir is not None:
+            self.shared_dir.mkdir(parents=True, exist_ok=True)
+
+    # regions: (bbox во координати на image, тип на валута) за секој исечок
+    # labels: детекциите (class_name, confidence) за натписите во мрежата
+    def put(self, image_id: str, image: np.ndarray, regions: List[Tuple[List[float], str]],
+            labels: Optional[List[Dict]] = None) -> None:
+        entry = _Entry(image, regions, labels or [], time.monotonic() + self.ttl)
+        with self._lock:
+            self._store(image_id, entry)
+
+        self._shared_put(image_id, entry)
+
+    def _store(self, image_id: str, entry: _Entry) -> None:
+        if image_id in self._entries:
+            self._remove(image_id)
+
+        self._entries[image_id] = entry
+        self._bytes += entry.image.nbytes
+
+        while len(self._entries) > self.max_requests or (
+                self._bytes > self.max_bytes and len(self._entries) > 1):
+            self._remove(next(iter(self._entries)))
+
+    def contains(self, image_id: str) -> bool:
+        return self._entry(image_id) is not None
+
+    # Енкодиран исечок или None ако барањето истекло / нема таков исечок
+    def get(self, image_id: str, crop_id: int, fmt: str = CROP_FORMAT,
+            quality: int = CROP_QUALITY) -> Optional[Tuple[bytes, str]]:
+        entry = self._entry(image_id)
+        if entry is None or not 0 <= crop_id < len(entry.regions):
+            return None
+
+        key = (crop_id, fmt, quality)
+        encoded = entry.encoded.get(key)
+        if encoded is None:
+            crop = self._crops(entry, [crop_id])[0]
+            encoded = entry.encoded[key] = encode_crop(crop, fmt, quality)
+            self.generated += 1
+
+        self.served += 1
+        return encoded
+
+    # Сите исечоци од барањето со натписи, во една JPEG слика (create_display_grid)
+    # Клиентот што прикажува резултат го презема ова наместо N посебни исечоци
+    def grid(self, image_id: str, quality: int = GRID_QUALITY,
+             columns: int = GRID_COLUMNS) -> Optional[Tuple[bytes, str]]:
+        entry = self._entry(image_id)
+        if entry is None or len(entry.labels) != len(entry.regions):
+            return None
+
+        columns = max(1, min(columns, len(entry.regions)))
+        key = (GRID_ID, f"jpeg:{columns}", quality)
+        encoded = entry.encoded.get(key)
+        if encoded is None:
+            crops = self._crops(entry, list(range(len(entry.regions))))
+            grid = create_display_grid(
+                crops, entry.labels, grid_cols=columns,
+                cell_size=(GRID_CELL_SIZE, GRID_CELL_SIZE)
+            )
+            encoded = entry.encoded[key] = encode_crop(grid, "jpeg", quality)
+            self.generated += 1
+
+        self.served += 1
+        return encoded
+
+    # Исечоците што недостасуваат се прават заедно, во еден extract_batch повик
+    def _crops(self, entry: _Entry, crop_ids: List[int]) -> List[np.ndarray]:
+        missing = [i for i in crop_ids if i not in entry.crops]
+        if missing:
+            extracted = extract_batch(entry.image, [entry.regions[i] for i in missing])
+            entry.crops.update(zip(missing, extracted))
+        return [entry.crops[i] for i in crop_ids]
+
+    def _entry(self, image_id: str) -> Optional[_Entry]:
+        with self._lock:
+            entry = self._entries.get(image_id)
+            if entry is not None:
+                if entry.expires_at > time.monotonic():
+                    self._entries.move_to_end(image_id)
+                    return entry
+                self._remove(image_id)
+                self.expired += 1
+
+        # Барањето можеби го обработил друг worker
+        entry = self._shared_get(image_id)
+        if entry is None:
+            return None
+
+        with self._lock:
+            self.shared_hits += 1
+            self._store(image_id, entry)
+        return entry
+
+    def _remove(self, image_id: str) -> None:
+        entry = self._entries.pop(image_id)
+        self._bytes -= entry.image.nbytes
+
+    # Заеднички слој: еден .npz фајл по барање (декодираната слика, box-ови, типови, натписи)
+    # TTL според времето на запишување, исечоците се прават локално во секој worker
+    def _shared_path(self, image_id: str) -> Path:
+        return self.shared_dir / f"{hashlib.blake2b(image_id.encode(), digest_size=16).hexdigest()}.npz"
+
+    def _shared_get(self, image_id: str) -> Optional[_Entry]:
+        if self.shared_dir is None:
+            return None
+
+        path = self._shared_path(image_id)
+        try:
+            remaining = path.stat().st_mtime + self.ttl - time.time()
+            if remaining <= 0:
+                path.unlink(missing_ok=True)
+                return None
+            with np.load(path, allow_pickle=False) as data:
+                image = data["image"]
+                boxes = data["boxes"].tolist()
+                types = data["types"].tolist()
+                labels = json.loads(str(data["labels"]))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Shared crop read failed: {e}")
+            return None
+
+        return _Entry(image, list(zip(boxes, types)), labels, time.monotonic() + remaining)
+
+    def _shared_put(self, image_id: str, entry: _Entry) -> None:
+        if self.shared_dir is None:
+            return
+
+        labels = [
+            {"class_name": label["class_name"], "confidence": float(label["confidence"])}
+            for label in entry.labels
+        ]
+        try:
+            # Атомско запишување, за друг процес никогаш да не прочита половина фајл
+            fd, tmp_path = tempfile.mkstemp(dir=self.shared_dir, suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    image=entry.image,
+                    boxes=np.array([box for box, _ in entry.regions], dtype=np.float64).reshape(-1, 4),
+                    types=np.array([str(kind) for _, kind in entry.regions]),
+                    labels=np.array(json.dumps(labels)),
+                )
+            os.replace(tmp_path, self._shared_path(image_id))
+        except OSError as e:
+            logger.warning(f"Shared crop write failed: {e}")
+            return
+
+        # Бришењето на најстарите фајлови се прави на секои 64 запишувања
+        self._shared_writes += 1
+        if self._shared_writes % 64 == 0:
+            self._shared_prune()
+
+    def _shared_prune(self) -> None:
+        files = []
+        for path in self.shared_dir.glob("*.npz"):
+            try:
+                files.append((path.stat().st_mtime, path))
+            except OSError:
+                continue
+
+        if len(files) <= self.shared_max_requests:
+            return
+
+        files.sort()
+        for _, path in files[:len(files) - self.shared_max_requests]:
+            path.unlink(missing_ok=True)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "requests": len(self._entries),
+                "bytes": self._bytes,
+                "ttl_seconds": self.ttl,
+                "served": self.served,
+                "generated": self.generated,
+                "expired": self.expired,
+                "shared": str(self.shared_dir) if self.shared_dir is not None else None,
+                "shared_hits": self.shared_hits,
+            }
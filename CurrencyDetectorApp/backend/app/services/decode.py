@@ -0,0 +1,92 @@
+import io
+from typing import Tuple
+
+import cv2
+import numpy as np
+from PIL import Image
+
+from core.config import DECODE_MAX_SIDE, MAX_IMAGE_PIXELS
+
+# JPEG се декодира директно на 1/2, 1/4 или 1/8 од големината (DCT scaling во libjpeg)
+REDUCED_FLAGS = {
+    1: cv2.IMREAD_COLOR,
+    2: cv2.IMREAD_REDUCED_COLOR_2,
+    4: cv2.IMREAD_REDUCED_COLOR_4,
+    8: cv2.IMREAD_REDUCED_COLOR_8,
+}
+
+
+# Сликата не може да се декодира или е преголема (decompression bomb)
+class ImageDecodeError(ValueError):
+    pass
+
+
+# Сликата има повеќе пиксели од MAX_IMAGE_PIXELS (пораката смее да оди до клиентот)
+class ImageTooLargeError(ImageDecodeError):
+    pass
+
+
+# Најголемиот фактор (1, 2, 4, 8) со кој долгата страна сеуште е барем max_side
+def reduction_factor(width: int, height: int, max_side: int = DECODE_MAX_SIDE) -> int:
+    long_side = max(width, height)
+    factor = 1
+    for candidate in (2, 4, 8):
+        if long_side / candidate >= max_side:
+            factor = candidate
+    return factor
+
+
+# Декодирање на прикачена слика директно во BGR, без PIL -> NumPy -> cvtColor копии
+# Прво се читаат само димензиите од header-от (PIL е lazy), за да се провери MAX_IMAGE_PIXELS
+# пред да се алоцира било што, а потоа се избира намалено декодирање според max_side
+# Враќа (слика, scale), scale = декодирана / оригинална ширина, за box-овите да се вратат
+# во координати на оригиналната слика
+# EXIF ориентацијата не се применува (исто како претходното PIL декодирање)
+def decode_image(contents: bytes, max_side: int = DECODE_MAX_SIDE,
+                 max_pixels: int = MAX_IMAGE_PIXELS) -> Tuple[np.ndarray, float]:
+    try:
+        with Image.open(io.BytesIO(contents)) as header:
+            width, height = header.size
+            image_format = header.format
+    except Exception as e:
+        raise ImageDecodeError(f"Invalid image file: {e}")
+
+    if width * height > max_pixels:
+        raise ImageTooLargeError(
+            f"Image has {width * height} pixels, the limit is {max_pixels}"
+        )
+
+    factor = reduction_factor(width, height, max_side)
+    buffer = np.frombuffer(contents, dtype=np.uint8)
+
+    if image_format == "JPEG":
+        image = cv2.imdecode(buffer, REDUCED_FLAGS[factor] | cv2.IMREAD_IGNORE_ORIENTATION)
+    else:
+        image = cv2.imdecode(buffer, cv2.IMREAD_COLOR | cv2.IMREAD_IGNORE_ORIENTATION)
+        if image is not None and factor > 1:
+            image = cv2.resize(
+                image, (width // factor, height // factor), interpolation=cv2.INTER_AREA
+            )
+
+    if image is None:
+        image = _decode_with_pil(contents, factor)
+
+    return image, image.shape[1] / width
+
+
+# Резервен пат за формати што OpenCV не ги чита, а PIL ги чита (GIF, некои TIFF/ICO...)
+# Првата слика од анимацијата се претвора во RGB и потоа во BGR
+def _decode_with_pil(contents: bytes, factor: int) -> np.ndarray:
+    try:
+        with Image.open(io.BytesIO(contents)) as pil_image:
+            rgb = np.asarray(pil_image.convert("RGB"))
+    except Exception as e:
+        raise ImageDecodeError(f"Invalid image file: {e}")
+
+    image = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    if factor > 1:
+        height, width = image.shape[:2]
+        image = cv2.resize(
+            image, (width // factor, height // factor), interpolation=cv2.INTER_AREA
+        )
+    return image
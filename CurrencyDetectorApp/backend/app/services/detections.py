@@ -0,0 +1,111 @@
+import numpy as np
+from typing import Dict, Iterator, List, Optional, Sequence
+
+
+# Детекции од еден повик до моделот, чувани како NumPy низи:
+# boxes (N x 4, xyxy), confidences (N), class_ids (N)
+# Се претвораат во dict (формат за Flutter JSON) дури на крајот, со to_dicts()
+# extras се дополнителни полиња по детекција (на пр. ensemble_confidence)
+class Detections:
+    def __init__(self, boxes: np.ndarray, confidences: np.ndarray,
+                 class_ids: np.ndarray, names: Dict[int, str],
+                 extras: Optional[Dict[str, np.ndarray]] = None):
+        self.boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+        self.confidences = np.asarray(confidences, dtype=np.float32).reshape(-1)
+        self.class_ids = np.asarray(class_ids, dtype=np.int64).reshape(-1)
+        self.names = names
+        self.extras: Dict[str, np.ndarray] = extras or {}
+
+    @classmethod
+    def empty(cls, names: Dict[int, str]) -> "Detections":
+        return cls(np.zeros((0, 4)), np.zeros(0), np.zeros(0), names)
+
+    # Излез од ultralytics (boxes.data): x1, y1, x2, y2, conf, cls во една низа
+    @classmethod
+    def from_array(cls, data: np.ndarray, names: Dict[int, str]) -> "Detections":
+        data = np.asarray(data).reshape(-1, 6)
+        return cls(data[:, :4], data[:, 4], data[:, 5], names)
+
+    # Спојува детекции од повеќе повици до ист модел (на пр. од повеќе исечоци)
+    @classmethod
+    def concatenate(cls, parts: List["Detections"], names: Dict[int, str]) -> "Detections":
+        if not parts:
+            return cls.empty(names)
+        return cls(
+            np.concatenate([part.boxes for part in parts]),
+            np.concatenate([part.confidences for part in parts]),
+            np.concatenate([part.class_ids for part in parts]),
+            names
+        )
+
+    def __len__(self) -> int:
+        return len(self.confidences)
+
+    # Итерација дава dict за секоја детекција (за скриптите што очекуваат листа)
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self.to_dicts())
+
+    def class_name(self, index: int) -> str:
+        class_id = int(self.class_ids[index])
+        return self.names.get(class_id, str(class_id))
+
+    # Индекс на детекцијата со најголем confidence, None ако нема детекции
+    def best(self) -> Optional[int]:
+        if not len(self):
+            return None
+        return int(self.confidences.argmax())
+
+    # Детекции од даден тип, на пр. само "note" од бинарниот модел
+    def of_class(self, class_name: str) -> "Detections":
+        class_ids = [i for i, name in self.names.items() if name == class_name]
+        return self.select(np.flatnonzero(np.isin(self.class_ids, class_ids)))
+
+    def select(self, indices: Sequence[int]) -> "Detections":
+        indices = np.asarray(indices, dtype=np.int64)
+        return Detections(
+            self.boxes[indices],
+            self.confidences[indices],
+            self.class_ids[indices],
+            self.names,
+            {key: values[indices] for key, values in self.extras.items()}
+        )
+
+    def to_dicts(self) -> List[Dict]:
+        extras = {key: values.tolist() for key, values in self.extras.items()}
+
+        detections = []
+        for i, (box, confidence, class_id) in enumerate(zip(
+                self.boxes.tolist(),
+                self.confidences.tolist(),
+                self.class_ids.tolist()
+        )):
+            detection = {
+                'bbox': box,
+                'confidence': confidence,
+                'class_id': class_id,
+                'class_name': self.names.get(class_id, str(class_id))
+            }
+            for key, values in extras.items():
+                detection[key] = values[i]
+            detections.append(detection)
+
+        return detections
+
+
+# IoU матрица (N x M) меѓу две групи box-ови во xyxy формат, без Python јамки
+def box_iou(boxes1: np.ndarray, boxes2: np.ndarray) -> np.ndarray:
+    top_left = np.maximum(boxes1[:, None, :2], boxes2[None, :, :2])
+    bottom_right = np.minimum(boxes1[:, None, 2:], boxes2[None, :, 2:])
+    inter = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+
+    area1 = (boxes1[:, 2:] - boxes1[:, :2]).prod(axis=1)
+    area2 = (boxes2[:, 2:] - boxes2[:, :2]).prod(axis=1)
+    union = area1[:, None] + area2[None, :] - inter
+
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+# Вредност во денари од името на класата, на пр. "100_note" -> 100, "5_coin" -> 5
+def denomination_value(class_name: str) -> int:
+    value = class_name.split("_", 1)[0]
+    return int(value) if value.isdigit() else 0
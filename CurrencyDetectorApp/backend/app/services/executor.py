@@ -0,0 +1,109 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict
+
+from core.config import INFERENCE_WORKERS, MAX_QUEUE_SIZE
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+# Се крева кога редицата за инференца е полна, API-то враќа 503 со Retry-After
+class QueueFullError(Exception):
+    pass
+
+
+# Собира статистика за редица: колку чекаат и колку долго чекале
+class QueueStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.completed = 0
+        self.rejected = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    def record_wait(self, wait: float) -> None:
+        with self._lock:
+            self.completed += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+
+    def record_rejected(self) -> None:
+        with self._lock:
+            self.rejected += 1
+
+    def as_dict(self) -> Dict:
+        with self._lock:
+            return {
+                "completed": self.completed,
+                "rejected": self.rejected,
+                "avg_wait_ms": (
+                    self.total_wait / self.completed * 1000.0 if self.completed else 0.0
+                ),
+                "max_wait_ms": self.max_wait * 1000.0,
+            }
+
+
+# Посебен executor за блокирачката инференца, за event loop-от да остане слободен
+# Бројот на барања што чекаат е ограничен на max_queue
+class InferenceExecutor:
+    def __init__(self, max_workers: int = INFERENCE_WORKERS, max_queue: int = MAX_QUEUE_SIZE):
+        self.max_workers = max(1, max_workers)
+        self.max_queue = max(0, max_queue)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.max_workers,
+            thread_name_prefix="inference"
+        )
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+        self.queue_stats = QueueStats()
+
+    @property
+    def queue_depth(self) -> int:
+        with self._lock:
+            return self._pending - self._running
+
+    async def run(self, fn: Callable, *args) -> Any:
+        with self._lock:
+            if self._pending >= self.max_workers + self.max_queue:
+                self.queue_stats.record_rejected()
+                raise QueueFullError("Inference queue is full")
+            self._pending += 1
+
+        submitted = time.perf_counter()
+
+        def task():
+            with self._lock:
+                self._running += 1
+            self.queue_stats.record_wait(time.perf_counter() - submitted)
+            try:
+                return fn(*args)
+            finally:
+                with self._lock:
+                    self._running -= 1
+
+        # _pending се намалува кога задачата навистина ќе заврши (или ќе се откаже пред да
+        # почне), а не кога ќе се откаже корутината што чека: откажаното барање
+        # сеуште го држи работникот, па лимитот max_workers + max_queue мора да важи
+        def release(_):
+            with self._lock:
+                self._pending -= 1
+
+        future = self._executor.submit(task)
+        future.add_done_callback(release)
+        return await asyncio.wrap_future(future)
+
+    def shutdown(self) -> None:
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.max_workers,
+            "max_queue": self.max_queue,
+            "queue_depth": self.queue_depth,
+            **self.queue_stats.as_dict(),
+        }
@@ -1,74 +1,113 @@
+import threading
+
 import cv2
 import numpy as np
-from typing import List, Tuple
+from typing import List, Optional, Tuple
 
 
-def extract_currency_images(image: np.ndarray, detections: List[dict], currency_type: str) -> List[np.ndarray]:
-    extracted = []
+# Кружницата за монетите се бара на намалена копија од исечокот (долга страна CIRCLE_SEARCH_SIZE)
+CIRCLE_SEARCH_SIZE = 160
 
-    for det in detections:
-        bbox = det['bbox']
-        extracted_img = extract_single_currency(image, bbox, currency_type)
-        extracted.append(extracted_img)
+SHARPEN_KERNEL = np.array([[-1, -1, -1],
+                           [-1, 9, -1],
+                           [-1, -1, -1]], dtype=np.float32) / 9
 
-    return extracted
+# CLAHE објектот се прави еднаш по нишка (не е безбедно да се дели меѓу нишки)
+_local = threading.local()
+
+
+def _clahe() -> "cv2.CLAHE":
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))
+    return clahe
+
+
+def extract_currency_images(image: np.ndarray, detections: List[dict], currency_type: str) -> List[np.ndarray]:
+    return extract_batch(image, [(det['bbox'], currency_type) for det in detections])
 
 
 def extract_single_currency(image: np.ndarray, bbox: List[float], currency_type: str, padding: int = 10) -> np.ndarray:
-    x1, y1, x2, y2 = map(int, bbox)
+    return extract_batch(image, [(bbox, currency_type)], padding)[0]
+
 
+# Сите исечоци од едно барање во еден повик: regions е листа од (bbox, тип на валута)
+# Исечоците се прозорци (views) во истата слика, без копирање, а нови низи се само резултатите
+def extract_batch(image: np.ndarray, regions: List[Tuple[List[float], str]],
+                  padding: int = 10) -> List[np.ndarray]:
     h, w = image.shape[:2]
-    x1 = max(0, x1 - padding)
-    y1 = max(0, y1 - padding)
-    x2 = min(w, x2 + padding)
-    y2 = min(h, y2 + padding)
+    extracted = []
 
-    cropped = image[y1:y2, x1:x2].copy()
+    for bbox, currency_type in regions:
+        x1, y1, x2, y2 = map(int, bbox)
+        x1, y1 = max(0, x1 - padding), max(0, y1 - padding)
+        x2, y2 = min(w, x2 + padding), min(h, y2 + padding)
 
-    if cropped.size == 0 or cropped.shape[0] == 0 or cropped.shape[1] == 0:
-        return np.zeros((100, 100, 3), dtype=np.uint8)
+        cropped = image[y1:y2, x1:x2]
 
-    if currency_type == 'coin':
-        return remove_background_circular(cropped)
-    else:
-        return enhance_banknote(cropped)
+        if cropped.size == 0:
+            extracted.append(np.zeros((100, 100, 3), dtype=np.uint8))
+        elif currency_type == 'coin':
+            extracted.append(remove_background_circular(cropped))
+        else:
+            extracted.append(enhance_banknote(cropped))
 
+    return extracted
 
-def remove_background_circular(image: np.ndarray) -> np.ndarray:
-    if len(image.shape) == 2:
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
-    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+# Кружница (cx, cy, r) во координати на image, или None
+# HoughCircles работи на намалена копија, а опсегот на радиуси е тесен затоа што
+# исечокот е box-от од моделот (+ padding), па монетата го исполнува скоро целиот
+def find_coin_circle(image: np.ndarray) -> Optional[Tuple[float, float, float]]:
+    h, w = image.shape[:2]
+    scale = min(1.0, CIRCLE_SEARCH_SIZE / max(h, w))
+
+    small = image
+    if scale < 1.0:
+        small = cv2.resize(
+            image, (max(1, round(w * scale)), max(1, round(h * scale))),
+            interpolation=cv2.INTER_AREA
+        )
+
+    gray = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+    cv2.GaussianBlur(gray, (0, 0), max(0.8, 2 * scale), dst=gray)
 
     circles = cv2.HoughCircles(
-        blurred,
+        gray,
         cv2.HOUGH_GRADIENT,
         dp=1,
-        minDist=50,
+        minDist=max(1.0, 50 * scale),
         param1=50,
-        param2=30,
-        minRadius=int(min(image.shape[:2]) * 0.25),
-        maxRadius=int(max(image.shape[:2]) * 0.55)
+        param2=max(12.0, 30 * scale),
+        minRadius=int(min(h, w) * 0.3 * scale),
+        maxRadius=int(max(h, w) * 0.55 * scale)
     )
 
+    if circles is None:
+        return None
+
+    cx, cy, r = circles[0, 0]
+    return float(cx) / scale, float(cy) / scale, float(r) / scale
+
+
+def remove_background_circular(image: np.ndarray) -> np.ndarray:
+    if len(image.shape) == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
     mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    circle = find_coin_circle(image)
 
-    if circles is not None:
-        circles = np.uint16(np.around(circles))
-        circle = circles[0, 0]
-        center = (circle[0], circle[1])
-        radius = int(circle[2] * 1.05)
-        cv2.circle(mask, center, radius, 255, -1)
+    if circle is not None:
+        cx, cy, r = circle
+        cv2.circle(mask, (int(round(cx)), int(round(cy))), int(r * 1.05), 255, -1)
     else:
         h, w = image.shape[:2]
         center = (w // 2, h // 2)
         axes = (int(w * 0.48), int(h * 0.48))
         cv2.ellipse(mask, center, axes, 0, 0, 360, 255, -1)
 
-    kernel = np.ones((3, 3), np.uint8)
-    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel, iterations=2)
-    mask = cv2.GaussianBlur(mask, (5, 5), 0)
+    # Маската е полн круг/елипса (конвексна), па morphology close не менува ништо
+    cv2.GaussianBlur(mask, (5, 5), 0, dst=mask)
 
     bgra = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
     bgra[:, :, 3] = mask
@@ -76,26 +115,29 @@ def remove_background_circular(image: np.ndarray) -> np.ndarray:
     return bgra
 
 
+# CLAHE само врз L каналот (extract/insert наместо split/merge на сите три канали)
 def enhance_banknote(image: np.ndarray) -> np.ndarray:
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
+    cv2.insertChannel(_clahe().apply(cv2.extractChannel(lab, 0)), lab, 0)
 
-    clahe = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8))
-    l = clahe.apply(l)
+    enhanced = cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+    sharpened = cv2.filter2D(enhanced, -1, SHARPEN_KERNEL)
 
-    enhanced = cv2.merge([l, a, b])
-    enhanced = cv2.cvtColor(enhanced, cv2.COLOR_LAB2BGR)
+    return cv2.addWeighted(enhanced, 0.7, sharpened, 0.3, 0, dst=sharpened)
 
-    kernel = np.array([[-1, -1, -1],
-                       [-1, 9, -1],
-                       [-1, -1, -1]]) / 9
-    sharpened = cv2.filter2D(enhanced, -1, kernel)
 
-    result = cv2.addWeighted(enhanced, 0.7, sharpened, 0.3, 0)
-
-    return result
+# Монета (BGRA) врз бела позадина, во цели броеви и директно во ќелијата од мрежата:
+# c*a/255 + 255*(1 - a/255) = 255 - (255 - c)*a/255
+def _composite_on_white(bgra: np.ndarray, out: np.ndarray) -> None:
+    alpha = bgra[:, :, 3:4].astype(np.uint16)
+    inverted = np.subtract(255, bgra[:, :, :3], dtype=np.uint16)
+    inverted *= alpha
+    inverted += 127
+    inverted //= 255
+    np.subtract(255, inverted, out=out, casting="unsafe")
 
 
+# Платното се алоцира еднаш (бело), а секој исечок се намалува и се пишува директно во својата ќелија
 def create_display_grid(images: List[np.ndarray], detections: List[dict], grid_cols: int = 3,
                         cell_size: Tuple[int, int] = (300, 300)) -> np.ndarray:
     if not images:
@@ -106,7 +148,7 @@ def create_display_grid(images: List[np.ndarray], detections: List[dict], grid_c
 
     grid_h = grid_rows * cell_size[1]
     grid_w = grid_cols * cell_size[0]
-    grid = np.ones((grid_h, grid_w, 3), dtype=np.uint8) * 255
+    grid = np.full((grid_h, grid_w, 3), 255, dtype=np.uint8)
 
     for idx, (img, det) in enumerate(zip(images, detections)):
         row = idx // grid_cols
@@ -114,22 +156,19 @@ def create_display_grid(images: List[np.ndarray], detections: List[dict], grid_c
 
         h, w = img.shape[:2]
         scale = min((cell_size[0] - 40) / w, (cell_size[1] - 60) / h)
-        new_w, new_h = int(w * scale), int(h * scale)
-
-        if img.shape[2] == 4:
-            resized = cv2.resize(img, (new_w, new_h))
-            alpha = resized[:, :, 3] / 255.0
-            for c in range(3):
-                resized[:, :, c] = (resized[:, :, c] * alpha +
-                                    255 * (1 - alpha)).astype(np.uint8)
-            resized = resized[:, :, :3]
-        else:
-            resized = cv2.resize(img, (new_w, new_h))
+        new_w, new_h = max(1, int(w * scale)), max(1, int(h * scale))
 
         y_offset = row * cell_size[1] + (cell_size[1] - new_h) // 2
         x_offset = col * cell_size[0] + (cell_size[0] - new_w) // 2
+        cell = grid[y_offset:y_offset + new_h, x_offset:x_offset + new_w]
 
-        grid[y_offset:y_offset + new_h, x_offset:x_offset + new_w] = resized
+        resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
+        if resized.ndim == 2:
+            cell[:] = resized[:, :, None]
+        elif resized.shape[2] == 4:
+            _composite_on_white(resized, cell)
+        else:
+            cell[:] = resized
 
         label = f"{det['class_name']}"
         conf = det.get('ensemble_confidence', det['confidence'])
@@ -1,71 +1,178 @@
+import time
+
 import cv2
 import numpy as np
-from ultralytics import YOLO
-from typing import Dict, List, Optional
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
 from core.config import (
-    DEVICE,
     BINARY_CONFIDENCE,
     BANKNOTE_CONFIDENCE,
     COIN_CONFIDENCE,
+    MODEL_BACKEND,
+    MODEL_PRECISION,
+    PREPROCESS_PROFILE,
+    USE_PREPROCESSING,
+    USE_ENSEMBLE,
+    ENSEMBLE_IOU_THRESHOLD,
+    IMAGE_SIZE,
+    BINARY_IMAGE_SIZE,
+    USE_ROI_CASCADE,
+    ROI_PADDING,
+    ROI_MAX_REGIONS,
+    ROI_MAX_AREA_RATIO,
+    SPECIFIC_IMAGE_SIZES,
+    DECODE_MAX_SIDE,
+    USE_MICRO_BATCHING,
+    MAX_BATCH_SIZE,
+    INFERENCE_WORKERS,
+    WARMUP_PASSES,
+    get_device,
 )
-from services.preprocess import preprocess_image
+from services.backends import load_backend, nms, resolve_model_path
+from services.buffers import buffer_pool
+from services.detections import Detections, box_iou, denomination_value
+from services.pipeline import PipelineContext, pick_image_size
 from core.logging import get_logger
 
 logger = get_logger(__name__)
 
 # Централна класа која ги содржи: моделите, threshold вредност, како и целата логика за детекција
 class CurrencyDetector:
-    def __init__(self, model_paths: Dict[str, str], device: str = DEVICE):
-        self.device = device
-        self.models: Dict[str, YOLO] = {}
+    def __init__(self, model_paths: Dict[str, str], device: Optional[str] = None,
+                 backend: str = MODEL_BACKEND, precision: str = MODEL_PRECISION):
+        # Уредот се одредува дури сега (torch се увезува само за pt backend-от)
+        self.device = device or (get_device() if backend == "pt" else "cpu")
+        self.backend = backend
+        self.precision = precision
+        self.models: Dict[str, object] = {}
 
         self.binary_threshold = BINARY_CONFIDENCE
         self.banknote_threshold = BANKNOTE_CONFIDENCE
         self.coin_threshold = COIN_CONFIDENCE
         self.iou_threshold = 0.5
+        self.min_final_confidence = 0.4
+        self.ensemble_iou_threshold = ENSEMBLE_IOU_THRESHOLD
+        self.use_roi_cascade = USE_ROI_CASCADE
+        self.binary_image_size = BINARY_IMAGE_SIZE
+        self.preprocess_profile = PREPROCESS_PROFILE
+        # За мешани сцени: банкнотите и монетите одат паралелно низ своите модели
+        # Се создава тука (а не при првиот повик) за повеќе нишки да не создадат по еден;
+        # самите нишки ги стартува дури првиот submit
+        self._stage_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="cascade")
 
         for name, path in model_paths.items():
             try:
-                # Динамичко вчитување на модели
+                # Динамичко вчитување на модели преку избраниот backend (pt или onnx)
                 # Ако моделот не се вчита, тогаш апликацијата ќе се стопира
-                self.models[name] = YOLO(str(path))
-                logger.info(f"Loaded {name} model from {path}")
+                self.models[name] = load_backend(path, backend, self.device, precision)
+                logger.info(
+                    f"Loaded {name} model from {resolve_model_path(path, backend, precision)}"
+                )
             except Exception as e:
                 logger.error(f"Failed to load {name} model: {e}")
                 raise
 
-# Го пушта YOLO моделот, ги вчитува bounding boxes и ги враќа како Python dict
+    # Влезните облици што моделите ги гледаат во продукција: (модел, imgsz, batch)
+    def warmup_shapes(self) -> List[Tuple[str, int, int]]:
+        batch_sizes = (1, MAX_BATCH_SIZE) if USE_MICRO_BATCHING and MAX_BATCH_SIZE > 1 else (1,)
+        sizes = {
+            "binary": [self.binary_image_size],
+            "banknote": sorted(set(SPECIFIC_IMAGE_SIZES)),
+            "coin": sorted(set(SPECIFIC_IMAGE_SIZES)),
+        }
+        return [
+            (name, imgsz, batch)
+            for name in self.models
+            for imgsz in sizes.get(name, [IMAGE_SIZE])
+            for batch in batch_sizes
+        ]
+
+    # Загревање пред првото вистинско барање: подесување на предикторот во ultralytics,
+    # раст на алокаторот и избор на kernel-и при прв повик се случуваат тука, а не во P99
+    # Фази: секој модел на секој продукциски облик (passes пати), па целата каскада
+    # (single и all) врз слика со големина како декодираната. Времето на секоја фаза се логира
+    # Враќа {фаза: секунди}
+    def warmup(self, passes: int = WARMUP_PASSES) -> Dict[str, float]:
+        timings: Dict[str, float] = {}
+        if passes <= 0:
+            return timings
+
+        rng = np.random.default_rng(0)
+        frames: Dict[int, np.ndarray] = {}
+        thresholds = {
+            "binary": self.binary_threshold,
+            "banknote": self.banknote_threshold,
+            "coin": self.coin_threshold,
+        }
+
+        for name, imgsz, batch in self.warmup_shapes():
+            if imgsz not in frames:
+                frames[imgsz] = rng.integers(0, 256, (imgsz, imgsz, 3), dtype=np.uint8)
+            images = [frames[imgsz]] * batch
+            model = self.models[name]
+
+            pass_times = []
+            for _ in range(passes):
+                start = time.perf_counter()
+                model.detect(images, thresholds.get(name, 0.5), self.iou_threshold, imgsz)
+                pass_times.append(time.perf_counter() - start)
+
+            phase = f"{name}@{imgsz}x{batch}"
+            timings[phase] = sum(pass_times)
+            logger.info(
+                f"Warmup {phase}: first {pass_times[0] * 1000:.0f}ms, "
+                f"last {pass_times[-1] * 1000:.0f}ms"
+            )
+
+            # Онолку бафери колку што има нишки во executor-от (претходно алоцирани)
+            if self.backend == "onnx":
+                buffer_pool.reserve((batch, 3, imgsz, imgsz), np.float32, INFERENCE_WORKERS)
+
+        frame = rng.integers(0, 256, (DECODE_MAX_SIDE * 3 // 4, DECODE_MAX_SIDE, 3), dtype=np.uint8)
+        for phase, run in (("cascade", self.detect), ("cascade_all", self.detect_all)):
+            start = time.perf_counter()
+            run(frame, USE_PREPROCESSING, USE_ENSEMBLE)
+            timings[phase] = time.perf_counter() - start
+            logger.info(f"Warmup {phase}: {timings[phase] * 1000:.0f}ms")
+
+        logger.info(
+            f"Warmup done in {sum(timings.values()):.1f}s ({passes} passes), "
+            f"buffers: {buffer_pool.stats()}"
+        )
+        return timings
+
+# Го пушта YOLO моделот и ги враќа bounding boxes како Detections (NumPy низи)
     def detect_with_confidence_filter(
             self,
             image: np.ndarray,
-            model: YOLO,
+            model,
             conf_threshold: float
-    ) -> List[Dict]:
+    ) -> Detections:
+
+        return self.detect_batch_with_confidence_filter(
+            [image],
+            model,
+            conf_threshold
+        )[0]
+
+    # Истото како погоре, но цела листа слики оди низ моделот во еден forward pass
+    # Враќа по една листа детекции за секоја слика, во истиот редослед
+    def detect_batch_with_confidence_filter(
+            self,
+            images: List[np.ndarray],
+            model,
+            conf_threshold: float,
+            imgsz: int = IMAGE_SIZE
+    ) -> List[Detections]:
+
+        if not images:
+            return []
 
         try:
-            results = model(
-                image,
-                conf=conf_threshold,
-                iou=self.iou_threshold,
-                verbose=False
-            )
-            # Ги извлекува резултатите во формат компатибилен со Flutter JSON
-            detections = []
-            for result in results:
-                boxes = result.boxes
-                for box in boxes:
-                    detection = {
-                        'bbox': box.xyxy[0].cpu().numpy().tolist(),
-                        'confidence': float(box.conf[0]),
-                        'class_id': int(box.cls[0]),
-                        'class_name': model.names[int(box.cls[0])]
-                    }
-                    detections.append(detection)
-
-            return detections
+            return model.detect(images, conf_threshold, self.iou_threshold, imgsz)
         except Exception as e:
             logger.error(f"Detection failed: {e}")
-            return []
+            return [Detections.empty(model.names) for _ in images]
 
     # Пресметува Intersection over Union
     # Претставува мерка за преклопување на два bounding box-а
@@ -89,86 +196,294 @@ class CurrencyDetector:
 
         return inter_area / union_area if union_area > 0 else 0
 
-    # Комбинира бинарен и специфичен модел
-    # Работи на тој начин што проверува дали bounding box од бинарен модел се преклопува со специфичен модел
-    # Се задржува најдобриот, со најдобар confidence
-    def ensemble_vote(self, binary_dets: List[Dict], specific_dets: List[Dict]) -> List[Dict]:
-        if not binary_dets or not specific_dets:
+    # Комбинира бинарен и специфичен модел (weighted box fusion)
+    # IoU матрицата меѓу box-овите од двата модела се пресметува одеднаш
+    # Секој бинарен box се спарува со специфичниот box со најголем IoU (над ensemble_iou_threshold),
+    # а спарените box-ови се спојуваат во просек тежински според confidence
+    # Класата и confidence остануваат од специфичниот модел, а ensemble_confidence е просекот од двата
+    # Ако ништо не се спари, се враќаат специфичните детекции непроменети
+    def ensemble_vote(self, binary_dets: Detections, specific_dets: Detections) -> Detections:
+        if not len(binary_dets) or not len(specific_dets):
             return specific_dets
 
-        matched_dets = []
+        iou = box_iou(binary_dets.boxes, specific_dets.boxes)
+        best_specific = iou.argmax(axis=1)
+        best_iou = iou[np.arange(len(iou)), best_specific]
 
-        for binary_det in binary_dets:
-            best_match = None
-            best_iou = 0.3
+        binary_idx = np.flatnonzero(best_iou > self.ensemble_iou_threshold)
+        if not len(binary_idx):
+            return specific_dets
 
-            for specific_det in specific_dets:
-                iou = self.calculate_iou(
-                    binary_det['bbox'],
-                    specific_det['bbox']
-                )
+        # Ако повеќе бинарни box-ови паднат на ист специфичен, останува оној со најголем IoU
+        order = binary_idx[np.argsort(-best_iou[binary_idx], kind="stable")]
+        _, first = np.unique(best_specific[order], return_index=True)
+        binary_idx = order[np.sort(first)]
+        specific_idx = best_specific[binary_idx]
 
-                if iou > best_iou:
-                    best_iou = iou
-                    best_match = specific_det.copy()
+        binary_conf = binary_dets.confidences[binary_idx]
+        specific_conf = specific_dets.confidences[specific_idx]
+        weights = np.stack([binary_conf, specific_conf])[:, :, None]
+        boxes = np.stack([binary_dets.boxes[binary_idx], specific_dets.boxes[specific_idx]])
+        fused_boxes = (weights * boxes).sum(axis=0) / np.maximum(weights.sum(axis=0), 1e-9)
 
-            if best_match:
-                best_match['binary_confidence'] = binary_det['confidence']
-                best_match['ensemble_confidence'] = max(
-                    binary_det['confidence'],
-                    best_match['confidence']
-                )
-                matched_dets.append(best_match)
-
-        return matched_dets if matched_dets else specific_dets
+        fused = specific_dets.select(specific_idx)
+        fused.boxes = fused_boxes.astype(np.float32)
+        fused.extras['binary_confidence'] = binary_conf
+        fused.extras['ensemble_confidence'] = (binary_conf + specific_conf) / 2
+        return fused
 
 
     # Детектирање на валута
     def detect(self, image: np.ndarray, use_preprocessing: bool = True,
                use_ensemble: bool = True) -> Dict:
 
-        binary_image, binary_scale = preprocess_image(image)
+        return self.detect_batch(
+            [image],
+            use_preprocessing=use_preprocessing,
+            use_ensemble=use_ensemble
+        )[0]
+
+    # Детектирање на валута за повеќе слики одеднаш
+    # Бинарниот модел ги обработува сите слики во еден повик, па сликите се групираат
+    # според типот (банкнота или монета) и секоја група оди во еден повик до специфичниот модел
+    # Препроцесирањето за секоја слика се прави еднаш, во PipelineContext
+    # Без препроцесирање се користи профилот "off" (само промена на големина)
+    def detect_batch(self, images: List[np.ndarray], use_preprocessing: bool = True,
+                     use_ensemble: bool = True) -> List[Dict]:
+
+        if not images:
+            return []
+
+        profile = self.preprocess_profile if use_preprocessing else "off"
+        contexts = [PipelineContext(image, profile=profile) for image in images]
+        try:
+            return self._detect_contexts(contexts, use_ensemble)
+        finally:
+            for ctx in contexts:
+                ctx.release()
 
+    def _detect_contexts(self, contexts: List[PipelineContext], use_ensemble: bool) -> List[Dict]:
         # Бинарна детекција, доколку нема ништо ќе врати „Не е детектирана валута!“
-        binary_dets = self.detect_with_confidence_filter(
-            binary_image,
-            self.models['binary'],
-            self.binary_threshold
+        # Бинарниот модел работи на помала резолуција (BINARY_IMAGE_SIZE)
+        binary_batch = self._run_stage(
+            contexts, 'binary', self.binary_threshold, 'enhanced', self.binary_image_size
         )
 
-        if not binary_dets:
-            return {
-                'success': False,
-                'message': 'Не е детектирана валута!',
-                'type': None,
-                'detections': []
-            }
+        results: List[Optional[Dict]] = [None] * len(contexts)
+        note_indices: List[int] = []
+        coin_indices: List[int] = []
+        currency_types: Dict[int, str] = {}
+
+        for idx, binary_dets in enumerate(binary_batch):
+            if not len(binary_dets):
+                results[idx] = {
+                    'success': False,
+                    'message': 'Не е детектирана валута!',
+                    'type': None,
+                    'detections': []
+                }
+                continue
+
+            # Одредување на тип на валута (банкнота или монета)
+            currency_types[idx] = binary_dets.class_name(binary_dets.best())
+
+            if currency_types[idx] == 'note':
+                note_indices.append(idx)
+            else:
+                coin_indices.append(idx)
+
+        # Банкнотите го користат истиот препроцесиран влез како бинарниот модел
+        note_batch = self._run_specific_stage(
+            contexts, binary_batch, currency_types, note_indices,
+            'banknote', self.banknote_threshold, 'enhanced'
+        )
+        for idx, specific_dets in zip(note_indices, note_batch):
+            if use_ensemble:
+                specific_dets = self.ensemble_vote(
+                    binary_batch[idx].of_class(currency_types[idx]), specific_dets
+                )
+            results[idx] = self._build_result(specific_dets, currency_types[idx], 'banknote')
 
-        # Одредување на тип на валута (банкнота или монета)
-        best_binary = max(binary_dets, key=lambda d: d['confidence'])
-        currency_type = best_binary['class_name']
+        # Монетите одат од оригиналната слика, без CLAHE и denoise
+        coin_batch = self._run_specific_stage(
+            contexts, binary_batch, currency_types, coin_indices,
+            'coin', self.coin_threshold, 'raw'
+        )
+        for idx, specific_dets in zip(coin_indices, coin_batch):
+            if use_ensemble:
+                specific_dets = self.ensemble_vote(
+                    binary_batch[idx].of_class(currency_types[idx]), specific_dets
+                )
+            results[idx] = self._build_result(specific_dets, currency_types[idx], 'coin')
 
-        if currency_type == 'note':
-            processed_image, scale = preprocess_image(image)
-            specific_model = self.models['banknote']
-            conf_threshold = self.banknote_threshold
-            type_name = 'banknote'
-        else:
-            processed_image = image
-            scale = 1.0
-            specific_model = self.models['coin']
-            conf_threshold = self.coin_threshold
-            type_name = 'coin'
+        return results
 
-        # Проверка на специфична детекција, доколку нема ќе врати грешка
-        # „Не е детектирана специфична класа за {type_name}!“
-        specific_dets = self.detect_with_confidence_filter(
-            processed_image,
-            specific_model,
-            conf_threshold
+    # Мешана сцена (на пр. маса со повеќе монети и банкнота): се враќаат сите детекции
+    # Бинарните box-ови од секој тип одат до соодветниот специфичен модел,
+    # а двата специфични модели работат истовремено врз истите PipelineContext-и
+    def detect_all(self, image: np.ndarray, use_preprocessing: bool = True,
+                   use_ensemble: bool = True) -> Dict:
+
+        return self.detect_all_batch(
+            [image],
+            use_preprocessing=use_preprocessing,
+            use_ensemble=use_ensemble
+        )[0]
+
+    def detect_all_batch(self, images: List[np.ndarray], use_preprocessing: bool = True,
+                         use_ensemble: bool = True) -> List[Dict]:
+
+        if not images:
+            return []
+
+        profile = self.preprocess_profile if use_preprocessing else "off"
+        contexts = [PipelineContext(image, profile=profile) for image in images]
+        try:
+            return self._detect_all_contexts(contexts, use_ensemble)
+        finally:
+            for ctx in contexts:
+                ctx.release()
+
+    def _detect_all_contexts(self, contexts: List[PipelineContext],
+                             use_ensemble: bool) -> List[Dict]:
+        binary_batch = self._run_stage(
+            contexts, 'binary', self.binary_threshold, 'enhanced', self.binary_image_size
+        )
+
+        # (тип од бинарниот модел, специфичен модел, threshold, варијанта на влезот)
+        stages = [
+            ('note', 'banknote', self.banknote_threshold, 'enhanced'),
+            ('coin', 'coin', self.coin_threshold, 'raw'),
+        ]
+
+        futures = []
+        for currency_type, model_name, threshold, variant in stages:
+            indices = [
+                idx for idx, dets in enumerate(binary_batch)
+                if len(dets.of_class(currency_type))
+            ]
+            types = {idx: currency_type for idx in indices}
+            futures.append((currency_type, indices, self._stage_executor.submit(
+                self._run_specific_stage, contexts, binary_batch, types, indices,
+                model_name, threshold, variant
+            )))
+
+        found: List[List[Dict]] = [[] for _ in contexts]
+        for currency_type, indices, future in futures:
+            for idx, specific_dets in zip(indices, future.result()):
+                if use_ensemble:
+                    specific_dets = self.ensemble_vote(
+                        binary_batch[idx].of_class(currency_type), specific_dets
+                    )
+                for det in specific_dets.to_dicts():
+                    det['type'] = currency_type
+                    found[idx].append(det)
+
+        return [self._build_mixed_result(detections) for detections in found]
+
+    # Една фаза од каскадата: моделот ја добива бараната варијанта од секој контекст,
+    # а box-овите се враќаат во координати на оригиналната слика
+    def _run_stage(self, contexts: List[PipelineContext], model_name: str,
+                   conf_threshold: float, variant: str,
+                   imgsz: int = IMAGE_SIZE) -> List[Detections]:
+
+        batch = self.detect_batch_with_confidence_filter(
+            [ctx.model_input(variant, imgsz) for ctx in contexts],
+            self.models[model_name],
+            conf_threshold,
+            imgsz
         )
 
-        if not specific_dets:
+        return [ctx.map_detections(dets, variant, imgsz) for ctx, dets in zip(contexts, batch)]
+
+    # Специфичната фаза (банкноти или монети) за сликите со индекси indices
+    # Во ROI режим моделот ги гледа само исечоците околу бинарните box-ови,
+    # а сликите за кои ROI не се исплати одат цели, како порано
+    # imgsz за секој влез се избира според големината на објектите (pick_image_size),
+    # и сите влезови со иста imgsz, од сите слики, одат во еден повик до моделот
+    def _run_specific_stage(self, contexts: List[PipelineContext], binary_batch: List[Detections],
+                            currency_types: Dict[int, str], indices: List[int], model_name: str,
+                            conf_threshold: float, variant: str) -> List[Detections]:
+
+        # (индекс на сликата, контекст, imgsz)
+        jobs: List[Tuple[int, PipelineContext, int]] = []
+
+        for idx in indices:
+            ctx = contexts[idx]
+            binary_dets = binary_batch[idx].of_class(currency_types[idx])
+            regions = self._roi_regions(ctx, binary_dets)
+
+            if regions is None:
+                jobs.append((idx, ctx, self._frame_image_size(ctx, binary_dets)))
+            else:
+                jobs.extend((idx, crop, imgsz) for crop, imgsz in regions)
+
+        outputs: Dict[int, List[Detections]] = {idx: [] for idx in indices}
+        for imgsz in sorted({job[2] for job in jobs}):
+            group = [job for job in jobs if job[2] == imgsz]
+            batch = self._run_stage(
+                [ctx for _, ctx, _ in group], model_name, conf_threshold, variant, imgsz
+            )
+            for (idx, _, _), dets in zip(group, batch):
+                outputs[idx].append(dets)
+
+        names = self.models[model_name].names
+        return [self._merge_regions(outputs[idx], names) for idx in indices]
+
+    # imgsz за целата слика, според најмалиот објект што го нашол бинарниот модел
+    @staticmethod
+    def _frame_image_size(ctx: PipelineContext, binary_dets: Detections) -> int:
+        if not len(binary_dets):
+            return IMAGE_SIZE
+
+        sizes = binary_dets.boxes[:, 2:] - binary_dets.boxes[:, :2]
+        return pick_image_size(float(sizes.max(axis=1).min()), max(ctx.shape))
+
+    # Исечоци (со padding) околу бинарните box-ови, секој со својата imgsz,
+    # или None ако треба да се обработи целата слика
+    def _roi_regions(self, ctx: PipelineContext,
+                     binary_dets: Detections) -> Optional[List[Tuple[PipelineContext, int]]]:
+        if not self.use_roi_cascade or not len(binary_dets) or len(binary_dets) > ROI_MAX_REGIONS:
+            return None
+
+        regions = []
+        for box in binary_dets.boxes.tolist():
+            crop = ctx.crop(box, ROI_PADDING)
+            if min(crop.shape) <= 1:
+                continue
+
+            object_size = max(box[2] - box[0], box[3] - box[1])
+            regions.append((crop, pick_image_size(object_size, max(crop.shape))))
+
+        h, w = ctx.shape
+        covered = sum(crop.shape[0] * crop.shape[1] for crop, _ in regions)
+        if not regions or covered > ROI_MAX_AREA_RATIO * h * w:
+            return None
+
+        return regions
+
+    # Детекциите од исечоците на една слика во една листа
+    # Исечоците може да се преклопуваат, па дупликатите се тргаат со NMS по класа
+    def _merge_regions(self, parts: List[Detections], names: Dict[int, str]) -> Detections:
+        if len(parts) == 1:
+            return parts[0]
+
+        merged = Detections.concatenate(parts, names)
+        if not len(merged):
+            return merged
+
+        offsets = merged.class_ids[:, None].astype(np.float32) * (merged.boxes.max() + 1)
+        keep = nms(merged.boxes + offsets, merged.confidences, self.iou_threshold)
+        return merged.select(keep)
+
+    # Го гради финалниот резултат од детекциите на специфичниот модел
+    # Тука детекциите за прв пат се претвораат во dict
+    # По ensemble се избира детекцијата со најголем ensemble_confidence
+    def _build_result(self, specific_dets: Detections, currency_type: str, type_name: str) -> Dict:
+
+        # Проверка на специфична детекција, доколку нема ќе врати грешка
+        # „Не е детектирана специфична класа за {type_name}!“
+        if not len(specific_dets):
             return {
                 'success': False,
                 'message': f'Не е детектирана специфична класа за {type_name}!',
@@ -176,10 +491,13 @@ class CurrencyDetector:
                 'detections': []
             }
 
-        best_specific = max(specific_dets, key=lambda d: d['confidence'])
+        if 'ensemble_confidence' in specific_dets.extras:
+            best = int(specific_dets.extras['ensemble_confidence'].argmax())
+        else:
+            best = specific_dets.best()
 
-        final_conf = best_specific['confidence']
-        if final_conf < 0.4:
+        final_conf = float(specific_dets.confidences[best])
+        if final_conf < self.min_final_confidence:
             return {
                 'success': False,
                 'message': 'Детекцијата е со ниска сигурност!',
@@ -187,27 +505,66 @@ class CurrencyDetector:
                 'detections': []
             }
 
-        x1, y1, x2, y2 = best_specific["bbox"]
-        best_specific["bbox"] = [
-            x1 / scale,
-            y1 / scale,
-            x2 / scale,
-            y2 / scale,
-        ]
-
         return {
             'success': True,
             'type': currency_type,
-            'detections': [best_specific],
+            'detections': specific_dets.select([best]).to_dicts(),
             'message': 'Детектиран еден објект!'
         }
+
+
+    # Резултат за мешана сцена: сите детекции над min_final_confidence, по confidence,
+    # заедно со вкупната вредност (во денари) и бројот по класа
+    def _build_mixed_result(self, detections: List[Dict]) -> Dict:
+        detections = sorted(
+            (det for det in detections if det['confidence'] >= self.min_final_confidence),
+            key=lambda det: det.get('ensemble_confidence', det['confidence']),
+            reverse=True
+        )
+
+        if not detections:
+            return {
+                'success': False,
+                'message': 'Не е детектирана валута!',
+                'type': None,
+                'detections': [],
+                'total_value': 0,
+                'counts': {}
+            }
+
+        types = {det['type'] for det in detections}
+        counts: Dict[str, int] = {}
+        for det in detections:
+            counts[det['class_name']] = counts.get(det['class_name'], 0) + 1
+
+        return {
+            'success': True,
+            'type': types.pop() if len(types) == 1 else 'mixed',
+            'detections': detections,
+            'total_value': sum(denomination_value(det['class_name']) for det in detections),
+            'counts': counts,
+            'message': f'Детектирани {len(detections)} објекти!'
+        }
+
+
 detector: Optional[CurrencyDetector] = None
 
 
-def init_detector(model_paths: Dict[str, str], device: str = DEVICE) -> CurrencyDetector:
+def init_detector(model_paths: Dict[str, str], device: Optional[str] = None,
+                  backend: str = MODEL_BACKEND,
+                  precision: str = MODEL_PRECISION,
+                  warmup_passes: int = WARMUP_PASSES) -> CurrencyDetector:
     global detector
-    detector = CurrencyDetector(model_paths, device)
-    logger.info(f"Detector initialized on {device}")
+
+    start = time.perf_counter()
+    new_detector = CurrencyDetector(model_paths, device, backend, precision)
+    logger.info(
+        f"Detector initialized on {new_detector.device} ({backend} backend, {precision}) "
+        f"in {time.perf_counter() - start:.1f}s"
+    )
+
+    new_detector.warmup(warmup_passes)
+    detector = new_detector
     return detector
 
 
@@ -217,6 +574,28 @@ def detect_currency(image: np.ndarray) -> Dict:
 
     return detector.detect(
         image,
-        use_preprocessing=True,
-        use_ensemble=True
+        use_preprocessing=USE_PREPROCESSING,
+        use_ensemble=USE_ENSEMBLE
+    )
+
+
+def detect_currency_batch(images: List[np.ndarray]) -> List[Dict]:
+    if detector is None:
+        raise RuntimeError("Detector not initialized. Call init_detector() first.")
+
+    return detector.detect_batch(
+        images,
+        use_preprocessing=USE_PREPROCESSING,
+        use_ensemble=USE_ENSEMBLE
+    )
+
+
+def detect_currency_all(image: np.ndarray) -> Dict:
+    if detector is None:
+        raise RuntimeError("Detector not initialized. Call init_detector() first.")
+
+    return detector.detect_all(
+        image,
+        use_preprocessing=USE_PREPROCESSING,
+        use_ensemble=USE_ENSEMBLE
     )
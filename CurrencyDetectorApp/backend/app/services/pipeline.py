@@ -0,0 +1,142 @@
+import cv2
+import numpy as np
+from typing import Dict, List, Optional, Tuple
+
+from core.config import (
+    IMAGE_SIZE,
+    PREPROCESS_PROFILE,
+    SPECIFIC_IMAGE_SIZES,
+    SPECIFIC_MIN_OBJECT_SIZE,
+)
+from services.buffers import buffer_pool
+from services.detections import Detections
+from services.preprocess import preprocess_image, letterbox
+
+# Варијанти на влезот за моделите:
+# "enhanced" - намалена на imgsz на моделот + профилот за препроцесирање (бинарен модел и банкноти)
+# "raw"      - оригиналната слика (монети)
+
+
+# Најмалата imgsz за специфичниот модел при која објектот (долгата страна, во пиксели)
+# сеуште зафаќа барем SPECIFIC_MIN_OBJECT_SIZE пиксели од влезот на моделот
+def pick_image_size(object_size: float, frame_size: float) -> int:
+    sizes = sorted(SPECIFIC_IMAGE_SIZES)
+    for size in sizes:
+        if object_size * size / max(frame_size, 1) >= SPECIFIC_MIN_OBJECT_SIZE:
+            return size
+    return sizes[-1]
+
+
+# Контекст за едно барање
+# Секоја варијанта на препроцесирање се пресметува најмногу еднаш, и тоа дури кога ќе затреба,
+# а потоа се користи во сите фази на каскадата
+# Ги чува и трансформациите за box-овите да се вратат во координати на оригиналната слика
+# offset е позицијата на сликата во оригиналот (за исечоци од crop(), инаку 0, 0)
+# Letterbox платната се позајмуваат од buffer_pool и се враќаат со release()
+# (заедно со платната на исечоците), после тоа контекстот не се користи
+class PipelineContext:
+    def __init__(self, image: np.ndarray, target_size: int = IMAGE_SIZE,
+                 profile: str = PREPROCESS_PROFILE, offset: Tuple[int, int] = (0, 0)):
+        if image.ndim == 2:
+            image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+
+        self.image = image
+        self.target_size = target_size
+        self.profile = profile
+        self.offset = offset
+
+        self._enhanced: Dict[int, Tuple[np.ndarray, float]] = {}
+        self._letterboxed: Dict[Tuple[str, int], Tuple[np.ndarray, float, Tuple[float, float]]] = {}
+        self._buffers: List[np.ndarray] = []
+        self._crops: List["PipelineContext"] = []
+
+    @property
+    def shape(self) -> Tuple[int, int]:
+        return self.image.shape[:2]
+
+    # Препроцесирана слика според профилот, скала во однос на оригиналот
+    # Се препроцесира директно на големината што ја бара моделот (по една за секоја големина)
+    def enhanced(self, target_size: Optional[int] = None) -> Tuple[np.ndarray, float]:
+        size = target_size or self.target_size
+        if size not in self._enhanced:
+            self._enhanced[size] = preprocess_image(self.image, size, self.profile)
+        return self._enhanced[size]
+
+    def _source(self, variant: str, imgsz: Optional[int] = None) -> Tuple[np.ndarray, float]:
+        if variant == "enhanced":
+            return self.enhanced(imgsz)
+        if variant == "raw":
+            return self.image, 1.0
+        raise ValueError(f"Unknown preprocessing variant: {variant}")
+
+    # Квадратен letterbox влез за моделот (imgsz x imgsz)
+    def model_input(self, variant: str, imgsz: int = IMAGE_SIZE) -> np.ndarray:
+        key = (variant, imgsz)
+        if key not in self._letterboxed:
+            source, _ = self._source(variant, imgsz)
+            canvas = buffer_pool.acquire((1, imgsz, imgsz, 3), np.uint8)
+            self._buffers.append(canvas)
+            self._letterboxed[key] = letterbox(source, imgsz, out=canvas[0])
+        return self._letterboxed[key][0]
+
+    def release(self) -> None:
+        for crop in self._crops:
+            crop.release()
+        for canvas in self._buffers:
+            buffer_pool.release(canvas)
+        self._crops = []
+        self._buffers = []
+        self._letterboxed = {}
+
+    # Box од letterbox координати -> координати на оригиналната слика
+    def to_original(self, bbox: List[float], variant: str, imgsz: int = IMAGE_SIZE) -> List[float]:
+        _, ratio, (pad_x, pad_y) = self._letterboxed[(variant, imgsz)]
+        _, scale = self._source(variant, imgsz)
+        h, w = self.shape
+
+        x1, y1, x2, y2 = bbox
+        factor = ratio * scale
+        off_x, off_y = self.offset
+
+        return [
+            min(max((x1 - pad_x) / factor, 0.0), w) + off_x,
+            min(max((y1 - pad_y) / factor, 0.0), h) + off_y,
+            min(max((x2 - pad_x) / factor, 0.0), w) + off_x,
+            min(max((y2 - pad_y) / factor, 0.0), h) + off_y,
+        ]
+
+    # Контекст за дел од сликата (на пр. box од бинарниот модел), со padding околу него
+    # Box-овите од исечокот се враќаат во координати на целата слика преку offset
+    def crop(self, bbox: List[float], padding: int = 10,
+             target_size: Optional[int] = None) -> "PipelineContext":
+        h, w = self.shape
+        x1, y1, x2, y2 = map(int, bbox)
+        x1, y1 = max(0, x1 - padding), max(0, y1 - padding)
+        x2, y2 = min(w, x2 + padding), min(h, y2 + padding)
+
+        crop = PipelineContext(
+            self.image[y1:y2, x1:x2],
+            target_size or self.target_size,
+            self.profile,
+            (self.offset[0] + x1, self.offset[1] + y1)
+        )
+        self._crops.append(crop)
+        return crop
+
+    # Сите box-ови одеднаш, во место (in-place) врз detections.boxes
+    def map_detections(self, detections: Detections, variant: str,
+                       imgsz: int = IMAGE_SIZE) -> Detections:
+        _, ratio, (pad_x, pad_y) = self._letterboxed[(variant, imgsz)]
+        _, scale = self._source(variant, imgsz)
+        h, w = self.shape
+
+        boxes = detections.boxes
+        boxes -= np.array([pad_x, pad_y, pad_x, pad_y], dtype=np.float32)
+        boxes /= ratio * scale
+        xs, ys = boxes[:, 0::2], boxes[:, 1::2]
+        np.clip(xs, 0, w, out=xs)
+        np.clip(ys, 0, h, out=ys)
+
+        if self.offset != (0, 0):
+            boxes += np.array([*self.offset, *self.offset], dtype=np.float32)
+        return detections
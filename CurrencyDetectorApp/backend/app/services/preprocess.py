@@ -1,27 +1,106 @@
+import threading
+
 import cv2
 import numpy as np
+from typing import Optional, Tuple
 
+from core.config import IMAGE_SIZE, PREPROCESS_PROFILE
 
-def preprocess_image(image: np.ndarray, target_size: int = 640):
-    original_h, original_w = image.shape[:2]
 
-    if image.ndim == 2:
-        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+# Профили за препроцесирање, сите прво ја намалуваат сликата на target_size
+# quality - CLAHE + fastNlMeansDenoisingColored
+# fast    - CLAHE + bilateral филтер (многу побрз denoise што ги чува рабовите)
+# off     - само промена на големина
+PREPROCESS_PROFILES = {
+    "quality": {"clahe": True, "denoise": "nlmeans", "interpolation": cv2.INTER_AREA},
+    "fast": {"clahe": True, "denoise": "bilateral", "interpolation": cv2.INTER_LINEAR},
+    "off": {"clahe": False, "denoise": None, "interpolation": cv2.INTER_LINEAR},
+}
+
+# CLAHE објектите не се thread-safe, па секоја нишка има свој
+_local = threading.local()
+
 
+def get_clahe() -> "cv2.CLAHE":
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+        _local.clahe = clahe
+    return clahe
+
+
+def apply_clahe(image: np.ndarray) -> np.ndarray:
     lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
-    l, a, b = cv2.split(lab)
+    l = get_clahe().apply(cv2.extractChannel(lab, 0))
+    cv2.insertChannel(l, lab, 0)
+    return cv2.cvtColor(lab, cv2.COLOR_LAB2BGR)
+
 
-    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
-    l = clahe.apply(l)
+def denoise(image: np.ndarray, method: Optional[str]) -> np.ndarray:
+    if method == "nlmeans":
+        return cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+    if method == "bilateral":
+        return cv2.bilateralFilter(image, 5, 50, 50)
+    return image
 
-    image = cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
 
-    image = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+def preprocess_image(image: np.ndarray, target_size: int = 640,
+                     profile: str = PREPROCESS_PROFILE):
+    if profile not in PREPROCESS_PROFILES:
+        raise ValueError(
+            f"Unknown preprocessing profile: {profile} "
+            f"(expected one of {list(PREPROCESS_PROFILES)})"
+        )
+    settings = PREPROCESS_PROFILES[profile]
+
+    original_h, original_w = image.shape[:2]
+
+    if image.ndim == 2:
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
 
     scale = target_size / max(original_h, original_w)
     new_w = int(original_w * scale)
     new_h = int(original_h * scale)
 
-    image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    # Прво намалување, па CLAHE и denoise на многу помалку пиксели
+    interpolation = settings["interpolation"] if scale < 1 else cv2.INTER_LINEAR
+    image = cv2.resize(image, (new_w, new_h), interpolation=interpolation)
+
+    if settings["clahe"]:
+        image = apply_clahe(image)
+
+    image = denoise(image, settings["denoise"])
 
     return image, scale
+
+
+# Letterbox: ја намалува сликата со зачуван сооднос и ја центрира на imgsz x imgsz
+# Ги враќа и ratio и padding за box-овите да се вратат во оригинални координати
+# Со out (однапред алоцирано imgsz x imgsz x 3 платно) резултатот се пишува во него
+def letterbox(image: np.ndarray, imgsz: int = IMAGE_SIZE,
+              color: Tuple[int, int, int] = (114, 114, 114),
+              out: Optional[np.ndarray] = None) -> Tuple[np.ndarray, float, Tuple[float, float]]:
+    h, w = image.shape[:2]
+    ratio = min(imgsz / h, imgsz / w)
+    new_w, new_h = int(round(w * ratio)), int(round(h * ratio))
+
+    pad_w = (imgsz - new_w) / 2
+    pad_h = (imgsz - new_h) / 2
+    top, bottom = int(round(pad_h - 0.1)), int(round(pad_h + 0.1))
+    left, right = int(round(pad_w - 0.1)), int(round(pad_w + 0.1))
+
+    if out is not None:
+        out[:] = color
+        view = out[top:top + new_h, left:left + new_w]
+        if (new_w, new_h) != (w, h):
+            cv2.resize(image, (new_w, new_h), dst=view, interpolation=cv2.INTER_LINEAR)
+        else:
+            view[:] = image
+        return out, ratio, (left, top)
+
+    if (new_w, new_h) != (w, h):
+        image = cv2.resize(image, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+
+    image = cv2.copyMakeBorder(image, top, bottom, left, right, cv2.BORDER_CONSTANT, value=color)
+
+    return image, ratio, (left, top)
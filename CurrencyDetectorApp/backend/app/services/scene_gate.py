@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+import cv2
+import numpy as np
+
+from core.config import (
+    SCENE_GATE_SIZE,
+    SCENE_GATE_THRESHOLD,
+    SCENE_GATE_MAX_REUSE,
+    SCENE_GATE_MAX_SESSIONS,
+)
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+# Евтина проверка пред detect_currency, по сесија
+# Секоја слика се намалува на мала сива сличица (size x size) и се споредува со сличицата
+# од последната слика што поминала низ моделите
+# Ако просечната апсолутна разлика (0-255) е под threshold, се враќа претходниот резултат
+# Најмногу max_reuse слики по ред го користат истиот резултат, потоа моделите се пуштаат пак
+class SceneGate:
+    def __init__(self, threshold: float = SCENE_GATE_THRESHOLD, size: int = SCENE_GATE_SIZE,
+                 max_reuse: int = SCENE_GATE_MAX_REUSE):
+        self.threshold = threshold
+        self.size = size
+        self.max_reuse = max_reuse
+
+        self._lock = threading.Lock()
+        self._reference: Optional[np.ndarray] = None
+        self._reference_shape = None
+        self._pending: Optional[np.ndarray] = None
+        self._pending_shape = None
+        self._result: Optional[Dict] = None
+        self._reused = 0
+
+        self.checks = 0
+        self.skipped = 0
+
+    def _thumbnail(self, image: np.ndarray) -> np.ndarray:
+        small = cv2.resize(image, (self.size, self.size), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small
+
+    # Претходниот резултат ако сцената не се сменила, инаку None (треба да се пуштат моделите,
+    # а резултатот потоа се предава на update())
+    def check(self, image: np.ndarray) -> Optional[Dict]:
+        thumb = self._thumbnail(image)
+        shape = image.shape[:2]
+
+        with self._lock:
+            self.checks += 1
+
+            if (self._result is not None and self._reused < self.max_reuse
+                    and shape == self._reference_shape
+                    and float(cv2.absdiff(thumb, self._reference).mean()) <= self.threshold):
+                self._reused += 1
+                self.skipped += 1
+                return {**self._result, "gated": True}
+
+            self._pending = thumb
+            self._pending_shape = shape
+            return None
+
+    def update(self, result: Dict) -> None:
+        with self._lock:
+            if self._pending is None:
+                return
+            self._reference, self._reference_shape = self._pending, self._pending_shape
+            self._pending = None
+            self._result = result
+            self._reused = 0
+
+    def reset(self) -> None:
+        with self._lock:
+            self._reference = None
+            self._pending = None
+            self._result = None
+            self._reused = 0
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "checks": self.checks,
+                "model_calls_saved": self.skipped,
+                "saved_ratio": self.skipped / self.checks if self.checks else 0.0,
+            }
+
+
+# Сесиите за /detect (session_id од клиентот), LRU, најмногу max_sessions
+# Бројачите од исфрлените сесии остануваат во вкупната статистика
+class SceneGateRegistry:
+    def __init__(self, max_sessions: int = SCENE_GATE_MAX_SESSIONS):
+        self.max_sessions = max(1, max_sessions)
+        self._gates: "OrderedDict[str, SceneGate]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self._retired_checks = 0
+        self._retired_skipped = 0
+
+    def get(self, session_id: str) -> SceneGate:
+        with self._lock:
+            gate = self._gates.get(session_id)
+            if gate is not None:
+                self._gates.move_to_end(session_id)
+                return gate
+
+            gate = self._gates[session_id] = SceneGate()
+            while len(self._gates) > self.max_sessions:
+                _, oldest = self._gates.popitem(last=False)
+                self._retired_checks += oldest.checks
+                self._retired_skipped += oldest.skipped
+            return gate
+
+    def stats(self) -> Dict:
+        with self._lock:
+            gates = list(self._gates.values())
+            checks = self._retired_checks + sum(gate.checks for gate in gates)
+            skipped = self._retired_skipped + sum(gate.skipped for gate in gates)
+
+        return {
+            "sessions": len(gates),
+            "checks": checks,
+            "model_calls_saved": skipped,
+            "saved_ratio": skipped / checks if checks else 0.0,
+        }
@@ -0,0 +1,134 @@
+import gzip
+import json
+from typing import Dict, Optional, Tuple
+
+from core.config import COMPRESS_MIN_BYTES, COMPRESS_LEVEL
+
+# orjson и msgpack се опционални (види requirements.txt)
+# Без orjson се користи стандардниот json, без msgpack се враќа секогаш JSON
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack", "application/vnd.msgpack")
+
+# Кратки клучеви за компактниот одговор (?compact=true)
+COMPACT_KEYS = {
+    "success": "ok",
+    "type": "t",
+    "count": "n",
+    "detections": "d",
+    "message": "m",
+    "tts_text": "s",
+    "total_value": "v",
+    "counts": "k",
+    "grid_url": "G",
+}
+COMPACT_DETECTION_KEYS = {
+    "id": "i",
+    "class_name": "c",
+    "confidence": "p",
+    "bbox": "b",
+    "type": "t",
+    "image_url": "u",
+    "image": "g",
+}
+
+
+# Компактна детекција: box во цели пиксели, confidence на 3 децимали, кратки клучеви
+def compact_detection(detection: Dict) -> Dict:
+    compact = {}
+    for key, value in detection.items():
+        if key == "bbox":
+            value = [int(round(v)) for v in value]
+        elif key == "confidence":
+            value = round(float(value), 3)
+        compact[COMPACT_DETECTION_KEYS.get(key, key)] = value
+    return compact
+
+
+# Компактен одговор: кратки клучеви и без полиња што се None (на пр. tts_audio)
+def compact_payload(payload: Dict) -> Dict:
+    compact = {}
+    for key, value in payload.items():
+        if value is None:
+            continue
+        if key == "detections":
+            value = [compact_detection(det) for det in value]
+        compact[COMPACT_KEYS.get(key, key)] = value
+    return compact
+
+
+# "msgpack" ако клиентот го бара во Accept и msgpack е инсталиран, инаку "json"
+def negotiate_wire_format(accept: Optional[str]) -> str:
+    accept = (accept or "").lower()
+    if msgpack is not None and any(media_type in accept for media_type in MSGPACK_TYPES):
+        return "msgpack"
+    return "json"
+
+
+# Враќа (бајти, media type)
+def serialize(payload: Dict, wire_format: str = "json") -> Tuple[bytes, str]:
+    if wire_format == "msgpack":
+        return msgpack.packb(payload, use_bin_type=True), "application/msgpack"
+
+    if orjson is not None:
+        return orjson.dumps(payload), "application/json"
+
+    body = json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return body, "application/json"
+
+
+def deserialize(body: bytes, wire_format: str = "json") -> Dict:
+    if wire_format == "msgpack":
+        return msgpack.unpackb(body, raw=False)
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+# Обратно од compact_payload (кратки клучеви -> полни), за кеширани одговори
+def expand_payload(payload: Dict) -> Dict:
+    full_keys = {short: key for key, short in COMPACT_KEYS.items()}
+    full_detection_keys = {short: key for key, short in COMPACT_DETECTION_KEYS.items()}
+
+    if "detections" in payload or "d" not in payload:
+        return payload
+
+    expanded = {full_keys.get(key, key): value for key, value in payload.items()}
+    expanded["detections"] = [
+        {full_detection_keys.get(key, key): value for key, value in det.items()}
+        for det in expanded["detections"]
+    ]
+    return expanded
+
+
+# Кеширан одговор за копија од сликата со друга резолуција: box-овите се множат со factor
+def rescale_boxes(body: bytes, wire_format: str, factor: float) -> bytes:
+    payload = deserialize(body, wire_format)
+    compact = "d" in payload
+    detections_key, bbox_key = ("d", "b") if compact else ("detections", "bbox")
+
+    for det in payload.get(detections_key, []):
+        bbox = [v * factor for v in det[bbox_key]]
+        det[bbox_key] = [int(round(v)) for v in bbox] if compact else bbox
+
+    return serialize(payload, wire_format)[0]
+
+
+def media_type_for(wire_format: str) -> str:
+    return "application/msgpack" if wire_format == "msgpack" else "application/json"
+
+
+# gzip само за поголеми одговори и само ако клиентот го прифаќа
+# Враќа (бајти, Content-Encoding или None)
+def compress(body: bytes, accept_encoding: Optional[str]) -> Tuple[bytes, Optional[str]]:
+    if len(body) < COMPRESS_MIN_BYTES or "gzip" not in (accept_encoding or "").lower():
+        return body, None
+    return gzip.compress(body, compresslevel=COMPRESS_LEVEL), "gzip"
@@ -0,0 +1,85 @@
+import asyncio
+import time
+from typing import Dict, Optional, Tuple
+
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+# Слот за најновата слика од live стрим (latest-frame-wins)
+# Секоја нова слика ја заменува претходната ако таа сеуште не е земена за обработка,
+# па серверот секогаш ја обработува најновата слика, а доцнењето останува ограничено
+# и кога клиентот праќа побрзо отколку што моделите стигнуваат
+class LatestFrameSlot:
+    def __init__(self):
+        self._frame: Optional[Tuple[int, bytes, float]] = None
+        self._ready = asyncio.Event()
+        self._closed = False
+
+        self.received = 0
+        self.dropped = 0
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    # Враќа секвентен број на сликата
+    def put(self, data: bytes) -> int:
+        self.received += 1
+        if self._frame is not None:
+            self.dropped += 1
+
+        self._frame = (self.received, data, time.perf_counter())
+        self._ready.set()
+        return self.received
+
+    def close(self) -> None:
+        self._closed = True
+        self._ready.set()
+
+    # Чека нова слика, враќа (seq, bytes, received_at) или None кога стримот е затворен
+    async def get(self) -> Optional[Tuple[int, bytes, float]]:
+        while self._frame is None:
+            if self._closed:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+
+        frame, self._frame = self._frame, None
+        return frame
+
+    def stats(self) -> Dict:
+        return {
+            "received": self.received,
+            "dropped": self.dropped,
+        }
+
+
+# Компактен резултат за една слика од стримот: без исечоци (base64) и без TTS,
+# box-овите се заокружени на цели пиксели
+# tracked / gated се True кога резултатот е од tracker-от или од scene gate, без моделите
+# scale е од декодирањето (декодирана / оригинална), box-овите се во оригинални координати
+def compact_result(seq: int, result: Dict, latency: float, dropped: int,
+                   scale: float = 1.0) -> Dict:
+    detections = []
+    for det in result.get("detections", []):
+        data = {
+            "class_name": det["class_name"],
+            "confidence": round(float(det.get("ensemble_confidence", det["confidence"])), 3),
+            "bbox": [int(round(v / scale)) for v in det["bbox"]],
+        }
+        if "track_id" in det:
+            data["track_id"] = det["track_id"]
+        detections.append(data)
+
+    return {
+        "seq": seq,
+        "success": bool(result.get("success", False)),
+        "type": result.get("type"),
+        "detections": detections,
+        "tracked": bool(result.get("tracked", False)),
+        "gated": bool(result.get("gated", False)),
+        "latency_ms": round(latency * 1000.0, 1),
+        "dropped": dropped,
+    }
@@ -0,0 +1,266 @@
+import cv2
+import numpy as np
+from typing import Callable, Dict, List, Optional, Tuple
+
+from core.config import (
+    TRACK_KEYFRAME_INTERVAL,
+    TRACK_MIN_POINTS_RATIO,
+    TRACK_MAX_BACKGROUND_CHANGE,
+    TRACK_MIN_CONFIDENCE,
+    TRACK_MAX_FB_ERROR,
+    TRACK_WIDTH,
+)
+from services.detections import box_iou
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+# Параметри за sparse optical flow (Lucas-Kanade) и за точките што се следат
+LK_PARAMS = dict(
+    winSize=(15, 15),
+    maxLevel=2,
+    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03),
+)
+MAX_TRACK_POINTS = 40
+MAX_FB_ERROR = 1.0  # forward-backward грешка во пиксели (на намалената слика)
+
+
+# Еден објект што се следи помеѓу keyframe-ови
+# Класата се одредува на keyframe-от каде објектот е прв пат виден и не се менува
+class Track:
+    def __init__(self, track_id: int, detection: Dict, box: np.ndarray):
+        self.track_id = track_id
+        self.class_name = detection["class_name"]
+        self.class_id = detection.get("class_id")
+        self.confidence = float(detection.get("ensemble_confidence", detection["confidence"]))
+        self.box = box  # xyxy, во координати на намалената слика
+        self.points: Optional[np.ndarray] = None
+        self.keyframe_points = 0  # број на точки на последниот keyframe
+
+
+# Стриминг режим околу CurrencyDetector
+# Целата каскада (бинарен + специфичен модел) се пушта само на keyframe-ови
+# Помеѓу нив box-овите се носат понатаму со optical flow, а каскадата се пушта пак кога:
+# - поминале keyframe_interval слики
+# - премалку точки преживеале (објектот се изгубил или flow-от "залутал")
+# - детекцијата на keyframe-от била несигурна (confidence под min_confidence)
+# - медијаната на forward-backward грешката пораснала над max_fb_error (следењето слабее)
+# - box-от излегол од сликата
+# - се сменила позадината надвор од box-овите (нов објект или поместена камера)
+# Состојбата е по сесија (еден FrameTracker за еден стрим)
+class FrameTracker:
+    def __init__(self, keyframe_interval: int = TRACK_KEYFRAME_INTERVAL,
+                 min_points_ratio: float = TRACK_MIN_POINTS_RATIO,
+                 max_background_change: float = TRACK_MAX_BACKGROUND_CHANGE,
+                 min_confidence: float = TRACK_MIN_CONFIDENCE,
+                 max_fb_error: float = TRACK_MAX_FB_ERROR,
+                 width: int = TRACK_WIDTH):
+        self.keyframe_interval = max(1, keyframe_interval)
+        self.min_points_ratio = min_points_ratio
+        self.max_background_change = max_background_change
+        self.min_confidence = min_confidence
+        self.max_fb_error = max_fb_error
+        self.width = width
+
+        self.tracks: List[Track] = []
+        self._next_id = 1
+        self._gray: Optional[np.ndarray] = None
+        self._scale = 1.0
+        self._since_keyframe = 0
+        self._last_result: Optional[Dict] = None
+
+        self.frames = 0
+        self.keyframes = 0
+        self.reasons: Dict[str, int] = {}
+
+    def reset(self) -> None:
+        self.tracks = []
+        self._gray = None
+        self._last_result = None
+
+    # Сива, намалена слика за flow (scale = намалена / оригинал)
+    def _prepare(self, image: np.ndarray):
+        h, w = image.shape[:2]
+        scale = min(1.0, self.width / max(w, 1))
+        small = cv2.resize(image, (int(w * scale), int(h * scale)), interpolation=cv2.INTER_AREA)
+        if small.ndim == 3:
+            small = cv2.cvtColor(small, cv2.COLOR_BGR2GRAY)
+        return small, scale
+
+    def _keyframe_needed(self, reason: str) -> None:
+        self.reasons[reason] = self.reasons.get(reason, 0) + 1
+        return None
+
+    # Обид да се одговори без моделите
+    # Враќа резултат (ист формат како detect()) или None кога треба keyframe
+    def step(self, image: np.ndarray) -> Optional[Dict]:
+        self.frames += 1
+
+        if self._gray is None:
+            return self._keyframe_needed("first")
+        if self._since_keyframe + 1 >= self.keyframe_interval:
+            return self._keyframe_needed("interval")
+        # Несигурна детекција не се носи понатаму, каскадата ја проверува на секоја слика
+        if any(track.confidence < self.min_confidence for track in self.tracks):
+            return self._keyframe_needed("low_confidence")
+
+        gray, _ = self._prepare(image)
+        if gray.shape != self._gray.shape:
+            return self._keyframe_needed("resolution")
+
+        moved = []
+        for track in self.tracks:
+            followed = self._follow(track, gray)
+            if followed is None:
+                return self._keyframe_needed("lost")
+            box, error = followed
+            if error > self.max_fb_error:
+                return self._keyframe_needed("drift")
+            moved.append(box)
+
+        h, w = gray.shape
+        for box in moved:
+            x1, y1, x2, y2 = box
+            if x1 < 0 or y1 < 0 or x2 > w or y2 > h:
+                return self._keyframe_needed("left_frame")
+
+        if self._background_change(gray, moved) > self.max_background_change:
+            return self._keyframe_needed("scene")
+
+        for track, box in zip(self.tracks, moved):
+            track.box = box
+        self._gray = gray
+        self._since_keyframe += 1
+
+        return self._result(tracked=True)
+
+    # Резултат од каскадата на keyframe: ги обновува track-овите
+    # Детекциите што се преклопуваат со постоечки track го задржуваат неговиот id и класа
+    def update(self, image: np.ndarray, result: Dict) -> Dict:
+        gray, scale = self._prepare(image)
+        detections = result.get("detections", []) if result.get("success") else []
+
+        boxes = np.array([d["bbox"] for d in detections], dtype=np.float32).reshape(-1, 4) * scale
+        old_boxes = np.array([t.box for t in self.tracks], dtype=np.float32).reshape(-1, 4)
+        iou = box_iou(boxes, old_boxes) if len(boxes) and len(old_boxes) else None
+
+        tracks = []
+        used = set()
+        for i, (det, box) in enumerate(zip(detections, boxes)):
+            match = None
+            if iou is not None:
+                j = int(iou[i].argmax())
+                if iou[i, j] > 0.3 and j not in used:
+                    match = self.tracks[j]
+                    match.confidence = float(det.get("ensemble_confidence", det["confidence"]))
+                    used.add(j)
+
+            if match is None:
+                match = Track(self._next_id, det, box)
+                self._next_id += 1
+            match.box = box
+            match.points = self._features(gray, box)
+            match.keyframe_points = len(match.points) if match.points is not None else 0
+            tracks.append(match)
+
+        self.tracks = tracks
+        self._gray = gray
+        self._scale = scale
+        self._since_keyframe = 0
+        self.keyframes += 1
+
+        # Неуспешниот резултат (нема валута) се враќа непроменет и помеѓу keyframe-ови
+        self._last_result = result
+        return self._result(tracked=False)
+
+    # Синхрон помошник: следење ако може, инаку целата каскада
+    def process(self, image: np.ndarray, detect_fn: Callable[[np.ndarray], Dict]) -> Dict:
+        result = self.step(image)
+        if result is None:
+            result = self.update(image, detect_fn(image))
+        return result
+
+    def _features(self, gray: np.ndarray, box: np.ndarray) -> Optional[np.ndarray]:
+        h, w = gray.shape
+        x1, y1, x2, y2 = np.clip(box, 0, [w, h, w, h]).astype(int)
+        if x2 - x1 < 4 or y2 - y1 < 4:
+            return None
+
+        mask = np.zeros_like(gray)
+        mask[y1:y2, x1:x2] = 255
+        return cv2.goodFeaturesToTrack(
+            gray, maxCorners=MAX_TRACK_POINTS, qualityLevel=0.01, minDistance=5, mask=mask
+        )
+
+    # Median flow: точките се следат напред и назад, остануваат оние со мала грешка,
+    # а box-от се поместува и скалира според медијаната од нивното движење
+    # Враќа (box, медијана на forward-backward грешката) или None кога објектот е изгубен
+    def _follow(self, track: Track, gray: np.ndarray) -> Optional[Tuple[np.ndarray, float]]:
+        points = track.points
+        if points is None or len(points) < 2:
+            return None
+
+        forward, status, _ = cv2.calcOpticalFlowPyrLK(self._gray, gray, points, None, **LK_PARAMS)
+        backward, status_back, _ = cv2.calcOpticalFlowPyrLK(gray, self._gray, forward, None, **LK_PARAMS)
+
+        fb_error = np.linalg.norm(points - backward, axis=2).reshape(-1)
+        good = (status.reshape(-1) == 1) & (status_back.reshape(-1) == 1) & (fb_error < MAX_FB_ERROR)
+        if good.sum() < max(2, self.min_points_ratio * track.keyframe_points):
+            return None
+
+        old = points.reshape(-1, 2)[good]
+        new = forward.reshape(-1, 2)[good]
+        shift = np.median(new - old, axis=0)
+
+        old_spread = np.linalg.norm(old - old.mean(axis=0), axis=1)
+        new_spread = np.linalg.norm(new - new.mean(axis=0), axis=1)
+        valid = old_spread > 1e-3
+        zoom = float(np.median(new_spread[valid] / old_spread[valid])) if valid.any() else 1.0
+
+        center = (track.box[:2] + track.box[2:]) / 2 + shift
+        half = (track.box[2:] - track.box[:2]) / 2 * zoom
+
+        box = np.concatenate([center - half, center + half]).astype(np.float32)
+        track.points = new.reshape(-1, 1, 2)
+        return box, float(np.median(fb_error[good]))
+
+    # Просечна апсолутна разлика (0-255) надвор од track-овите, во однос на претходната слика
+    def _background_change(self, gray: np.ndarray, boxes: List[np.ndarray]) -> float:
+        mask = np.ones(gray.shape, dtype=bool)
+        h, w = gray.shape
+        for box in boxes:
+            x1, y1, x2, y2 = np.clip(box, 0, [w, h, w, h]).astype(int)
+            mask[y1:y2, x1:x2] = False
+        if not mask.any():
+            return 0.0
+
+        diff = cv2.absdiff(gray, self._gray)
+        return float(diff[mask].mean())
+
+    def _result(self, tracked: bool) -> Dict:
+        result = dict(self._last_result or {})
+        result["tracked"] = tracked
+
+        if not self.tracks:
+            return result
+
+        result["detections"] = [
+            {
+                "bbox": (track.box / self._scale).tolist(),
+                "confidence": track.confidence,
+                "class_id": track.class_id,
+                "class_name": track.class_name,
+                "track_id": track.track_id,
+            }
+            for track in self.tracks
+        ]
+        return result
+
+    def stats(self) -> Dict:
+        return {
+            "frames": self.frames,
+            "keyframes": self.keyframes,
+            "tracked_frames": self.frames - self.keyframes,
+            "keyframe_ratio": self.keyframes / self.frames if self.frames else 0.0,
+            "keyframe_reasons": dict(self.reasons),
+        }
@@ -0,0 +1,335 @@
+import multiprocessing as mp
+import os
+import queue
+import threading
+from multiprocessing import shared_memory
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import (
+    MODEL_BACKEND,
+    NUM_PROCESS_WORKERS,
+    SHM_SLOT_BYTES,
+    WORKER_RESPONSE_TIMEOUT,
+    WORKER_START_TIMEOUT,
+)
+from core.logging import get_logger
+
+logger = get_logger(__name__)
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    # Родителот е сопственик на меморијата, работникот само се приклучува
+    # Пред Python 3.13 нема track=False, но spawn работниците го делат
+    # resource tracker-от на родителот, па повторната регистрација е безопасна
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+
+# Главна функција на работничкиот процес
+# Секој процес има сопствен CurrencyDetector и сопствен shared memory слот
+def _worker_main(model_paths: Dict[str, str], device: Optional[str], shm_name: str,
+                 conn, torch_threads: int) -> None:
+    shm = _attach_shared_memory(shm_name)
+
+    try:
+        import cv2
+        from services.inference import CurrencyDetector
+
+        # Секој процес добива свој дел од јадрата, без преоптоварување
+        # torch се увезува само за pt backend-от (onnx не го користи, а увозот трае секунди)
+        if MODEL_BACKEND == "pt":
+            import torch
+            torch.set_num_threads(torch_threads)
+        cv2.setNumThreads(torch_threads)
+
+        detector = CurrencyDetector(model_paths, device)
+        # Секој процес се загрева сам, пред да јави дека е спремен
+        detector.warmup()
+        conn.send(("ready", os.getpid()))
+    except Exception as e:
+        conn.send(("error", str(e)))
+        shm.close()
+        return
+
+    # Методите на детекторот што може да ги побара родителот
+    methods = {
+        "detect_batch": detector.detect_batch,
+        "detect_all_batch": detector.detect_all_batch,
+    }
+
+    try:
+        while True:
+            message = conn.recv()
+            if message is None:
+                break
+
+            method, layout = message
+            frames = [
+                np.ndarray(shape, dtype=np.uint8, buffer=shm.buf, offset=offset)
+                for offset, shape in layout
+            ]
+            try:
+                conn.send(("ok", methods[method](frames)))
+            except Exception as e:
+                conn.send(("error", str(e)))
+            finally:
+                del frames
+    except (EOFError, KeyboardInterrupt):
+        pass
+    finally:
+        shm.close()
+
+
+class _Worker:
+    def __init__(self, process, conn, shm: shared_memory.SharedMemory):
+        self.process = process
+        self.conn = conn
+        self.shm = shm
+
+
+# Работникот умрел или не одговорил на време; се заменува со нов процес
+class WorkerLostError(RuntimeError):
+    pass
+
+
+# Pool од работнички процеси за инференца
+# Декодираните слики се запишуваат директно во shared memory на работникот,
+# така што низ pipe-от одат само offset-и и shape-ови, а назад само малите резултати
+class WorkerPool:
+    def __init__(
+            self,
+            model_paths: Dict[str, str],
+            device: Optional[str] = None,
+            num_workers: int = NUM_PROCESS_WORKERS,
+            slot_bytes: int = SHM_SLOT_BYTES,
+            response_timeout: float = WORKER_RESPONSE_TIMEOUT
+    ):
+        self.model_paths = {name: str(path) for name, path in model_paths.items()}
+        self.device = device
+        self.num_workers = max(1, num_workers)
+        self.slot_bytes = slot_bytes
+        self.response_timeout = response_timeout
+
+        self._workers: List[_Worker] = []
+        self._idle: "queue.Queue[_Worker]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._running = False
+        self._ctx = mp.get_context("spawn")
+        self._torch_threads = max(1, (os.cpu_count() or 1) // self.num_workers)
+
+        self.replaced = 0
+
+    def _spawn(self) -> _Worker:
+        shm = shared_memory.SharedMemory(create=True, size=self.slot_bytes)
+        parent_conn, child_conn = self._ctx.Pipe()
+        process = self._ctx.Process(
+            target=_worker_main,
+            args=(self.model_paths, self.device, shm.name, child_conn, self._torch_threads),
+            daemon=True
+        )
+        process.start()
+        child_conn.close()
+        return _Worker(process, parent_conn, shm)
+
+    # Чека работникот да ги вчита моделите, инаку го гаси и фрла RuntimeError
+    def _wait_ready(self, worker: _Worker) -> None:
+        if not worker.conn.poll(WORKER_START_TIMEOUT):
+            self._discard(worker)
+            raise RuntimeError("Inference worker did not start in time")
+
+        status, payload = worker.conn.recv()
+        if status != "ready":
+            self._discard(worker)
+            raise RuntimeError(f"Inference worker failed to start: {payload}")
+
+        logger.info(f"Inference worker {payload} ready")
+
+    # Го гаси процесот и го ослободува неговиот shared memory слот
+    @staticmethod
+    def _discard(worker: _Worker) -> None:
+        if worker.process.is_alive():
+            worker.process.terminate()
+        worker.process.join(timeout=5)
+        worker.conn.close()
+        worker.shm.close()
+        try:
+            worker.shm.unlink()
+        except FileNotFoundError:
+            pass
+
+    def start(self) -> None:
+        workers = [self._spawn() for _ in range(self.num_workers)]
+        self._workers = list(workers)
+        self._running = True
+
+        for worker in workers:
+            try:
+                self._wait_ready(worker)
+            except RuntimeError:
+                self._workers.remove(worker)
+                self.stop()
+                raise
+            self._idle.put(worker)
+
+        logger.info(f"Worker pool started with {self.num_workers} processes")
+
+    def stop(self) -> None:
+        with self._lock:
+            self._running = False
+            workers, self._workers = self._workers, []
+
+        for worker in workers:
+            try:
+                worker.conn.send(None)
+            except (BrokenPipeError, OSError):
+                pass
+
+        for worker in workers:
+            worker.process.join(timeout=5)
+            self._discard(worker)
+
+        self._idle = queue.Queue()
+
+    # Мртов или заглавен работник: се гаси веднаш, а нов се стартува во позадина
+    # (вчитувањето на моделите трае), за барањето да не чека на него
+    def _replace(self, worker: _Worker) -> None:
+        with self._lock:
+            if worker not in self._workers:
+                return
+            self._workers.remove(worker)
+
+        logger.warning(f"Replacing inference worker {worker.process.pid}")
+        self._discard(worker)
+        self.replaced += 1
+        threading.Thread(target=self._respawn, daemon=True).start()
+
+    def _respawn(self) -> None:
+        try:
+            worker = self._spawn()
+            self._wait_ready(worker)
+        except Exception as e:
+            logger.error(f"Could not replace inference worker: {e}")
+            return
+
+        with self._lock:
+            if not self._running:
+                self._discard(worker)
+                return
+            self._workers.append(worker)
+        self._idle.put(worker)
+
+    def _chunks(self, images: List[np.ndarray]) -> List[List[np.ndarray]]:
+        chunks, current, used = [], [], 0
+
+        for image in images:
+            if image.nbytes > self.slot_bytes:
+                raise ValueError(
+                    f"Frame of {image.nbytes} bytes does not fit the "
+                    f"{self.slot_bytes} byte shared memory slot"
+                )
+            if used + image.nbytes > self.slot_bytes:
+                chunks.append(current)
+                current, used = [], 0
+            current.append(image)
+            used += image.nbytes
+
+        if current:
+            chunks.append(current)
+
+        return chunks
+
+    def _run_on_worker(self, worker: _Worker, images: List[np.ndarray],
+                       method: str = "detect_batch") -> List[Dict]:
+        layout: List[Tuple[int, Tuple[int, ...]]] = []
+        offset = 0
+
+        for image in images:
+            image = np.ascontiguousarray(image, dtype=np.uint8)
+            np.ndarray(image.shape, dtype=np.uint8, buffer=worker.shm.buf, offset=offset)[...] = image
+            layout.append((offset, image.shape))
+            offset += image.nbytes
+
+        try:
+            worker.conn.send((method, layout))
+            if not worker.conn.poll(self.response_timeout):
+                raise WorkerLostError(
+                    f"Inference worker {worker.process.pid} did not answer "
+                    f"in {self.response_timeout}s"
+                )
+            status, payload = worker.conn.recv()
+        except (EOFError, BrokenPipeError, OSError) as e:
+            raise WorkerLostError(f"Inference worker {worker.process.pid} died: {e}")
+
+        if status != "ok":
+            raise RuntimeError(f"Inference worker error: {payload}")
+
+        return payload
+
+    # Блокирачки повик, безбеден за повеќе нишки
+    # Секоја нишка зема слободен работник, така што N нишки работат паралелно на N процеси
+    def _dispatch(self, images: List[np.ndarray], method: str) -> List[Dict]:
+        if not self._workers:
+            raise RuntimeError("Worker pool not started. Call start() first.")
+
+        results: List[Dict] = []
+        for chunk in self._chunks(images):
+            results.extend(self._run_chunk(chunk, method))
+
+        return results
+
+    # Ако работникот е мртов или заглави, делот се праќа уште еднаш на друг слободен
+    # работник (ако има), за барањето да не падне додека другите чекаат без работа
+    def _run_chunk(self, chunk: List[np.ndarray], method: str) -> List[Dict]:
+        try:
+            # Ако сите работници се мртви, чекаме најмногу колку што трае замената
+            worker = self._idle.get(timeout=WORKER_START_TIMEOUT)
+        except queue.Empty:
+            raise WorkerLostError("No inference worker available")
+
+        for attempt in range(2):
+            try:
+                if not worker.process.is_alive():
+                    raise WorkerLostError(f"Inference worker {worker.process.pid} is not running")
+                result = self._run_on_worker(worker, chunk, method)
+            except WorkerLostError as e:
+                self._replace(worker)
+                if attempt:
+                    raise
+                try:
+                    worker = self._idle.get_nowait()
+                except queue.Empty:
+                    raise e
+                logger.warning(f"{e}, retrying on worker {worker.process.pid}")
+                continue
+            except BaseException:
+                self._idle.put(worker)
+                raise
+
+            self._idle.put(worker)
+            return result
+
+    def detect_batch(self, images: List[np.ndarray]) -> List[Dict]:
+        return self._dispatch(images, "detect_batch")
+
+    def detect(self, image: np.ndarray) -> Dict:
+        return self.detect_batch([image])[0]
+
+    # Мешана сцена: сите банкноти и монети (види CurrencyDetector.detect_all)
+    def detect_all_batch(self, images: List[np.ndarray]) -> List[Dict]:
+        return self._dispatch(images, "detect_all_batch")
+
+    def detect_all(self, image: np.ndarray) -> Dict:
+        return self.detect_all_batch([image])[0]
+
+    def stats(self) -> Dict:
+        return {
+            "workers": self.num_workers,
+            "alive": sum(worker.process.is_alive() for worker in self._workers),
+            "idle": self._idle.qsize(),
+            "replaced": self.replaced,
+            "slot_bytes": self.slot_bytes,
+        }
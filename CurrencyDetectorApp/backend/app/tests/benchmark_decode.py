@@ -0,0 +1,86 @@
+# ============================================================================
+# tests/benchmark_decode.py
+# Decode time and peak memory of the upload decode paths
+# "legacy" is the old path (PIL open + convert("RGB") + np.array + cvtColor),
+# "reduced" is services/decode.py (reduced-size JPEG decode straight to BGR).
+# Peak memory is measured with tracemalloc (NumPy/OpenCV arrays are tracked).
+# Usage:
+#   python tests/benchmark_decode.py [path/to/image_folder] [--repeat N]
+# ============================================================================
+
+import io
+import sys
+import time
+import argparse
+import tracemalloc
+from pathlib import Path
+
+import cv2
+import numpy as np
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.decode import decode_image
+
+
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png")
+DEFAULT_FOLDER = Path(__file__).resolve().parent / "test_images"
+
+
+def legacy_decode(contents):
+    pil_image = Image.open(io.BytesIO(contents)).convert("RGB")
+    return cv2.cvtColor(np.array(pil_image), cv2.COLOR_RGB2BGR)
+
+
+def reduced_decode(contents):
+    return decode_image(contents)[0]
+
+
+def measure(decode, uploads, repeat):
+    timings, peaks = [], []
+    for contents in uploads:
+        for _ in range(repeat):
+            tracemalloc.start()
+            start = time.perf_counter()
+            decode(contents)
+            timings.append(time.perf_counter() - start)
+            peaks.append(tracemalloc.get_traced_memory()[1])
+            tracemalloc.stop()
+    return float(np.median(timings) * 1000), float(np.median(peaks) / (1024 * 1024))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark upload decoding")
+    parser.add_argument("folder", nargs="?", default=str(DEFAULT_FOLDER))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    folder = Path(args.folder)
+    if not folder.exists():
+        print(f"❌ Folder not found: {folder}")
+        sys.exit(1)
+
+    uploads = [
+        path.read_bytes() for path in sorted(folder.iterdir())
+        if path.suffix.lower() in SUPPORTED_EXTENSIONS
+    ]
+    if not uploads:
+        print("❌ No images found")
+        sys.exit(1)
+
+    print("=" * 70)
+    print(f"DECODE BENCHMARK ({len(uploads)} images, {folder})")
+    print("=" * 70)
+
+    print(f"\n{'path':<10}{'decode ms':>12}{'peak MB':>12}")
+    print("-" * 70)
+    for name, decode in (("legacy", legacy_decode), ("reduced", reduced_decode)):
+        decode_ms, peak_mb = measure(decode, uploads, args.repeat)
+        print(f"{name:<10}{decode_ms:>12.1f}{peak_mb:>12.1f}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
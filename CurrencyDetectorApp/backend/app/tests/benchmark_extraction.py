@@ -0,0 +1,239 @@
+# ============================================================================
+# tests/benchmark_extraction.py
+# Per-crop latency of the crop extraction, before and after
+# "legacy" is the old extraction (HoughCircles on the full crop with a wide
+# radius range, morphology close + blur on the mask, LAB split/merge and a new
+# CLAHE object per banknote crop). "batch" is services/extraction.extract_batch.
+# Crops are taken around the center of every image in the folder, one coin-sized
+# square and one banknote-sized rectangle per image.
+# The coin masks of both engines are also compared on the hand-labelled coin boxes
+# in COIN_BOXES (IoU of the alpha masks and the distance between the found circles);
+# the script exits with 1 when the mean IoU is below --min-iou.
+# Usage:
+#   python tests/benchmark_extraction.py [path/to/image_folder] [--repeat N] [--min-iou X]
+#                                        [--accuracy-only]
+# ============================================================================
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from services.extraction import extract_batch, find_coin_circle, remove_background_circular
+
+
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+DEFAULT_FOLDER = Path(__file__).resolve().parent / "test_images"
+
+# Coin boxes in tests/test_images, as fractions of the image (x1, y1, x2, y2)
+COIN_BOXES = {
+    "5_coin.png": (0.33, 0.55, 0.51, 0.73),
+    "5_coin_1.png": (0.49, 0.47, 0.65, 0.66),
+    "image_03.jpg": (0.39, 0.48, 0.69, 0.70),
+    "image_05.jpg": (0.32, 0.43, 0.64, 0.68),
+    "image_06.jpg": (0.25, 0.30, 0.63, 0.59),
+    "image_07.jpg": (0.22, 0.42, 0.59, 0.71),
+    "image_08.jpg": (0.19, 0.35, 0.47, 0.56),
+    "image_09.jpg": (0.30, 0.33, 0.55, 0.60),
+    "image_10.jpg": (0.38, 0.37, 0.68, 0.60),
+    "image_11.jpg": (0.20, 0.44, 0.50, 0.67),
+    "image_12.jpg": (0.38, 0.31, 0.66, 0.49),
+    "image_13.jpg": (0.40, 0.48, 0.69, 0.70),
+}
+
+
+def legacy_find_coin_circle(image):
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+    blurred = cv2.GaussianBlur(gray, (9, 9), 2)
+
+    circles = cv2.HoughCircles(
+        blurred, cv2.HOUGH_GRADIENT, dp=1, minDist=50, param1=50, param2=30,
+        minRadius=int(min(image.shape[:2]) * 0.25),
+        maxRadius=int(max(image.shape[:2]) * 0.55)
+    )
+    return None if circles is None else np.uint16(np.around(circles))[0, 0]
+
+
+def legacy_coin_mask(image, circle):
+    mask = np.zeros(image.shape[:2], dtype=np.uint8)
+    if circle is not None:
+        cv2.circle(mask, (circle[0], circle[1]), int(circle[2] * 1.05), 255, -1)
+    else:
+        h, w = image.shape[:2]
+        cv2.ellipse(mask, (w // 2, h // 2), (int(w * 0.48), int(h * 0.48)), 0, 0, 360, 255, -1)
+
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8), iterations=2)
+    return cv2.GaussianBlur(mask, (5, 5), 0)
+
+
+def legacy_remove_background_circular(image):
+    mask = legacy_coin_mask(image, legacy_find_coin_circle(image))
+
+    bgra = cv2.cvtColor(image, cv2.COLOR_BGR2BGRA)
+    bgra[:, :, 3] = mask
+    return bgra
+
+
+def legacy_enhance_banknote(image):
+    l, a, b = cv2.split(cv2.cvtColor(image, cv2.COLOR_BGR2LAB))
+    l = cv2.createCLAHE(clipLimit=1.5, tileGridSize=(8, 8)).apply(l)
+    enhanced = cv2.cvtColor(cv2.merge([l, a, b]), cv2.COLOR_LAB2BGR)
+
+    kernel = np.array([[-1, -1, -1], [-1, 9, -1], [-1, -1, -1]]) / 9
+    sharpened = cv2.filter2D(enhanced, -1, kernel)
+    return cv2.addWeighted(enhanced, 0.7, sharpened, 0.3, 0)
+
+
+def legacy_extract(image, regions, padding=10):
+    h, w = image.shape[:2]
+    extracted = []
+    for bbox, currency_type in regions:
+        x1, y1, x2, y2 = map(int, bbox)
+        cropped = image[max(0, y1 - padding):min(h, y2 + padding),
+                        max(0, x1 - padding):min(w, x2 + padding)].copy()
+        if currency_type == 'coin':
+            extracted.append(legacy_remove_background_circular(cropped))
+        else:
+            extracted.append(legacy_enhance_banknote(cropped))
+    return extracted
+
+
+def center_regions(image):
+    h, w = image.shape[:2]
+    cx, cy = w // 2, h // 2
+    coin = min(h, w) // 3
+    note_w, note_h = int(w * 0.6), int(h * 0.4)
+    return [
+        ([cx - coin // 2, cy - coin // 2, cx + coin // 2, cy + coin // 2], 'coin'),
+        ([cx - note_w // 2, cy - note_h // 2, cx + note_w // 2, cy + note_h // 2], 'note'),
+    ]
+
+
+def measure(extract, images, repeat):
+    timings = {'coin': [], 'note': []}
+    for image in images:
+        for region in center_regions(image):
+            for _ in range(repeat):
+                start = time.perf_counter()
+                extract(image, [region])
+                timings[region[1]].append(time.perf_counter() - start)
+    return {kind: float(np.median(values) * 1000) for kind, values in timings.items()}
+
+
+def measure_request(extract, images, repeat):
+    timings = []
+    for image in images:
+        regions = center_regions(image)
+        for _ in range(repeat):
+            start = time.perf_counter()
+            extract(image, regions)
+            timings.append((time.perf_counter() - start) / len(regions))
+    return float(np.median(timings) * 1000)
+
+
+def coin_crops(named_images, padding=10):
+    crops = []
+    for name, image in named_images:
+        if name not in COIN_BOXES:
+            continue
+        h, w = image.shape[:2]
+        x1, y1, x2, y2 = COIN_BOXES[name]
+        crops.append((name, image[max(0, int(y1 * h) - padding):min(h, int(y2 * h) + padding),
+                                  max(0, int(x1 * w) - padding):min(w, int(x2 * w) + padding)]))
+    return crops
+
+
+# IoU of the alpha masks (> 127) and the distance between the circle centers
+def compare_coin_masks(named_images):
+    ious, shifts, found = {}, [], 0
+    for name, crop in coin_crops(named_images):
+        legacy_circle = legacy_find_coin_circle(crop)
+        circle = find_coin_circle(crop)
+
+        legacy_mask = legacy_coin_mask(crop, legacy_circle) > 127
+        batch_mask = remove_background_circular(crop)[:, :, 3] > 127
+        union = np.logical_or(legacy_mask, batch_mask).sum()
+        ious[name] = np.logical_and(legacy_mask, batch_mask).sum() / union if union else 1.0
+
+        if (legacy_circle is None) == (circle is None):
+            found += 1
+        if legacy_circle is not None and circle is not None:
+            offset = np.hypot(float(legacy_circle[0]) - circle[0], float(legacy_circle[1]) - circle[1])
+            shifts.append(offset / max(crop.shape[:2]))
+
+    return {
+        "ious": ious,
+        "mean_iou": float(np.mean(list(ious.values()))),
+        "min_iou": float(np.min(list(ious.values()))),
+        "found_agree": found / len(ious),
+        "center_shift": float(np.median(shifts)) if shifts else 0.0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark crop extraction")
+    parser.add_argument("folder", nargs="?", default=str(DEFAULT_FOLDER))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--min-iou", type=float, default=0.8)
+    parser.add_argument("--accuracy-only", action="store_true")
+    args = parser.parse_args()
+
+    folder = Path(args.folder)
+    if not folder.exists():
+        print(f"❌ Folder not found: {folder}")
+        sys.exit(1)
+
+    named_images = [
+        (path.name, image) for path, image in (
+            (path, cv2.imread(str(path))) for path in sorted(folder.iterdir())
+            if path.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+        if image is not None
+    ]
+    images = [image for _, image in named_images]
+    if not images:
+        print("❌ No images found")
+        sys.exit(1)
+
+    print("=" * 70)
+    print(f"EXTRACTION BENCHMARK ({len(images)} images, {folder})")
+    print("=" * 70)
+
+    if not args.accuracy_only:
+        print(f"\n{'engine':<10}{'coin ms':>12}{'note ms':>12}{'per crop ms':>14}")
+        print("-" * 70)
+        for name, extract in (("legacy", legacy_extract), ("batch", extract_batch)):
+            per_kind = measure(extract, images, args.repeat)
+            per_crop = measure_request(extract, images, args.repeat)
+            print(f"{name:<10}{per_kind['coin']:>12.2f}{per_kind['note']:>12.2f}{per_crop:>14.2f}")
+
+        print("=" * 70)
+        print("per crop = one extract call with all crops of an image, divided by the crop count")
+
+    if not any(name in COIN_BOXES for name, _ in named_images):
+        print("No labelled coin boxes in this folder, skipping the mask comparison")
+        return
+
+    accuracy = compare_coin_masks(named_images)
+    print(f"\n{'coin mask vs legacy':<24}{'mean IoU':>10}{'min IoU':>10}{'found':>8}{'shift':>8}")
+    print("-" * 70)
+    print(f"{'':<24}{accuracy['mean_iou']:>10.3f}{accuracy['min_iou']:>10.3f}"
+          f"{accuracy['found_agree']:>8.0%}{accuracy['center_shift']:>8.1%}")
+    print("found = crops where both engines do or do not find a circle, "
+          "shift = median center distance / crop side")
+    for name, iou in accuracy["ious"].items():
+        if iou < args.min_iou:
+            print(f"  {name}: IoU {iou:.3f}")
+
+    if accuracy["mean_iou"] < args.min_iou:
+        print(f"❌ Mean coin mask IoU {accuracy['mean_iou']:.3f} is below {args.min_iou}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# ============================================================================
+# tests/benchmark_preprocess.py
+# Latency and accuracy of the preprocessing profiles
+# Runs every profile over an image folder and reports the preprocessing time,
+# the end-to-end detect time and how often the result (type + class) agrees
+# with the "quality" profile. The images have no labels, so agreement with
+# the default profile is used as the accuracy measure.
+# "legacy" is the old order (CLAHE + denoise at full resolution, then resize).
+# Usage:
+#   python tests/benchmark_preprocess.py [path/to/image_folder] [--repeat N]
+# ============================================================================
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.config import BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL, DEVICE, IMAGE_SIZE
+from services.preprocess import preprocess_image, PREPROCESS_PROFILES
+from services.inference import init_detector
+
+
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+DEFAULT_FOLDER = Path(__file__).resolve().parent / "test_images"
+REFERENCE_PROFILE = "quality"
+
+
+def legacy_preprocess(image, target_size=IMAGE_SIZE):
+    original_h, original_w = image.shape[:2]
+
+    clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8))
+    lab = cv2.cvtColor(image, cv2.COLOR_BGR2LAB)
+    l, a, b = cv2.split(lab)
+    image = cv2.cvtColor(cv2.merge([clahe.apply(l), a, b]), cv2.COLOR_LAB2BGR)
+    image = cv2.fastNlMeansDenoisingColored(image, None, 10, 10, 7, 21)
+
+    scale = target_size / max(original_h, original_w)
+    image = cv2.resize(image, (int(original_w * scale), int(original_h * scale)))
+    return image, scale
+
+
+def time_preprocess(images, profile, repeat):
+    timings = []
+    for image in images:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            if profile == "legacy":
+                legacy_preprocess(image)
+            else:
+                preprocess_image(image, IMAGE_SIZE, profile)
+            timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1000)
+
+
+def summarize(result):
+    if not result["success"]:
+        return (None, None)
+    return (result["type"], result["detections"][0]["class_name"])
+
+
+def run_detection(detector, images, profile):
+    detector.preprocess_profile = profile
+    detector.detect(images[0])
+
+    outcomes, timings = [], []
+    for image in images:
+        start = time.perf_counter()
+        result = detector.detect(image)
+        timings.append(time.perf_counter() - start)
+        outcomes.append(summarize(result))
+
+    return outcomes, float(np.median(timings) * 1000)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark preprocessing profiles")
+    parser.add_argument("folder", nargs="?", default=str(DEFAULT_FOLDER))
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    folder = Path(args.folder)
+    if not folder.exists():
+        print(f"❌ Folder not found: {folder}")
+        sys.exit(1)
+
+    images = [
+        image for image in (
+            cv2.imread(str(path)) for path in sorted(folder.iterdir())
+            if path.suffix.lower() in SUPPORTED_EXTENSIONS
+        )
+        if image is not None
+    ]
+    if not images:
+        print("❌ No images found")
+        sys.exit(1)
+
+    print("=" * 70)
+    print(f"PREPROCESSING BENCHMARK ({len(images)} images, {folder})")
+    print("=" * 70)
+
+    detector = init_detector(
+        {"binary": BINARY_MODEL, "banknote": BANKNOTE_MODEL, "coin": COIN_MODEL},
+        DEVICE
+    )
+
+    profiles = [REFERENCE_PROFILE] + [p for p in PREPROCESS_PROFILES if p != REFERENCE_PROFILE]
+    reference = None
+    rows = []
+
+    for profile in profiles:
+        preprocess_ms = time_preprocess(images, profile, args.repeat)
+        outcomes, detect_ms = run_detection(detector, images, profile)
+
+        if reference is None:
+            reference = outcomes
+        agreement = np.mean([a == b for a, b in zip(outcomes, reference)])
+        rows.append((profile, preprocess_ms, detect_ms, agreement))
+
+    legacy_ms = time_preprocess(images, "legacy", args.repeat)
+
+    print(f"\n{'profile':<10}{'preprocess ms':>15}{'detect ms':>12}{'agreement':>12}")
+    print("-" * 70)
+    print(f"{'legacy':<10}{legacy_ms:>15.1f}{'-':>12}{'-':>12}")
+    for profile, preprocess_ms, detect_ms, agreement in rows:
+        print(f"{profile:<10}{preprocess_ms:>15.1f}{detect_ms:>12.1f}{agreement:>12.0%}")
+
+    print("=" * 70)
+    print(f"Agreement = same type and class as the '{REFERENCE_PROFILE}' profile.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,46 @@
+# ============================================================================
+# tests/export_onnx.py
+# Export the three YOLO models to ONNX for the onnx backend
+# Usage: python tests/export_onnx.py
+# Then set MODEL_BACKEND = "onnx" in core/config.py
+# ============================================================================
+
+import sys
+import shutil
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from ultralytics import YOLO
+
+from core.config import BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL, IMAGE_SIZE
+
+
+def main():
+    print("=" * 70)
+    print("EXPORTING MODELS TO ONNX")
+    print("=" * 70)
+
+    for model_path in (BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL):
+        model = YOLO(str(model_path))
+
+        # dynamic=True дозволува batch со повеќе слики во еден повик
+        exported = model.export(
+            format="onnx",
+            imgsz=IMAGE_SIZE,
+            dynamic=True,
+            simplify=True,
+        )
+
+        destination = model_path.with_suffix(".onnx")
+        if Path(exported).resolve() != destination.resolve():
+            shutil.move(exported, destination)
+
+        print(f"✅ {model_path.name} -> {destination.name}")
+        print(f"   Classes: {list(model.names.values())}")
+
+    print("=" * 70)
+
+
+if __name__ == "__main__":
+    main()
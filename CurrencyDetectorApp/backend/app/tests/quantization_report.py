@@ -0,0 +1,334 @@
+# ============================================================================
+# tests/quantization_report.py
+# Accuracy vs latency report for reduced-precision models
+# Quantizes the ONNX models to INT8 (if needed), then runs the full-precision
+# and reduced-precision models on yolov8_training/datasets/*/test and reports
+# the mAP drop next to the speedup.
+# Usage:
+#   python tests/quantization_report.py [--mode dynamic|static] [--force]
+#                                       [--bf16] [--max-images N]
+# Requires the .onnx models (python tests/export_onnx.py).
+# ============================================================================
+
+import sys
+import time
+import argparse
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from core.config import BASE_DIR, BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL, IMAGE_SIZE
+from services.backends import resolve_model_path
+from services.preprocess import letterbox
+from services.inference import CurrencyDetector
+from services.detections import box_iou
+
+
+DATASETS_DIR = BASE_DIR.parent / "yolov8_training" / "datasets"
+SUPPORTED_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp")
+
+MODEL_PATHS = {
+    "binary": BINARY_MODEL,
+    "banknote": BANKNOTE_MODEL,
+    "coin": COIN_MODEL,
+}
+
+# mAP се пресметува со низок праг, како во ultralytics val
+EVAL_CONFIDENCE = 0.001
+EVAL_IOU = 0.7
+IOU_THRESHOLDS = np.linspace(0.5, 0.95, 10)
+
+
+# ============================================================================
+# QUANTIZATION
+# ============================================================================
+
+class CalibrationReader:
+    """Feeds letterboxed training images to the static INT8 calibrator."""
+
+    def __init__(self, input_name, image_paths, imgsz):
+        self.input_name = input_name
+        self.image_paths = list(image_paths)
+        self.imgsz = imgsz
+
+    def get_next(self):
+        while self.image_paths:
+            image = cv2.imread(str(self.image_paths.pop()))
+            if image is None:
+                continue
+            boxed, _, _ = letterbox(image, self.imgsz)
+            blob = boxed[:, :, ::-1].transpose(2, 0, 1)[None].astype(np.float32) / 255.0
+            return {self.input_name: blob}
+        return None
+
+
+def quantize_models(mode, force, calibration_images=64):
+    import onnxruntime as ort
+    from onnxruntime.quantization import (
+        QuantFormat,
+        QuantType,
+        quantize_dynamic,
+        quantize_static,
+    )
+
+    for name, model_path in MODEL_PATHS.items():
+        source = resolve_model_path(model_path, "onnx")
+        target = resolve_model_path(model_path, "onnx", "int8")
+
+        if not source.exists():
+            print(f"❌ {source.name} not found, run tests/export_onnx.py first")
+            sys.exit(1)
+
+        if target.exists() and not force:
+            print(f"   {target.name} already exists")
+            continue
+
+        print(f"   Quantizing {source.name} ({mode}) ...")
+
+        if mode == "dynamic":
+            quantize_dynamic(str(source), str(target), weight_type=QuantType.QUInt8)
+        else:
+            model_input = ort.InferenceSession(
+                str(source), providers=["CPUExecutionProvider"]
+            ).get_inputs()[0]
+            images = list_images(DATASETS_DIR / name / "train" / "images")[:calibration_images]
+            imgsz = model_input.shape[2] if isinstance(model_input.shape[2], int) else IMAGE_SIZE
+            reader = CalibrationReader(model_input.name, images, imgsz)
+            quantize_static(
+                str(source),
+                str(target),
+                reader,
+                quant_format=QuantFormat.QDQ,
+                per_channel=True,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+            )
+
+        print(f"   ✓ {target.name}")
+
+
+# ============================================================================
+# DATASET
+# ============================================================================
+
+def list_images(folder):
+    return sorted(p for p in folder.iterdir() if p.suffix.lower() in SUPPORTED_EXTENSIONS)
+
+
+def load_labels(label_path, width, height):
+    """YOLO labels (bbox or polygon) -> (xyxy pixel boxes, class ids)."""
+    boxes, classes = [], []
+
+    if label_path.exists():
+        for line in label_path.read_text().splitlines():
+            values = line.split()
+            if len(values) < 5:
+                continue
+
+            cls, coords = int(values[0]), np.array(values[1:], dtype=np.float32)
+
+            if len(coords) == 4:
+                cx, cy, w, h = coords
+                box = [cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2]
+            else:
+                xs, ys = coords[0::2], coords[1::2]
+                box = [xs.min(), ys.min(), xs.max(), ys.max()]
+
+            boxes.append(np.array(box) * [width, height, width, height])
+            classes.append(cls)
+
+    return np.array(boxes, dtype=np.float32).reshape(-1, 4), np.array(classes, dtype=np.int64)
+
+
+def load_dataset(name, max_images):
+    dataset_dir = DATASETS_DIR / name
+    names = yaml.safe_load((dataset_dir / "data.yaml").read_text())["names"]
+
+    samples = []
+    for image_path in list_images(dataset_dir / "test" / "images")[:max_images]:
+        image = cv2.imread(str(image_path))
+        if image is None:
+            continue
+        label_path = dataset_dir / "test" / "labels" / f"{image_path.stem}.txt"
+        samples.append((image, *load_labels(label_path, image.shape[1], image.shape[0])))
+
+    return samples, names
+
+
+# ============================================================================
+# METRICS
+# ============================================================================
+
+def match_predictions(pred_boxes, pred_classes, gt_boxes, gt_classes):
+    """For each prediction and IoU threshold: is it a true positive?"""
+    correct = np.zeros((len(pred_boxes), len(IOU_THRESHOLDS)), dtype=bool)
+    if len(pred_boxes) == 0 or len(gt_boxes) == 0:
+        return correct
+
+    iou = box_iou(gt_boxes, pred_boxes) * (gt_classes[:, None] == pred_classes[None, :])
+
+    for t, threshold in enumerate(IOU_THRESHOLDS):
+        gt_idx, pred_idx = np.nonzero(iou >= threshold)
+        if len(gt_idx) == 0:
+            continue
+
+        order = iou[gt_idx, pred_idx].argsort()[::-1]
+        gt_idx, pred_idx = gt_idx[order], pred_idx[order]
+        _, first = np.unique(pred_idx, return_index=True)
+        gt_idx, pred_idx = gt_idx[first], pred_idx[first]
+        _, first = np.unique(gt_idx, return_index=True)
+        correct[pred_idx[first], t] = True
+
+    return correct
+
+
+def average_precision(recall, precision):
+    recall = np.concatenate(([0.0], recall, [1.0]))
+    precision = np.concatenate(([1.0], precision, [0.0]))
+    precision = np.flip(np.maximum.accumulate(np.flip(precision)))
+
+    x = np.linspace(0, 1, 101)
+    trapezoid = getattr(np, "trapezoid", None) or np.trapz
+    return trapezoid(np.interp(x, recall, precision), x)
+
+
+def mean_average_precision(correct, scores, pred_classes, gt_classes):
+    """Returns (mAP50, mAP50-95) over the classes present in the ground truth."""
+    order = np.argsort(-scores)
+    correct, pred_classes = correct[order], pred_classes[order]
+
+    aps = []
+    for cls in np.unique(gt_classes):
+        mask = pred_classes == cls
+        n_gt = (gt_classes == cls).sum()
+
+        if mask.sum() == 0:
+            aps.append(np.zeros(len(IOU_THRESHOLDS)))
+            continue
+
+        tp = correct[mask].cumsum(axis=0)
+        fp = (~correct[mask]).cumsum(axis=0)
+        recall = tp / (n_gt + 1e-9)
+        precision = tp / (tp + fp)
+
+        aps.append([
+            average_precision(recall[:, t], precision[:, t])
+            for t in range(len(IOU_THRESHOLDS))
+        ])
+
+    if not aps:
+        return 0.0, 0.0
+
+    aps = np.array(aps)
+    return float(aps[:, 0].mean()), float(aps.mean())
+
+
+def evaluate_model(detector, model_name, samples, dataset_names):
+    model = detector.models[model_name]
+    name_to_id = {name: cls for cls, name in dataset_names.items()}
+
+    all_correct, all_scores, all_pred_classes, all_gt_classes = [], [], [], []
+    latencies = []
+
+    for image, gt_boxes, gt_classes in samples:
+        start = time.perf_counter()
+        detections = model.detect([image], EVAL_CONFIDENCE, EVAL_IOU)[0]
+        latencies.append(time.perf_counter() - start)
+
+        pred_boxes, scores = detections.boxes, detections.confidences
+        pred_classes = np.array(
+            [name_to_id.get(detections.class_name(i), -1) for i in range(len(detections))],
+            dtype=np.int64
+        )
+
+        all_correct.append(match_predictions(pred_boxes, pred_classes, gt_boxes, gt_classes))
+        all_scores.append(scores)
+        all_pred_classes.append(pred_classes)
+        all_gt_classes.append(gt_classes)
+
+    map50, map50_95 = mean_average_precision(
+        np.concatenate(all_correct),
+        np.concatenate(all_scores),
+        np.concatenate(all_pred_classes),
+        np.concatenate(all_gt_classes),
+    )
+
+    # Првата слика се прескокнува, бидејќи вклучува warmup
+    return map50, map50_95, float(np.median(latencies[1:] or latencies) * 1000)
+
+
+def cascade_latency(detector, images):
+    detector.detect(images[0])
+
+    start = time.perf_counter()
+    for image in images:
+        detector.detect(image)
+    return (time.perf_counter() - start) / len(images) * 1000
+
+
+# ============================================================================
+# MAIN
+# ============================================================================
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy vs latency for reduced precision")
+    parser.add_argument("--mode", choices=("dynamic", "static"), default="dynamic")
+    parser.add_argument("--force", action="store_true", help="re-quantize existing INT8 models")
+    parser.add_argument("--bf16", action="store_true", help="also evaluate the pt backend in bf16")
+    parser.add_argument("--max-images", type=int, default=1000)
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print("QUANTIZATION REPORT")
+    print("=" * 70)
+
+    print("\nPreparing INT8 models...")
+    quantize_models(args.mode, args.force)
+
+    variants = [("pt", "fp32"), ("onnx", "fp32"), ("onnx", "int8")]
+    if args.bf16:
+        variants.append(("pt", "bf16"))
+
+    datasets = {name: load_dataset(name, args.max_images) for name in MODEL_PATHS}
+    cascade_images = [image for image, _, _ in datasets["binary"][0]]
+
+    rows = []
+    for backend, precision in variants:
+        print(f"\nEvaluating {backend}/{precision} ...")
+        detector = CurrencyDetector(MODEL_PATHS, device="cpu", backend=backend, precision=precision)
+
+        for name, (samples, dataset_names) in datasets.items():
+            map50, map50_95, latency = evaluate_model(detector, name, samples, dataset_names)
+            rows.append((f"{backend}/{precision}", name, map50, map50_95, latency))
+
+        rows.append((f"{backend}/{precision}", "cascade", None, None,
+                     cascade_latency(detector, cascade_images)))
+
+    reference = {model: row for row in rows if row[0] == "pt/fp32" for model in [row[1]]}
+
+    print("\n" + "=" * 70)
+    print(f"{'variant':<12}{'model':<10}{'mAP50':>8}{'mAP50-95':>10}"
+          f"{'ΔmAP50':>9}{'ms/img':>9}{'speedup':>9}")
+    print("-" * 70)
+
+    for variant, model, map50, map50_95, latency in rows:
+        ref = reference[model]
+        speedup = ref[4] / latency if latency else 0.0
+
+        if map50 is None:
+            print(f"{variant:<12}{model:<10}{'-':>8}{'-':>10}{'-':>9}{latency:>9.1f}{speedup:>8.2f}x")
+        else:
+            delta = map50 - ref[2]
+            print(f"{variant:<12}{model:<10}{map50:>8.3f}{map50_95:>10.3f}"
+                  f"{delta:>+9.3f}{latency:>9.1f}{speedup:>8.2f}x")
+
+    print("=" * 70)
+    print("ΔmAP50 and speedup are relative to pt/fp32.")
+
+
+if __name__ == "__main__":
+    main()
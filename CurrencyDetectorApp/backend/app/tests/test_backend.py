@@ -24,9 +24,17 @@ from fastapi.testclient import TestClient
 
 @pytest.fixture(scope="session")
 def client():
-    """Create FastAPI test client."""
+    """Create FastAPI test client, once the models are loaded and warmed up."""
+    import time
     from main import app
-    return TestClient(app)
+
+    with TestClient(app) as test_client:
+        deadline = time.monotonic() + 300
+        while test_client.get("/ready").status_code != 200:
+            assert test_client.get("/ready").json()["stage"] != "failed"
+            assert time.monotonic() < deadline, "Models not ready in time"
+            time.sleep(0.5)
+        yield test_client
 
 
 @pytest.fixture
@@ -87,6 +95,22 @@ class TestConfig:
         assert os.path.exists(BANKNOTE_MODEL), f"Banknote model not found: {BANKNOTE_MODEL}"
         assert os.path.exists(COIN_MODEL), f"Coin model not found: {COIN_MODEL}"
 
+    def test_config_import_is_lazy(self):
+        """Test importing the config neither imports torch nor checks model files."""
+        import subprocess
+
+        code = "import sys, core.config; assert 'torch' not in sys.modules"
+        app_dir = Path(__file__).resolve().parent.parent
+        subprocess.run([sys.executable, "-c", code], cwd=app_dir, check=True)
+
+    def test_validate_model_files(self, monkeypatch, tmp_path):
+        """Test missing model files are reported by validate_model_files."""
+        import core.config as config
+
+        monkeypatch.setattr(config, "BINARY_MODEL", tmp_path / "missing.pt")
+        with pytest.raises(FileNotFoundError):
+            config.validate_model_files()
+
     def test_confidence_thresholds(self):
         """Test confidence threshold values."""
         from core.config import BINARY_CONFIDENCE, BANKNOTE_CONFIDENCE, COIN_CONFIDENCE
@@ -133,6 +157,153 @@ class TestPreprocessing:
         assert len(processed.shape) == 3
         assert processed.shape[2] == 3
 
+    def test_preprocess_profiles(self, sample_image_cv2):
+        """Test every profile returns the same shape and scale."""
+        from services.preprocess import preprocess_image, PREPROCESS_PROFILES
+
+        img = cv2.resize(sample_image_cv2, (1280, 960))
+        for profile in PREPROCESS_PROFILES:
+            processed, scale = preprocess_image(img, target_size=640, profile=profile)
+            assert processed.shape == (480, 640, 3), f"Failed for profile {profile}"
+            assert scale == pytest.approx(0.5)
+
+    def test_preprocess_off_is_resize_only(self):
+        """Test the 'off' profile does nothing but resize."""
+        from services.preprocess import preprocess_image
+
+        img = np.random.randint(0, 255, (480, 640, 3), dtype=np.uint8)
+        processed, scale = preprocess_image(img, target_size=640, profile="off")
+        assert scale == 1.0
+        assert np.array_equal(processed, img)
+
+    def test_preprocess_unknown_profile(self, sample_image_cv2):
+        """Test an unknown profile is rejected."""
+        from services.preprocess import preprocess_image
+
+        with pytest.raises(ValueError):
+            preprocess_image(sample_image_cv2, profile="turbo")
+
+
+class TestPipelineContext:
+    """Test the per-request preprocessing context."""
+
+    def test_enhanced_computed_once(self):
+        """Test the CLAHE + denoise variant is cached."""
+        from services.pipeline import PipelineContext
+
+        ctx = PipelineContext(np.ones((480, 640, 3), dtype=np.uint8) * 128)
+        assert ctx.enhanced() is ctx.enhanced()
+        assert ctx.model_input("enhanced") is ctx.model_input("enhanced")
+        assert ctx.model_input("raw").shape == (640, 640, 3)
+
+    def test_boxes_map_to_original(self):
+        """Test letterbox coordinates map back to the original image."""
+        from services.pipeline import PipelineContext
+
+        # 1280x960 -> ratio 0.5, letterbox pads 80px top and bottom
+        ctx = PipelineContext(np.zeros((960, 1280, 3), dtype=np.uint8))
+        for variant in ("raw", "enhanced"):
+            ctx.model_input(variant)
+            bbox = ctx.to_original([100, 180, 300, 380], variant)
+            assert bbox == pytest.approx([200, 200, 600, 600])
+
+    def test_grayscale_input(self):
+        """Test grayscale images are converted to BGR."""
+        from services.pipeline import PipelineContext
+
+        ctx = PipelineContext(np.ones((100, 200), dtype=np.uint8))
+        assert ctx.image.shape == (100, 200, 3)
+
+    def test_map_detections_matches_to_original(self):
+        """Test vectorized box mapping agrees with the per-box mapping."""
+        from services.pipeline import PipelineContext
+        from services.detections import Detections
+
+        ctx = PipelineContext(np.zeros((960, 1280, 3), dtype=np.uint8))
+        ctx.model_input("enhanced")
+        boxes = [[100, 180, 300, 380], [0, 0, 640, 640]]
+        dets = Detections(np.array(boxes), [0.9, 0.5], [0, 1], {0: "coin", 1: "note"})
+
+        mapped = ctx.map_detections(dets, "enhanced")
+        for box, expected in zip(mapped.boxes, boxes):
+            assert box.tolist() == pytest.approx(ctx.to_original(expected, "enhanced"))
+
+    def test_crop_maps_to_frame(self):
+        """Test boxes found in a crop map back to full-frame coordinates."""
+        from services.pipeline import PipelineContext
+        from services.detections import Detections
+
+        ctx = PipelineContext(np.zeros((960, 1280, 3), dtype=np.uint8))
+        crop = ctx.crop([110, 210, 310, 410], padding=10, target_size=320)
+        assert crop.offset == (100, 200)
+        assert crop.shape == (220, 220)
+
+        # 220x220 -> 320x320, ratio 320 / 220, no padding
+        crop.model_input("raw", 320)
+        dets = Detections(np.array([[0, 0, 160, 160]]), [0.9], [0], {0: "coin"})
+        mapped = crop.map_detections(dets, "raw", 320)
+        assert mapped.boxes[0].tolist() == pytest.approx([100, 200, 210, 310])
+
+    def test_canvases_return_to_pool(self):
+        """Test letterbox canvases come from the buffer pool and go back on release."""
+        from services.buffers import buffer_pool
+        from services.pipeline import PipelineContext
+
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        ctx = PipelineContext(image)
+        ctx.model_input("raw", 416)
+        ctx.crop([10, 10, 200, 200]).model_input("raw", 416)
+        ctx.release()
+
+        before = buffer_pool.stats()
+        ctx = PipelineContext(image)
+        ctx.model_input("raw", 416)
+        ctx.crop([10, 10, 200, 200]).model_input("raw", 416)
+        ctx.release()
+        after = buffer_pool.stats()
+
+        assert after["allocated"] == before["allocated"]
+        assert after["reused"] == before["reused"] + 2
+
+
+class TestDetections:
+    """Test the array-backed detections structure."""
+
+    def test_from_array(self):
+        """Test ultralytics (x1, y1, x2, y2, conf, cls) rows are split into arrays."""
+        from services.detections import Detections
+
+        data = np.array([[0, 0, 10, 10, 0.5, 1], [5, 5, 20, 20, 0.9, 0]], dtype=np.float32)
+        dets = Detections.from_array(data, {0: "coin", 1: "note"})
+        assert len(dets) == 2
+        assert dets.boxes.shape == (2, 4)
+        assert dets.best() == 1
+        assert dets.class_name(dets.best()) == "coin"
+
+    def test_to_dicts(self):
+        """Test conversion to the JSON detection format."""
+        from services.detections import Detections
+
+        dets = Detections(np.array([[1, 2, 3, 4]]), [0.75], [1], {1: "note"})
+        det = dets.to_dicts()[0]
+        assert det == {
+            'bbox': [1.0, 2.0, 3.0, 4.0],
+            'confidence': 0.75,
+            'class_id': 1,
+            'class_name': 'note'
+        }
+        assert isinstance(det['class_id'], int)
+        assert list(dets) == dets.to_dicts()
+
+    def test_empty(self):
+        """Test an empty result has no best detection."""
+        from services.detections import Detections
+
+        dets = Detections.empty({0: "coin"})
+        assert len(dets) == 0
+        assert dets.best() is None
+        assert dets.to_dicts() == []
+
 
 # ============================================================================
 # TEST INFERENCE
@@ -172,6 +343,63 @@ class TestInference:
         result = detector.detect(sample_image_cv2, use_ensemble=True)
         assert isinstance(result, dict)
 
+    def test_detect_batch_returns_list(self, detector, sample_image_cv2):
+        """Test batched detection returns one result per image."""
+        images = [sample_image_cv2, np.zeros((480, 640, 3), dtype=np.uint8)]
+        results = detector.detect_batch(images)
+        assert isinstance(results, list)
+        assert len(results) == len(images)
+        for result in results:
+            assert "success" in result
+            assert "type" in result
+            assert "detections" in result
+
+    def test_detect_batch_empty(self, detector):
+        """Test batched detection with no images."""
+        assert detector.detect_batch([]) == []
+
+    def test_roi_regions(self, detector):
+        """Test ROI crops are used only for boxes that cover a small part of the frame."""
+        from services.pipeline import PipelineContext
+        from services.detections import Detections
+        from core.config import SPECIFIC_IMAGE_SIZES
+
+        ctx = PipelineContext(np.zeros((1000, 1000, 3), dtype=np.uint8))
+        small = Detections(np.array([[100, 100, 200, 200]]), [0.9], [0], {0: "coin"})
+        large = Detections(np.array([[0, 0, 900, 900]]), [0.9], [0], {0: "coin"})
+
+        regions = detector._roi_regions(ctx, small)
+        assert len(regions) == 1
+        crop, imgsz = regions[0]
+        assert crop.offset == (90, 90)
+        assert imgsz in SPECIFIC_IMAGE_SIZES
+        assert detector._roi_regions(ctx, large) is None
+
+    def test_pick_image_size(self):
+        """Test the specific stage resolution follows the object size."""
+        from services.pipeline import pick_image_size
+        from core.config import SPECIFIC_IMAGE_SIZES
+
+        # Large object -> smallest size, tiny object -> full IMAGE_SIZE
+        assert pick_image_size(900, 1000) == min(SPECIFIC_IMAGE_SIZES)
+        assert pick_image_size(50, 4000) == max(SPECIFIC_IMAGE_SIZES)
+        # A note across half of the frame does not need the full resolution
+        assert pick_image_size(500, 1000) < max(SPECIFIC_IMAGE_SIZES)
+        sizes = [pick_image_size(obj, 1000) for obj in (900, 600, 450, 50)]
+        assert sizes == sorted(sizes)
+
+    def test_merge_regions_removes_duplicates(self, detector):
+        """Test overlapping crops do not report the same object twice."""
+        from services.detections import Detections
+
+        names = {0: "5_coin", 1: "10_coin"}
+        first = Detections(np.array([[0, 0, 100, 100]]), [0.9], [0], names)
+        second = Detections(np.array([[2, 2, 100, 100], [0, 0, 100, 100]]), [0.6, 0.7], [0, 1], names)
+
+        merged = detector._merge_regions([first, second], names)
+        assert len(merged) == 2
+        assert sorted(merged.class_ids.tolist()) == [0, 1]
+
     def test_calculate_iou(self, detector):
         """Test IoU calculation."""
         box1 = [0, 0, 100, 100]
@@ -188,6 +416,1091 @@ class TestInference:
         iou_none = detector.calculate_iou(box1, box3)
         assert iou_none == 0.0
 
+    def test_box_iou_matches_calculate_iou(self, detector):
+        """Test the vectorized IoU matrix agrees with the pairwise IoU."""
+        from services.detections import box_iou
+
+        boxes1 = np.array([[0, 0, 100, 100], [50, 50, 150, 150]], dtype=np.float32)
+        boxes2 = np.array([[0, 0, 100, 100], [200, 200, 300, 300], [25, 25, 75, 75]],
+                          dtype=np.float32)
+        matrix = box_iou(boxes1, boxes2)
+        assert matrix.shape == (2, 3)
+        for i, box1 in enumerate(boxes1):
+            for j, box2 in enumerate(boxes2):
+                assert matrix[i, j] == pytest.approx(
+                    detector.calculate_iou(box1.tolist(), box2.tolist())
+                )
+
+    def test_ensemble_vote_fuses_boxes(self, detector):
+        """Test matched boxes are fused with confidence weights."""
+        from services.detections import Detections
+
+        binary = Detections(np.array([[0, 0, 100, 100]]), [0.9], [0], {0: "note"})
+        specific = Detections(
+            np.array([[10, 10, 110, 110], [300, 300, 400, 400]]),
+            [0.3, 0.8], [2, 5], {2: "10_note", 5: "500_note"}
+        )
+
+        fused = detector.ensemble_vote(binary, specific)
+        assert len(fused) == 1
+        assert fused.class_name(0) == "10_note"
+        assert fused.confidences[0] == pytest.approx(0.3)
+        assert fused.boxes[0].tolist() == pytest.approx([2.5, 2.5, 102.5, 102.5])
+
+        det = fused.to_dicts()[0]
+        assert det['binary_confidence'] == pytest.approx(0.9)
+        assert det['ensemble_confidence'] == pytest.approx(0.6)
+
+    def test_ensemble_vote_without_match(self, detector):
+        """Test specific detections are kept when nothing overlaps."""
+        from services.detections import Detections
+
+        binary = Detections(np.array([[0, 0, 10, 10]]), [0.9], [0], {0: "coin"})
+        specific = Detections(np.array([[100, 100, 150, 150]]), [0.7], [1], {1: "5_coin"})
+        assert detector.ensemble_vote(binary, specific) is specific
+
+
+    def test_detect_all_returns_total(self, detector, sample_image_cv2):
+        """Test mixed-scene detection returns every detection and a total value."""
+        result = detector.detect_all(sample_image_cv2)
+        assert "detections" in result
+        assert "total_value" in result
+        assert "counts" in result
+        assert result["total_value"] == sum(
+            int(d["class_name"].split("_")[0]) for d in result["detections"]
+        )
+
+    def test_warmup(self, detector):
+        """Test warmup covers every model at its production shapes and the full cascade."""
+        from core.config import SPECIFIC_IMAGE_SIZES
+
+        shapes = detector.warmup_shapes()
+        assert ("binary", detector.binary_image_size, 1) in shapes
+        for imgsz in SPECIFIC_IMAGE_SIZES:
+            assert ("coin", imgsz, 1) in shapes
+            assert ("banknote", imgsz, 1) in shapes
+
+        timings = detector.warmup(passes=1)
+        assert "cascade" in timings and "cascade_all" in timings
+        assert len(timings) == len(shapes) + 2
+        assert detector.warmup(passes=0) == {}
+
+    def test_build_mixed_result(self, detector):
+        """Test notes and coins are combined into one result."""
+        detections = [
+            {"class_name": "100_note", "confidence": 0.9, "bbox": [0, 0, 10, 10], "type": "note"},
+            {"class_name": "5_coin", "confidence": 0.8, "bbox": [20, 20, 30, 30], "type": "coin"},
+            {"class_name": "5_coin", "confidence": 0.7, "bbox": [40, 40, 50, 50], "type": "coin"},
+            {"class_name": "10_coin", "confidence": 0.1, "bbox": [60, 60, 70, 70], "type": "coin"},
+        ]
+        result = detector._build_mixed_result(detections)
+        assert result["success"] is True
+        assert result["type"] == "mixed"
+        assert len(result["detections"]) == 3
+        assert result["total_value"] == 110
+        assert result["counts"] == {"100_note": 1, "5_coin": 2}
+
+    def test_denomination_value(self):
+        """Test denomination values are read from class names."""
+        from services.detections import denomination_value
+
+        assert denomination_value("2000_note") == 2000
+        assert denomination_value("1_coin") == 1
+        assert denomination_value("note") == 0
+
+# ============================================================================
+# TEST BACKENDS
+# ============================================================================
+
+class TestBackends:
+    """Test the model backends and NumPy post-processing."""
+
+    def test_letterbox(self):
+        """Test letterbox keeps aspect ratio and centers the image."""
+        from services.backends import letterbox
+
+        image = np.ones((300, 500, 3), dtype=np.uint8)
+        boxed, ratio, (pad_x, pad_y) = letterbox(image, 640)
+        assert boxed.shape == (640, 640, 3)
+        assert ratio == pytest.approx(640 / 500)
+        assert pad_x == 0
+        assert pad_y == 128
+
+    def test_letterbox_into_buffer(self):
+        """Test letterbox into a pre-allocated canvas matches the allocating path."""
+        from services.backends import letterbox
+
+        image = np.random.randint(0, 255, (301, 500, 3), dtype=np.uint8)
+        expected, ratio, pad = letterbox(image, 640)
+
+        canvas = np.zeros((640, 640, 3), dtype=np.uint8)
+        boxed, ratio_out, pad_out = letterbox(image, 640, out=canvas)
+        assert boxed is canvas
+        assert (ratio_out, pad_out) == (ratio, pad)
+        assert np.array_equal(boxed, expected)
+
+    def test_buffer_pool_reuse(self):
+        """Test borrowed buffers are returned to the pool and reused."""
+        from services.buffers import BufferPool
+
+        pool = BufferPool(max_free=2)
+        pool.reserve((8, 3, 32, 32), np.float32, count=2)
+        assert pool.stats()["allocated"] == 2
+
+        with pool.borrow((3, 3, 32, 32)) as first, pool.borrow((8, 3, 32, 32)) as second:
+            assert first.shape == (3, 3, 32, 32)
+            assert second.shape == (8, 3, 32, 32)
+        with pool.borrow((1, 3, 32, 32)):
+            pass
+
+        stats = pool.stats()
+        assert stats["allocated"] == 2
+        assert stats["reused"] == 3
+        assert stats["free"] == 2
+
+    def test_nms(self):
+        """Test NMS keeps the best of overlapping boxes."""
+        from services.backends import nms
+
+        boxes = np.array([
+            [0, 0, 100, 100],
+            [5, 5, 105, 105],
+            [200, 200, 300, 300],
+        ], dtype=np.float32)
+        scores = np.array([0.8, 0.9, 0.7], dtype=np.float32)
+        keep = nms(boxes, scores, 0.5)
+        assert list(keep) == [1, 2]
+
+    def test_decode_yolo_output(self):
+        """Test decoding of a raw (4 + nc, anchors) YOLOv8 output."""
+        from services.backends import decode_yolo_output
+
+        output = np.zeros((4 + 2, 3), dtype=np.float32)
+        output[:4, 0] = [50, 50, 20, 20]
+        output[:4, 1] = [300, 300, 40, 40]
+        output[5, 0] = 0.9
+        output[4, 1] = 0.6
+        output[4, 2] = 0.1
+
+        boxes, scores, class_ids = decode_yolo_output(output, 0.25, 0.5)
+        assert len(boxes) == 2
+        assert list(class_ids) == [1, 0]
+        assert boxes[0].tolist() == [40, 40, 60, 60]
+
+    def test_unknown_backend(self):
+        """Test an unknown backend name is rejected."""
+        from services.backends import load_backend
+
+        with pytest.raises(ValueError):
+            load_backend("model.pt", "tflite")
+
+    def test_onnx_model_path(self):
+        """Test ONNX models are resolved next to the .pt files."""
+        from services.backends import resolve_model_path
+        from core.config import BINARY_MODEL
+
+        assert resolve_model_path(BINARY_MODEL, "onnx").suffix == ".onnx"
+        assert resolve_model_path(BINARY_MODEL, "pt") == BINARY_MODEL
+        assert resolve_model_path(BINARY_MODEL, "onnx", "int8").name == "binary_model.int8.onnx"
+
+    def test_unsupported_precision(self):
+        """Test precisions a backend cannot run are rejected."""
+        from services.backends import load_backend
+
+        with pytest.raises(ValueError):
+            load_backend("model.pt", "pt", "cpu", "int8")
+        with pytest.raises(ValueError):
+            load_backend("model.pt", "onnx", "cpu", "bf16")
+
+
+# ============================================================================
+# TEST BATCHING
+# ============================================================================
+
+class TestBatching:
+    """Test the micro-batching scheduler."""
+
+    def test_concurrent_requests_share_batch(self):
+        """Test requests inside the window are run as one batch."""
+        import asyncio
+        from services.batching import MicroBatcher
+
+        calls = []
+
+        def run_batch(images):
+            calls.append(len(images))
+            return [{"id": int(img[0, 0, 0])} for img in images]
+
+        async def scenario():
+            batcher = MicroBatcher(run_batch, window_ms=50, max_batch_size=8)
+            batcher.start()
+            images = [np.full((8, 8, 3), i, dtype=np.uint8) for i in range(3)]
+            results = await asyncio.gather(*(batcher.submit(img) for img in images))
+            await batcher.stop()
+            return results
+
+        results = asyncio.run(scenario())
+        assert [r["id"] for r in results] == [0, 1, 2]
+        assert calls == [3]
+
+    def test_max_batch_size(self):
+        """Test batches never exceed the maximum size."""
+        import asyncio
+        from services.batching import MicroBatcher
+
+        calls = []
+
+        def run_batch(images):
+            calls.append(len(images))
+            return [{} for _ in images]
+
+        async def scenario():
+            batcher = MicroBatcher(run_batch, window_ms=50, max_batch_size=2)
+            batcher.start()
+            images = [np.zeros((8, 8, 3), dtype=np.uint8) for _ in range(5)]
+            await asyncio.gather(*(batcher.submit(img) for img in images))
+            await batcher.stop()
+
+        asyncio.run(scenario())
+        assert sum(calls) == 5
+        assert max(calls) <= 2
+
+    def test_full_queue_rejects(self):
+        """Test submissions beyond the bounded queue are rejected."""
+        import asyncio
+        import threading
+        from services.batching import MicroBatcher
+        from services.executor import QueueFullError
+
+        release = threading.Event()
+
+        def run_batch(images):
+            release.wait()
+            return [{"size": len(images)} for _ in images]
+
+        async def scenario():
+            batcher = MicroBatcher(run_batch, window_ms=0, max_batch_size=1, max_queue=1)
+            batcher.start()
+            running = asyncio.ensure_future(batcher.submit(np.zeros((8, 8, 3))))
+            await asyncio.sleep(0.05)
+            queued = asyncio.ensure_future(batcher.submit(np.zeros((8, 8, 3))))
+            await asyncio.sleep(0.05)
+
+            with pytest.raises(QueueFullError):
+                await batcher.submit(np.zeros((8, 8, 3)))
+            assert batcher.stats()["rejected"] == 1
+
+            release.set()
+            assert await running == {"size": 1}
+            assert await queued == {"size": 1}
+            await batcher.stop()
+
+        asyncio.run(scenario())
+
+    def test_inference_executor_backpressure(self):
+        """Test the executor rejects work once workers and queue are busy."""
+        import asyncio
+        import threading
+        from services.executor import InferenceExecutor, QueueFullError
+
+        release = threading.Event()
+
+        async def scenario():
+            executor = InferenceExecutor(max_workers=1, max_queue=1)
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            assert executor.queue_depth == 1
+            with pytest.raises(QueueFullError):
+                await executor.run(release.wait)
+            release.set()
+            await asyncio.gather(running, queued)
+            stats = executor.stats()
+            executor.shutdown()
+            return stats
+
+        stats = asyncio.run(scenario())
+        assert stats["rejected"] == 1
+        assert stats["completed"] == 2
+        assert stats["queue_depth"] == 0
+
+    def test_cancelled_run_keeps_bound(self):
+        """Test a cancelled waiter still counts until its job leaves the pool."""
+        import asyncio
+        import threading
+        from services.executor import InferenceExecutor, QueueFullError
+
+        release = threading.Event()
+
+        async def scenario():
+            executor = InferenceExecutor(max_workers=1, max_queue=1)
+            running = asyncio.ensure_future(executor.run(release.wait))
+            queued = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+
+            # Client went away: the waiter is cancelled, the job keeps its worker
+            running.cancel()
+            await asyncio.sleep(0.05)
+            with pytest.raises(QueueFullError):
+                await executor.run(release.wait)
+
+            # Cancelled before it started: its queue slot is freed
+            queued.cancel()
+            await asyncio.sleep(0.05)
+            assert executor.queue_depth == 0
+            refill = asyncio.ensure_future(executor.run(release.wait))
+            await asyncio.sleep(0.05)
+            with pytest.raises(QueueFullError):
+                await executor.run(release.wait)
+
+            release.set()
+            await asyncio.gather(running, queued, refill, return_exceptions=True)
+            await asyncio.sleep(0.05)
+            assert await executor.run(lambda: 1) == 1
+            executor.shutdown()
+
+        asyncio.run(scenario())
+
+
+class TestWorkerPool:
+    """Test the multi-process inference pool."""
+
+    def test_worker_pool_matches_detector(self, detector):
+        """Test frames sent through shared memory give the same results."""
+        from core.config import BINARY_MODEL, BANKNOTE_MODEL, COIN_MODEL
+        from services.worker_pool import WorkerPool
+
+        images = [
+            np.full((480, 640, 3), 200, dtype=np.uint8),
+            np.zeros((320, 240, 3), dtype=np.uint8),
+        ]
+        pool = WorkerPool(
+            {"binary": BINARY_MODEL, "banknote": BANKNOTE_MODEL, "coin": COIN_MODEL},
+            device="cpu",
+            num_workers=1,
+        )
+        pool.start()
+        try:
+            results = pool.detect_batch(images)
+        finally:
+            pool.stop()
+
+        assert len(results) == len(images)
+        assert [r["success"] for r in results] == [
+            r["success"] for r in detector.detect_batch(images)
+        ]
+
+    def test_dead_worker_replaced(self):
+        """Test a dead worker is not reused and a new one takes its slot."""
+        import multiprocessing as mp
+        import threading
+        import time
+        from multiprocessing import shared_memory
+        from services.worker_pool import WorkerPool, WorkerLostError, _Worker
+
+        class FakeProcess:
+            def __init__(self, pid, alive):
+                self.pid = pid
+                self.alive = alive
+
+            def is_alive(self):
+                return self.alive
+
+            def terminate(self):
+                self.alive = False
+
+            def join(self, timeout=None):
+                pass
+
+        def fake_worker(pid, alive):
+            parent_conn, child_conn = mp.Pipe()
+            child_conn.send(("ready", pid))
+            shm = shared_memory.SharedMemory(create=True, size=1024)
+            return _Worker(FakeProcess(pid, alive), parent_conn, shm)
+
+        pool = WorkerPool({}, device="cpu", num_workers=1, slot_bytes=1024)
+        dead = fake_worker(1, alive=False)
+        pool._workers = [dead]
+        pool._idle.put(dead)
+        pool._running = True
+        # The replacement only starts after the request failed (no worker to retry on)
+        failed = threading.Event()
+
+        def spawn():
+            failed.wait(5)
+            return fake_worker(2, alive=True)
+
+        pool._spawn = spawn
+
+        with pytest.raises(WorkerLostError):
+            pool.detect_batch([np.zeros((4, 4, 3), dtype=np.uint8)])
+        failed.set()
+
+        deadline = time.monotonic() + 5
+        while pool._idle.qsize() == 0 and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        assert pool.stats()["replaced"] == 1
+        assert [w.process.pid for w in pool._workers] == [2]
+        assert pool._idle.qsize() == 1
+        pool.stop()
+
+    def test_lost_worker_retried_on_idle_worker(self):
+        """Test a request on a dead worker is retried once on another idle worker."""
+        import multiprocessing as mp
+        from multiprocessing import shared_memory
+        from services.worker_pool import WorkerPool, _Worker
+
+        class FakeProcess:
+            def __init__(self, pid, alive):
+                self.pid = pid
+                self.alive = alive
+
+            def is_alive(self):
+                return self.alive
+
+            def terminate(self):
+                self.alive = False
+
+            def join(self, timeout=None):
+                pass
+
+        children = []
+
+        def fake_worker(pid, alive, answer):
+            parent_conn, child_conn = mp.Pipe()
+            child_conn.send(answer)
+            children.append(child_conn)  # open, so the request can be sent
+            shm = shared_memory.SharedMemory(create=True, size=1024)
+            return _Worker(FakeProcess(pid, alive), parent_conn, shm)
+
+        pool = WorkerPool({}, device="cpu", num_workers=2, slot_bytes=1024)
+        dead = fake_worker(1, alive=False, answer=("ready", 1))
+        idle = fake_worker(2, alive=True, answer=("ok", [{"success": True, "count": 0}]))
+        pool._workers = [dead, idle]
+        pool._idle.put(dead)
+        pool._idle.put(idle)
+        pool._running = True
+        pool._spawn = lambda: fake_worker(3, alive=True, answer=("ready", 3))
+
+        results = pool.detect_batch([np.zeros((4, 4, 3), dtype=np.uint8)])
+        assert results == [{"success": True, "count": 0}]
+        assert pool.stats()["replaced"] == 1
+        assert idle in pool._workers and dead not in pool._workers
+        pool.stop()
+
+    def test_frame_too_large(self):
+        """Test frames larger than the shared memory slot are refused."""
+        from services.worker_pool import WorkerPool
+
+        pool = WorkerPool({}, device="cpu", num_workers=1, slot_bytes=100)
+        with pytest.raises(ValueError):
+            pool._chunks([np.zeros((10, 10, 3), dtype=np.uint8)])
+
+
+# ============================================================================
+# TEST DECODE
+# ============================================================================
+
+class TestDecode:
+    """Test the upload decode path."""
+
+    def test_reduced_jpeg_decode(self):
+        """Test large JPEGs are decoded at a reduced size straight to BGR."""
+        from services.decode import decode_image
+
+        image = np.zeros((3000, 4000, 3), dtype=np.uint8)
+        image[:, :, 2] = 255  # red in BGR
+        contents = cv2.imencode(".jpg", image)[1].tobytes()
+
+        decoded, scale = decode_image(contents, max_side=1280)
+        assert decoded.shape == (1500, 2000, 3)
+        assert scale == 0.5
+        assert decoded[750, 1000, 2] > 200
+        assert decoded[750, 1000, 0] < 50
+
+    def test_small_and_png_decode(self):
+        """Test small images keep their size and PNGs are reduced by resizing."""
+        from services.decode import decode_image
+
+        small = np.full((480, 640, 3), 100, dtype=np.uint8)
+        decoded, scale = decode_image(cv2.imencode(".jpg", small)[1].tobytes(), max_side=1280)
+        assert decoded.shape == (480, 640, 3)
+        assert scale == 1.0
+
+        large = np.full((2600, 2600, 3), 100, dtype=np.uint8)
+        decoded, scale = decode_image(cv2.imencode(".png", large)[1].tobytes(), max_side=1280)
+        assert decoded.shape == (1300, 1300, 3)
+        assert scale == 0.5
+
+    def test_gif_decoded_with_pil(self):
+        """Test formats OpenCV cannot read still decode through PIL."""
+        from PIL import Image
+        from services.decode import decode_image
+
+        buffer = io.BytesIO()
+        Image.new("RGB", (400, 300), (255, 0, 0)).save(buffer, format="GIF")
+        decoded, scale = decode_image(buffer.getvalue(), max_side=200)
+        assert decoded.shape == (150, 200, 3)
+        assert scale == 0.5
+        assert tuple(decoded[75, 100]) == (0, 0, 255)
+
+    def test_pixel_budget_and_invalid(self):
+        """Test oversized and invalid uploads are rejected."""
+        from services.decode import decode_image, ImageDecodeError, ImageTooLargeError
+
+        contents = cv2.imencode(".png", np.zeros((100, 100, 3), dtype=np.uint8))[1].tobytes()
+        with pytest.raises(ImageTooLargeError):
+            decode_image(contents, max_pixels=5000)
+        with pytest.raises(ImageDecodeError):
+            decode_image(b"not an image")
+
+
+# ============================================================================
+# TEST RESULT CACHE
+# ============================================================================
+
+class TestResultCache:
+    """Test the /detect result cache."""
+
+    def test_hit_and_miss(self):
+        """Test hits and misses are counted."""
+        from services.cache import ResultCache
+
+        cache = ResultCache(max_entries=4, ttl_seconds=60, shared_dir=None)
+        assert cache.get("a") is None
+        cache.put("a", b"{}")
+        assert cache.get("a") == b"{}"
+
+        stats = cache.stats()
+        assert stats["hits"] == 1
+        assert stats["misses"] == 1
+        assert stats["hit_rate"] == 0.5
+
+    def test_lru_eviction(self):
+        """Test the least recently used entry is evicted first."""
+        from services.cache import ResultCache
+
+        cache = ResultCache(max_entries=2, ttl_seconds=60, shared_dir=None)
+        cache.put("a", b"1")
+        cache.put("b", b"2")
+        cache.get("a")
+        cache.put("c", b"3")
+        assert cache.get("b") is None
+        assert cache.get("a") == b"1"
+        assert cache.stats()["evictions"] == 1
+
+    def test_memory_cap_and_ttl(self):
+        """Test entries are bounded by bytes and expire after the TTL."""
+        import time
+        from services.cache import ResultCache
+
+        cache = ResultCache(max_entries=10, max_bytes=10, ttl_seconds=60, shared_dir=None)
+        cache.put("a", b"x" * 6)
+        cache.put("b", b"x" * 6)
+        assert cache.stats()["bytes"] <= 10
+        assert cache.get("a") is None
+
+        cache = ResultCache(max_entries=10, ttl_seconds=0.01, shared_dir=None)
+        cache.put("a", b"1")
+        time.sleep(0.02)
+        assert cache.get("a") is None
+
+    def test_shared_tier(self, tmp_path):
+        """Test a second cache (another worker) sees hits through the shared tier."""
+        from services.cache import ResultCache
+
+        first = ResultCache(ttl_seconds=60, shared_dir=str(tmp_path))
+        second = ResultCache(ttl_seconds=60, shared_dir=str(tmp_path))
+        first.put("key", b'{"success":true}')
+
+        assert second.get("key") == b'{"success":true}'
+        assert second.stats()["shared_hits"] == 1
+        assert second.get("key") == b'{"success":true}'
+        assert second.stats()["hits"] == 1
+
+    def test_shared_tier_names_and_expiry(self, tmp_path):
+        """Test shared files are named by a hash and keep their original expiry."""
+        import time
+        from services.cache import ResultCache
+
+        first = ResultCache(ttl_seconds=60, shared_dir=str(tmp_path))
+        first.put("abc:url:webp:80:single:json:0", b"{}")
+        (path,) = tmp_path.glob("*.json")
+        assert ":" not in path.name and "webp" not in path.name
+
+        # Written 59.8s ago: only 0.2s left in the second worker
+        os.utime(path, (time.time() - 59.8, time.time() - 59.8))
+        second = ResultCache(ttl_seconds=60, shared_dir=str(tmp_path))
+        assert second.get("abc:url:webp:80:single:json:0") == b"{}"
+        time.sleep(0.3)
+        assert second.get("abc:url:webp:80:single:json:0") is None
+
+    def test_perceptual_key_matches_reencoded_copy(self):
+        """Test re-encoded and resized copies of a photo map to the same perceptual key."""
+        from services.cache import PerceptualIndex, content_key
+
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        cv2.rectangle(image, (100, 100), (400, 300), (200, 180, 50), -1)
+        cv2.circle(image, (500, 350), 80, (30, 90, 220), -1)
+
+        png = cv2.imencode(".png", image)[1].tobytes()
+        jpeg = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 80])[1].tobytes()
+        reencoded = cv2.imdecode(np.frombuffer(jpeg, np.uint8), cv2.IMREAD_COLOR)
+        assert content_key(png) != content_key(jpeg)
+
+        index = PerceptualIndex(max_distance=5)
+        key, factor = index.match(image, (640, 480))
+        assert factor == 1.0
+        assert index.match(reencoded, (640, 480)) == (key, 1.0)
+        assert index.match(cv2.resize(image, (320, 240)), (320, 240)) == (key, 0.5)
+        assert index.match(cv2.flip(image, 1), (640, 480))[0] != key
+        assert index.match(image[:, :320], (320, 480))[0] != key
+
+    def test_perceptual_key_rejects_different_note(self):
+        """Test two different notes with the same layout do not share a perceptual key."""
+        from services.cache import PerceptualIndex, dhash
+
+        # Same design and pose, different colour (like two denominations of one series)
+        first = np.full((480, 640, 3), 40, dtype=np.uint8)
+        cv2.rectangle(first, (80, 120), (560, 360), (60, 160, 60), -1)
+        cv2.circle(first, (200, 240), 60, (30, 90, 30), -1)
+        second = np.clip(first.astype(np.float32) * [1.6, 0.5, 2.2], 0, 255).astype(np.uint8)
+        assert bin(dhash(first) ^ dhash(second)).count("1") <= 5
+
+        index = PerceptualIndex(max_distance=5)
+        key, _ = index.match(first, (640, 480))
+        other, factor = index.match(second, (640, 480))
+        assert other != key and factor == 1.0
+        assert index.match(first, (640, 480))[0] == key
+        assert index.match(second, (640, 480))[0] == other
+
+    def test_rescale_cached_boxes(self):
+        """Test cached boxes are scaled for a copy at another resolution."""
+        from services.serialization import compact_payload, deserialize, rescale_boxes, serialize
+
+        payload = {"success": True, "detections": [{"class_name": "10_coin", "bbox": [10, 20, 30, 40]}]}
+        body = rescale_boxes(serialize(payload)[0], "json", 0.5)
+        assert deserialize(body)["detections"][0]["bbox"] == [5, 10, 15, 20]
+
+        body = rescale_boxes(serialize(compact_payload(payload))[0], "json", 2.0)
+        assert deserialize(body)["d"][0]["b"] == [20, 40, 60, 80]
+
+
+# ============================================================================
+# TEST LIVE STREAM
+# ============================================================================
+
+class TestStream:
+    """Test the WebSocket live-camera stream."""
+
+    def test_latest_frame_wins(self):
+        """Test stale frames are dropped and only the newest one is returned."""
+        import asyncio
+        from services.stream import LatestFrameSlot
+
+        async def scenario():
+            slot = LatestFrameSlot()
+            slot.put(b"1")
+            slot.put(b"2")
+            slot.put(b"3")
+            seq, data, _ = await slot.get()
+            slot.close()
+            return seq, data, await slot.get(), slot.stats()
+
+        seq, data, after_close, stats = asyncio.run(scenario())
+        assert (seq, data) == (3, b"3")
+        assert after_close is None
+        assert stats == {"received": 3, "dropped": 2}
+
+    def test_compact_result(self):
+        """Test stream results carry no crops and rounded boxes."""
+        from services.stream import compact_result
+
+        result = {
+            "success": True,
+            "type": "note",
+            "detections": [{"class_name": "10_note", "confidence": 0.91234,
+                            "bbox": [10.4, 20.6, 100.2, 200.9]}],
+        }
+        compact = compact_result(7, result, 0.0123, 2)
+        assert compact["seq"] == 7
+        assert compact["detections"] == [
+            {"class_name": "10_note", "confidence": 0.912, "bbox": [10, 21, 100, 201]}
+        ]
+        assert compact["latency_ms"] == 12.3
+        assert "image" not in compact["detections"][0]
+
+    def test_stream_endpoint(self, client, image_bytes):
+        """Test frames sent over the socket get results on the same socket."""
+        with client.websocket_connect("/ws/detect") as websocket:
+            websocket.send_bytes(image_bytes.getvalue())
+            result = websocket.receive_json()
+            assert result["seq"] == 1
+            assert "success" in result
+
+            websocket.send_bytes(b"not an image")
+            result = websocket.receive_json()
+            assert result["success"] is False
+            assert result["error"] == "Invalid image file"
+
+    def test_stream_rejects_text_frames(self):
+        """Test text messages get an error and the socket keeps working."""
+        from fastapi.testclient import TestClient
+        from main import app
+
+        # No lifespan: no frame reaches the models, so they are not loaded
+        with TestClient(app).websocket_connect("/ws/detect") as websocket:
+            websocket.send_text("hello")
+            result = websocket.receive_json()
+            assert result == {"success": False, "error": "Expected binary image frames"}
+
+            websocket.send_bytes(b"not an image")
+            result = websocket.receive_json()
+            assert result["seq"] == 1
+            assert result["error"] == "Invalid image file"
+
+
+class TestTracking:
+    """Test keyframe-based tracking for the live stream."""
+
+    @staticmethod
+    def _frame(x, y):
+        rng = np.random.default_rng(0)
+        frame = np.full((480, 640, 3), 90, dtype=np.uint8)
+        patch = rng.integers(0, 255, (120, 200, 3), dtype=np.uint8)
+        frame[y:y + 120, x:x + 200] = cv2.GaussianBlur(patch, (5, 5), 0)
+        return frame
+
+    @staticmethod
+    def _detect_fn(calls):
+        def detect(image):
+            calls.append(1)
+            return {
+                "success": True,
+                "type": "note",
+                "detections": [{"class_name": "100_note", "class_id": 3, "confidence": 0.9,
+                                "bbox": [100.0, 100.0, 300.0, 220.0]}],
+            }
+        return detect
+
+    def test_tracks_between_keyframes(self):
+        """Test boxes follow a moving object without running the cascade."""
+        from services.tracking import FrameTracker
+
+        calls = []
+        tracker = FrameTracker(keyframe_interval=10, width=640)
+        detect = self._detect_fn(calls)
+
+        first = tracker.process(self._frame(100, 100), detect)
+        assert first["tracked"] is False
+
+        result = None
+        for step in range(1, 5):
+            result = tracker.process(self._frame(100 + 3 * step, 100), detect)
+
+        assert len(calls) == 1
+        assert result["tracked"] is True
+        assert result["detections"][0]["class_name"] == "100_note"
+        assert result["detections"][0]["track_id"] == first["detections"][0]["track_id"]
+        assert abs(result["detections"][0]["bbox"][0] - 112.0) < 3.0
+        assert tracker.stats()["tracked_frames"] == 4
+
+    def test_keyframe_interval_and_lost_track(self):
+        """Test the cascade runs again after the interval and when the object is lost."""
+        from services.tracking import FrameTracker
+
+        calls = []
+        tracker = FrameTracker(keyframe_interval=3, width=640)
+        detect = self._detect_fn(calls)
+
+        for _ in range(4):
+            tracker.process(self._frame(100, 100), detect)
+        assert len(calls) == 2
+        assert tracker.stats()["keyframe_reasons"]["interval"] == 1
+
+        tracker.process(np.full((480, 640, 3), 90, dtype=np.uint8), detect)
+        assert len(calls) == 3
+
+    def test_keyframe_on_low_confidence_and_drift(self):
+        """Test uncertain detections and drifting tracks send frames to the cascade."""
+        from services.tracking import FrameTracker
+
+        calls = []
+        detect = self._detect_fn(calls)
+
+        def uncertain(image):
+            result = detect(image)
+            result["detections"][0]["confidence"] = 0.4
+            return result
+
+        tracker = FrameTracker(keyframe_interval=10, min_confidence=0.6, width=640)
+        for _ in range(3):
+            tracker.process(self._frame(100, 100), uncertain)
+        assert len(calls) == 3
+        assert tracker.stats()["keyframe_reasons"]["low_confidence"] == 2
+
+        calls.clear()
+        tracker = FrameTracker(keyframe_interval=10, max_fb_error=0.005, width=640)
+        tracker.process(self._frame(100, 100), detect)
+        assert tracker.process(self._frame(103, 100), detect)["tracked"] is True
+
+        # Noise on the object only: the background is unchanged, the points track worse
+        noisy = self._frame(106, 100).astype(np.int16)
+        noisy[100:220, 106:306] += np.random.default_rng(1).integers(-20, 20, (120, 200, 3))
+        tracker.process(np.clip(noisy, 0, 255).astype(np.uint8), detect)
+        assert len(calls) == 2
+        assert tracker.stats()["keyframe_reasons"] == {"first": 1, "drift": 1}
+
+
+class TestSceneGate:
+    """Test the scene-change gate in front of the models."""
+
+    def test_reuses_result_for_still_scene(self):
+        """Test near-identical frames return the previous result."""
+        from services.scene_gate import SceneGate
+
+        gate = SceneGate(threshold=4.0, max_reuse=10)
+        frame = np.full((480, 640, 3), 120, dtype=np.uint8)
+        cv2.rectangle(frame, (100, 100), (300, 250), (0, 0, 0), -1)
+
+        assert gate.check(frame) is None
+        gate.update({"success": True, "type": "note", "detections": []})
+
+        noisy = cv2.add(frame, np.full_like(frame, 2))
+        reused = gate.check(noisy)
+        assert reused["success"] is True
+        assert reused["gated"] is True
+
+        moved = np.full((480, 640, 3), 120, dtype=np.uint8)
+        cv2.rectangle(moved, (300, 200), (500, 350), (0, 0, 0), -1)
+        assert gate.check(moved) is None
+
+        stats = gate.stats()
+        assert stats["checks"] == 3
+        assert stats["model_calls_saved"] == 1
+
+    def test_max_reuse(self):
+        """Test the models run again after max_reuse skipped frames."""
+        from services.scene_gate import SceneGate
+
+        gate = SceneGate(max_reuse=2)
+        frame = np.zeros((64, 64, 3), dtype=np.uint8)
+
+        assert gate.check(frame) is None
+        gate.update({"success": False})
+        assert gate.check(frame) is not None
+        assert gate.check(frame) is not None
+        assert gate.check(frame) is None
+
+    def test_registry_sessions(self):
+        """Test sessions are separate and evicted counters are kept."""
+        from services.scene_gate import SceneGateRegistry
+
+        registry = SceneGateRegistry(max_sessions=1)
+        frame = np.zeros((64, 64, 3), dtype=np.uint8)
+
+        first = registry.get("a")
+        first.check(frame)
+        first.update({"success": False})
+        first.check(frame)
+
+        assert registry.get("b") is not first
+        stats = registry.stats()
+        assert stats["sessions"] == 1
+        assert stats["checks"] == 2
+        assert stats["model_calls_saved"] == 1
+
+
+class TestCrops:
+    """Test lazy crop delivery."""
+
+    def test_crop_store_generates_on_demand(self):
+        """Test crops are extracted and encoded only when requested, then reused."""
+        from services.crops import CropStore
+
+        store = CropStore(max_requests=4, ttl_seconds=60)
+        image = np.full((400, 600, 3), 128, dtype=np.uint8)
+        store.put("img", image, [([100, 100, 300, 250], "note"), ([350, 100, 450, 200], "coin")])
+        assert store.stats()["generated"] == 0
+
+        body, media_type = store.get("img", 0, "webp", 80)
+        assert media_type == "image/webp"
+        assert store.get("img", 0, "webp", 80)[0] == body
+        assert store.stats()["generated"] == 1
+        assert store.get("img", 5) is None
+        assert store.get("missing", 0) is None
+
+    def test_crop_store_shared_between_workers(self, tmp_path):
+        """Test a crop link works in a worker that did not handle the request."""
+        from services.crops import CropStore
+
+        first = CropStore(ttl_seconds=60, shared_dir=str(tmp_path))
+        second = CropStore(ttl_seconds=60, shared_dir=str(tmp_path))
+        image = np.full((400, 600, 3), 128, dtype=np.uint8)
+        labels = [{"class_name": "10_note", "confidence": np.float32(0.9)}]
+        first.put("img", image, [([100, 100, 300, 250], "note")], labels)
+
+        assert second.get("img", 0, "png", 80) == first.get("img", 0, "png", 80)
+        assert second.grid("img") is not None
+        assert second.stats()["shared_hits"] == 1
+        assert CropStore(ttl_seconds=60).get("img", 0) is None
+
+    def test_coin_alpha_never_jpeg(self):
+        """Test crops with alpha fall back to PNG instead of JPEG."""
+        from services.crops import encode_crop
+
+        bgra = np.zeros((50, 50, 4), dtype=np.uint8)
+        _, media_type = encode_crop(bgra, "jpeg", 80)
+        assert media_type == "image/png"
+        _, media_type = encode_crop(bgra[:, :, :3], "jpeg", 80)
+        assert media_type == "image/jpeg"
+
+    def test_crop_store_ttl_and_lru(self):
+        """Test crops expire and old requests are evicted."""
+        import time
+        from services.crops import CropStore
+
+        image = np.zeros((10, 10, 3), dtype=np.uint8)
+        store = CropStore(max_requests=1, ttl_seconds=60)
+        store.put("a", image, [([0, 0, 5, 5], "note")])
+        store.put("b", image, [([0, 0, 5, 5], "note")])
+        assert not store.contains("a")
+        assert store.contains("b")
+
+        store = CropStore(ttl_seconds=0.01)
+        store.put("a", image, [([0, 0, 5, 5], "note")])
+        time.sleep(0.02)
+        assert not store.contains("a")
+
+    def test_negotiate_format(self):
+        """Test the crop format comes from the query or the Accept header."""
+        from services.crops import negotiate_format
+
+        assert negotiate_format(None, "JPG") == "jpeg"
+        assert negotiate_format("image/webp,image/*", None) == "webp"
+        assert negotiate_format("image/jpeg", None) == "jpeg"
+        with pytest.raises(ValueError):
+            negotiate_format(None, "gif")
+
+    def test_crop_grid(self):
+        """Test all crops of a request come back as one labelled JPEG."""
+        from services.crops import CropStore
+
+        store = CropStore(ttl_seconds=60)
+        image = np.full((400, 600, 3), 128, dtype=np.uint8)
+        labels = [
+            {"class_name": "10_note", "confidence": 0.9},
+            {"class_name": "5_coin", "confidence": 0.8},
+        ]
+        store.put("img", image, [([100, 100, 300, 250], "note"), ([350, 100, 450, 200], "coin")], labels)
+
+        body, media_type = store.grid("img", 85, 3)
+        assert media_type == "image/jpeg"
+        grid = cv2.imdecode(np.frombuffer(body, np.uint8), cv2.IMREAD_COLOR)
+        assert grid.shape == (300, 600, 3)
+        assert store.grid("img", 85, 3)[0] == body
+        assert store.grid("missing") is None
+
+    def test_restore_crops_from_cached_response(self):
+        """Test a cached response from another worker repopulates this process's crop store."""
+        import main
+        from services.serialization import compact_payload, serialize
+
+        image = np.full((400, 600, 3), 128, dtype=np.uint8)
+        payload = {
+            "success": True,
+            "type": "note",
+            "detections": [{"id": 0, "class_name": "10_note", "confidence": 0.9,
+                            "bbox": [200, 200, 600, 500], "image_url": "/crops/shared/0"}],
+        }
+        body = serialize(compact_payload(payload))[0]
+
+        main.restore_crops("shared", image, 0.5, body, "json")
+        assert main.crop_store.contains("shared")
+        crop, media_type = main.crop_store.get("shared", 0, "png")
+        decoded = cv2.imdecode(np.frombuffer(crop, np.uint8), cv2.IMREAD_UNCHANGED)
+        assert decoded.shape[:2] == (170, 220)  # (100, 100, 300, 250) + padding 10
+
+    def test_crop_links_in_response(self, client, image_bytes):
+        """Test /detect returns crop links that can be fetched."""
+        files = {"file": ("test.jpg", image_bytes, "image/jpeg")}
+        result = client.post("/detect", files=files).json()
+        for det in result["detections"]:
+            assert "image" not in det
+            response = client.get(det["image_url"], params={"format": "jpeg"})
+            assert response.status_code == 200
+            assert response.headers["content-type"] in ("image/jpeg", "image/png")
+
+        assert client.get("/crops/missing/0").status_code == 404
+
+
+class TestSerialization:
+    """Test the compact wire format."""
+
+    def test_compact_payload(self):
+        """Test short keys, integer boxes and no null fields."""
+        from services.serialization import compact_payload
+
+        payload = {
+            "success": True,
+            "type": "note",
+            "detections": [{"id": 0, "class_name": "100_note", "confidence": 0.91234,
+                            "bbox": [10.4, 20.6, 100.2, 200.9], "image_url": "/crops/a/0"}],
+            "count": 1,
+            "tts_text": "text",
+            "tts_audio": None,
+        }
+        compact = compact_payload(payload)
+        assert compact == {
+            "ok": True,
+            "t": "note",
+            "d": [{"i": 0, "c": "100_note", "p": 0.912, "b": [10, 21, 100, 201], "u": "/crops/a/0"}],
+            "n": 1,
+            "s": "text",
+        }
+
+    def test_serialize_json_and_compress(self):
+        """Test JSON round-trips and large bodies are gzip-compressed."""
+        import gzip
+        import json
+        from services.serialization import serialize, compress
+
+        payload = {"success": True, "tts_text": "Детектирана банкнота", "detections": []}
+        body, media_type = serialize(payload, "json")
+        assert media_type == "application/json"
+        assert json.loads(body) == payload
+
+        assert compress(body, "gzip")[1] is None
+        large = body * 200
+        compressed, encoding = compress(large, "gzip, deflate")
+        assert encoding == "gzip"
+        assert gzip.decompress(compressed) == large
+        assert compress(large, None)[1] is None
+
+    def test_msgpack_negotiation(self):
+        """Test MessagePack is chosen from the Accept header when available."""
+        from services import serialization
+
+        assert serialization.negotiate_wire_format("application/json") == "json"
+        if serialization.msgpack is None:
+            assert serialization.negotiate_wire_format("application/msgpack") == "json"
+            return
+
+        assert serialization.negotiate_wire_format("application/msgpack") == "msgpack"
+        body, media_type = serialization.serialize({"ok": True}, "msgpack")
+        assert media_type == "application/msgpack"
+        assert serialization.msgpack.unpackb(body) == {"ok": True}
+
+    def test_compact_endpoint(self, client, image_bytes):
+        """Test /detect in compact mode."""
+        files = {"file": ("test.jpg", image_bytes, "image/jpeg")}
+        response = client.post("/detect?compact=true", files=files)
+        assert response.status_code == 200
+        result = response.json()
+        assert "ok" in result
+        assert "tts_audio" not in result
+
 
 # ============================================================================
 # TEST EXTRACTION
@@ -248,6 +1561,19 @@ class TestExtraction:
         assert grid.shape[0] == 300  # 1 row
         assert grid.shape[1] == 600  # 2 cols
 
+    def test_create_display_grid_alpha(self):
+        """Test coin crops are composited onto white by their alpha."""
+        from services.extraction import create_display_grid
+
+        coin = np.zeros((100, 100, 4), dtype=np.uint8)
+        coin[:, :50, 3] = 255  # left half opaque black, right half transparent
+
+        grid = create_display_grid([coin], [{'class_name': '5_coin', 'confidence': 0.9}],
+                                   grid_cols=1, cell_size=(300, 300))
+        # 100x100 -> 240x240 centered in the 300x300 cell
+        assert (grid[100, 40:140] == 0).all()
+        assert (grid[100, 160:265] == 255).all()
+
     def test_remove_background_circular(self):
         """Test circular background removal."""
         from services.extraction import remove_background_circular
@@ -269,6 +1595,37 @@ class TestExtraction:
         assert enhanced.shape == image.shape
         assert enhanced.shape[2] == 3  # BGR
 
+    def test_extract_batch(self):
+        """Test batch extraction returns one crop per region, clipped to the image."""
+        from services.extraction import extract_batch
+
+        image = np.ones((640, 480, 3), dtype=np.uint8) * 200
+        regions = [
+            ([100, 100, 200, 200], 'coin'),
+            ([250, 100, 470, 250], 'note'),
+            ([-20, -20, 60, 60], 'note'),
+        ]
+
+        extracted = extract_batch(image, regions)
+        assert len(extracted) == 3
+        assert extracted[0].shape[2] == 4
+        assert extracted[1].shape == (170, 240, 3)
+        assert extracted[2].shape == (70, 70, 3)
+
+    def test_find_coin_circle(self):
+        """Test the downscaled circle search maps back to crop coordinates."""
+        from services.extraction import find_coin_circle
+
+        image = np.full((400, 400, 3), 40, dtype=np.uint8)
+        cv2.circle(image, (200, 210), 150, (220, 220, 220), -1)
+
+        circle = find_coin_circle(image)
+        assert circle is not None
+        cx, cy, r = circle
+        assert abs(cx - 200) < 15
+        assert abs(cy - 210) < 15
+        assert abs(r - 150) < 20
+
 
 # ============================================================================
 # TEST API ENDPOINTS
@@ -291,6 +1648,54 @@ class TestAPIEndpoints:
         data = response.json()
         assert data["status"] == "healthy"
         assert "device" in data
+        assert "stage" in data
+
+    def test_health_fails_after_failed_startup(self, monkeypatch):
+        """Test liveness turns red when loading the models failed."""
+        import main
+
+        monkeypatch.setattr(main, "startup_stage", "failed")
+        monkeypatch.setattr(main, "startup_error", "Model not found")
+        response = TestClient(main.app).get("/health")
+        assert response.status_code == 503
+        assert response.json()["status"] == "unhealthy"
+
+    def test_lost_worker_is_retryable(self, monkeypatch):
+        """Test a lost inference worker answers 503 + Retry-After, not 500."""
+        import main
+        from services.worker_pool import WorkerLostError
+
+        async def lost(image, mode="single"):
+            raise WorkerLostError("No inference worker available")
+
+        monkeypatch.setattr(main, "run_detection", lost)
+        image = np.random.randint(0, 255, (64, 64, 3), dtype=np.uint8)
+        response = TestClient(main.app).post(
+            "/detect/raw", content=cv2.imencode(".png", image)[1].tobytes(),
+            headers={"Content-Type": "image/png"},
+        )
+        assert response.status_code == 503
+        assert "Retry-After" in response.headers
+        assert response.json()["success"] is False
+
+    def test_invalid_image_detail_is_fixed(self):
+        """Test decode errors do not echo decoder internals to the client."""
+        import main
+
+        response = TestClient(main.app).post(
+            "/detect/raw", content=b"GIF89a not an image", headers={"Content-Type": "image/png"}
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"] == "Invalid image file"
+
+    def test_ready_endpoint(self, client):
+        """Test the readiness probe is green once the models are warmed up."""
+        response = client.get("/ready")
+        assert response.status_code == 200
+        data = response.json()
+        assert data["ready"] is True
+        assert data["stage"] == "ready"
+        assert data["startup_seconds"] > 0
 
     def test_detect_endpoint_success(self, client, image_bytes):
         """Test detect endpoint with valid image."""
@@ -302,6 +1707,86 @@ class TestAPIEndpoints:
         assert "type" in result
         assert "detections" in result
 
+    def test_detect_endpoint_mode_all(self, client, image_bytes):
+        """Test detect endpoint in mixed-scene mode."""
+        files = {"file": ("test.jpg", image_bytes, "image/jpeg")}
+        response = client.post("/detect?mode=all", files=files)
+        assert response.status_code == 200
+        assert "detections" in response.json()
+
+        files = {"file": ("test.jpg", image_bytes, "image/jpeg")}
+        response = client.post("/detect?mode=unknown", files=files)
+        assert response.status_code == 400
+
+    def test_detect_raw_endpoint(self, client, image_bytes):
+        """Test detection from a raw image body without multipart."""
+        response = client.post(
+            "/detect/raw", content=image_bytes.getvalue(), headers={"Content-Type": "image/jpeg"}
+        )
+        assert response.status_code == 200
+        assert "detections" in response.json()
+
+        response = client.post(
+            "/detect/raw", content=b"text", headers={"Content-Type": "text/plain"}
+        )
+        assert response.status_code == 415
+
+    def test_oversized_upload_rejected(self, client):
+        """Test uploads above the size limit are rejected."""
+        from core.config import MAX_IMAGE_SIZE, UPLOAD_OVERHEAD
+
+        body = b"\0" * (MAX_IMAGE_SIZE + UPLOAD_OVERHEAD + 1)
+        response = client.post(
+            "/detect/raw", content=body, headers={"Content-Type": "image/jpeg"}
+        )
+        assert response.status_code == 400
+        assert "too large" in response.json()["detail"]
+
+    def test_chunked_upload_limited(self):
+        """Test bodies without Content-Length are cut off at the limit."""
+        from fastapi import FastAPI, Request
+        from fastapi.testclient import TestClient
+        from main import UploadLimitMiddleware
+
+        app = FastAPI()
+        app.add_middleware(UploadLimitMiddleware, paths=("/upload",), limit=1000)
+
+        @app.post("/upload")
+        async def upload(request: Request):
+            return {"size": len(await request.body())}
+
+        def body(size):
+            for _ in range(size // 100):
+                yield b"x" * 100
+
+        with TestClient(app) as test_client:
+            response = test_client.post("/upload", content=body(500))
+            assert response.status_code == 200
+            assert response.json()["size"] == 500
+
+            response = test_client.post("/upload", content=body(2000))
+            assert response.status_code == 400
+            assert "too large" in response.json()["detail"]
+
+    def test_read_limited_stops_at_limit(self):
+        """Test chunked reads abort as soon as the limit is crossed."""
+        import asyncio
+        from fastapi import HTTPException
+        from main import read_limited
+
+        consumed = []
+
+        async def chunks():
+            for _ in range(10):
+                consumed.append(1)
+                yield b"x" * 100
+
+        assert asyncio.run(read_limited(chunks(), 1000)) == b"x" * 1000
+        consumed.clear()
+        with pytest.raises(HTTPException):
+            asyncio.run(read_limited(chunks(), 250))
+        assert len(consumed) == 3
+
     def test_detect_endpoint_no_file(self, client):
         """Test detect endpoint without file."""
         response = client.post("/detect")